@@ -1,7 +1,210 @@
-from django.contrib import admin
+"""
+Admin of the merchant, catalog and order tables, built for large tables.
 
-# Register your models here.
-from .models import Merchant
+- Lists are paginated by EstimatedCountPaginator, which never runs COUNT(*)
+  over a whole large table, and without the unfiltered "N total" count.
+- Related objects shown in lists are joined with list_select_related.
+- Foreign keys are edited with raw id or autocomplete widgets, not with
+  dropdowns of every row.
+- Stock and prices are changed by the restock and reprice actions, one UPDATE
+  for all the selected listings, which keep the product aggregates, the
+  stock baselines and the price history in step. Orders are read-only, they
+  are changed through the API.
+- Listings, orders and order lines cannot be deleted: deleting them would
+  skip the product aggregates, the change feed and the stock ledger.
+- The lines of an order are linked to, not listed inline: an order can have
+  thousands.
+"""
 
-# admin will create only merchant, then we'll have view where merchant can create Product and Listing
-admin.site.register(Merchant)
\ No newline at end of file
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from myapp import catalog, price_history, product_stats, writes
+from myapp.models import Listing, Merchant, Order, OrderLine, Product
+
+
+def estimated_count(model):
+    """Row count of the table of `model` from the database statistics, or
+    None when there are none"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table]
+            )
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == "sqlite":
+            try:
+                # Filled by ANALYZE, the first number is the row count
+                cursor.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]
+                )
+            except DatabaseError:  # never analyzed
+                return None
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting unfiltered tables of more than
+    ADMIN_PAGINATION["COUNT_LIMIT"] rows from the database statistics, and
+    filtered lists up to COUNT_LIMIT rows"""
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_PAGINATION["COUNT_LIMIT"]
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Field looked up when searching for a number
+    search_id_field = "pk"
+
+    def get_search_results(self, request, queryset, search_term):
+        # Through its index, search_fields only make LIKE scans
+        if search_term.strip().isdigit():
+            return queryset.filter(**{self.search_id_field: int(search_term)}), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Merchant)
+class MerchantAdmin(LargeTableAdmin):
+    list_display = ["id", "user"]
+    list_select_related = ["user"]
+    raw_id_fields = ["user"]
+    search_fields = ["=user__username"]
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ["id", "name", "listing_count", "min_price", "total_stock"]
+    search_fields = ["name"]
+    # Maintained by myapp.product_stats
+    readonly_fields = ["listing_count", "min_price", "total_stock"]
+
+
+class ListingActionForm(ActionForm):
+    quantity = forms.IntegerField(
+        required=False, min_value=1, help_text="Items received, to restock"
+    )
+    price = forms.DecimalField(
+        required=False,
+        min_value=0,
+        max_digits=8,
+        decimal_places=2,
+        help_text="New price, to reprice",
+    )
+
+
+@admin.register(Listing)
+class ListingAdmin(LargeTableAdmin):
+    list_display = ["id", "title", "product", "price", "quantity"]
+    list_select_related = ["product"]
+    search_fields = ["^title"]
+    autocomplete_fields = ["product"]
+    action_form = ListingActionForm
+    actions = ["restock", "reprice"]
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return ["stock_baseline"]
+        # Changes go through the actions, or attach-product for the product
+        return ["product", "price", "quantity", "stock_baseline"]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            product_stats.listing_added(obj)
+            price_history.record({obj.pk: obj.price})
+
+    def get_action_value(self, request, field):
+        form = self.action_form(request.POST)
+        form.fields["action"].choices = self.get_action_choices(request)
+        value = form.cleaned_data[field] if form.is_valid() else None
+        if value is None:
+            self.message_user(
+                request, "Set a valid {} for this action.".format(field), messages.ERROR
+            )
+        return value
+
+    @admin.action(description="Restock selected listings by the quantity")
+    def restock(self, request, queryset):
+        quantity = self.get_action_value(request, "quantity")
+        if quantity is None:
+            return
+        restocked = writes.write_queue.run(lambda: catalog.restock(queryset, quantity))
+        self.message_user(request, "{} listings restocked.".format(restocked))
+
+    @admin.action(description="Reprice selected listings at the price")
+    def reprice(self, request, queryset):
+        price = self.get_action_value(request, "price")
+        if price is None:
+            return
+        repriced = writes.write_queue.run(lambda: catalog.reprice(queryset, price))
+        self.message_user(request, "{} listings repriced.".format(repriced))
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ["id", "merchant", "creation_date", "status", "total"]
+    list_select_related = ["merchant__user"]
+    list_filter = ["status"]
+    search_fields = ["=merchant__user__username"]
+    readonly_fields = ["merchant", "creation_date", "status", "total", "lines"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("merchant__user")
+
+    @admin.display(description="Lines")
+    def lines(self, obj):
+        url = reverse("admin:myapp_orderline_changelist")
+        return format_html(
+            '<a href="{}?order__id__exact={}">Lines of this order</a>', url, obj.pk
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OrderLine)
+class OrderLineAdmin(LargeTableAdmin):
+    list_display = ["id", "order", "listing", "quantity", "unit_price"]
+    list_select_related = ["order", "listing"]
+    search_fields = ["^listing__title"]
+    search_id_field = "order_id"
+    readonly_fields = [
+        "order",
+        "listing",
+        "quantity",
+        "unit_price",
+        "returned_quantity",
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
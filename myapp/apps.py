@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        from myapp.events import bus
+        from myapp.matching import product_index
+
+        # Keep the product matching index in sync with the catalog
+        product = self.get_model("Product")
+        post_save.connect(product_index.product_saved, sender=product)
+        post_delete.connect(product_index.product_deleted, sender=product)
+
+        # Feed the listing changes to the server-sent events subscribers
+        post_save.connect(bus.listing_saved, sender=self.get_model("Listing"))
@@ -0,0 +1,84 @@
+"""
+Archiving of old orders.
+
+Orders older than ORDER_ARCHIVE["AGE_DAYS"] are moved with their lines to the
+ArchivedOrder and ArchivedOrderLine tables, keeping their ids, one chunk per
+transaction, so that the hot Order and OrderLine tables only hold the recent
+history that merchant queries and stock jobs actually need.
+
+Archiving never moves an order younger than AGE_DAYS, so orders created since
+`horizon()` are always in the hot tables: a read only needs the archive when
+its date range starts before the horizon, or has no start.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from myapp.models import ArchivedOrder, ArchivedOrderLine, Order, OrderLine
+
+ORDER_FIELDS = [
+    "id",
+    "merchant_id",
+    "creation_date",
+    "received_date",
+    "status",
+    "total",
+]
+LINE_FIELDS = [
+    "id",
+    "order_id",
+    "listing_id",
+    "quantity",
+    "unit_price",
+    "returned_quantity",
+]
+
+
+def horizon(now=None):
+    """Date before which orders may be archived"""
+    now = now or timezone.now()
+    return now - datetime.timedelta(days=settings.ORDER_ARCHIVE["AGE_DAYS"])
+
+
+def needs_archive(since):
+    """Whether orders created since `since` (None for all of them) may be
+    archived, whatever the end of the range"""
+    return since is None or since < horizon()
+
+
+def archive_chunk(order_ids):
+    """Move the orders `order_ids` and their lines to the archive tables"""
+    with transaction.atomic():
+        orders = Order.objects.filter(pk__in=order_ids)
+        lines = OrderLine.objects.filter(order_id__in=order_ids)
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**values) for values in orders.values(*ORDER_FIELDS)]
+        )
+        ArchivedOrderLine.objects.bulk_create(
+            [ArchivedOrderLine(**values) for values in lines.values(*LINE_FIELDS)],
+            batch_size=1000,
+        )
+        # Lines go with their orders
+        orders.delete()
+
+
+def archive(before=None, chunk_size=None):
+    """Archive the orders created before `before` (the horizon by default).
+    Yields the number of orders archived by each chunk."""
+    limit = horizon()
+    before = min(before or limit, limit)
+    chunk_size = chunk_size or settings.ORDER_ARCHIVE["CHUNK_SIZE"]
+
+    while True:
+        order_ids = list(
+            Order.objects.filter(creation_date__lt=before)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not order_ids:
+            return
+        archive_chunk(order_ids)
+        yield len(order_ids)
@@ -0,0 +1,127 @@
+"""
+Attaching listings to catalog products, and bulk changes of listings.
+
+`attach_products` handles any number of (listing, product) pairs with a number
+of queries set by the products, not the listings: the listings are loaded and
+the products checked, then each product costs one UPDATE per batch of its
+listings and one for its aggregates. Batches keep the id lists under SQLite's
+limit on query parameters.
+
+`restock` and `reprice` change any number of listings with one UPDATE, then
+keep the product aggregates, the price history and the change feed in step.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from myapp import events, price_history, product_stats
+from myapp.models import Listing, Product
+
+ATTACHED = "attached"
+LISTING_NOT_FOUND = "listing_not_found"
+PRODUCT_NOT_FOUND = "product_not_found"
+ALREADY_ATTACHED = "already_attached"
+
+# Ids bound by one query
+BATCH_SIZE = 500
+
+
+def attach_products(pairs):
+    """Attach products to listings given as {listing_id: product_id}.
+
+    A listing that already has a product is left untouched. Returns the
+    outcome of every listing as {listing_id: status}."""
+    with transaction.atomic():
+        listings = Listing.objects.only("id", "product_id", "price", "quantity")
+        listings = listings.in_bulk(list(pairs))
+        product_ids = list(set(pairs.values()))
+        products = set()
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            batch = product_ids[start : start + BATCH_SIZE]
+            products.update(
+                Product.objects.filter(pk__in=batch).values_list("pk", flat=True)
+            )
+
+        outcomes = {}
+        by_product = {}
+        for listing_id, product_id in pairs.items():
+            listing = listings.get(listing_id)
+            if listing is None:
+                outcomes[listing_id] = LISTING_NOT_FOUND
+            elif product_id not in products:
+                outcomes[listing_id] = PRODUCT_NOT_FOUND
+            elif listing.product_id is not None:
+                outcomes[listing_id] = ALREADY_ATTACHED
+            else:
+                by_product.setdefault(product_id, []).append(listing)
+
+        for product_id, listings in by_product.items():
+            attached = []
+            for start in range(0, len(listings), BATCH_SIZE):
+                batch = listings[start : start + BATCH_SIZE]
+                ids = [listing.pk for listing in batch]
+                # The product__isnull guard enforces the rule against concurrent
+                # attaches
+                updated = Listing.objects.filter(
+                    pk__in=ids, product__isnull=True
+                ).update(product_id=product_id)
+                if updated != len(ids):
+                    won = set(
+                        Listing.objects.filter(
+                            pk__in=ids, product_id=product_id
+                        ).values_list("pk", flat=True)
+                    )
+                    for listing in batch:
+                        if listing.pk not in won:
+                            outcomes[listing.pk] = ALREADY_ATTACHED
+                    batch = [listing for listing in batch if listing.pk in won]
+                attached.extend(batch)
+            if not attached:
+                continue
+
+            for listing in attached:
+                outcomes[listing.pk] = ATTACHED
+            product_stats.listings_added(
+                product_id,
+                len(attached),
+                sum(listing.quantity for listing in attached),
+                min(listing.price for listing in attached),
+            )
+
+    return outcomes
+
+
+def restock(listings, quantity):
+    """Receive `quantity` more items on every listing of the queryset
+    `listings`. Returns the number of listings restocked."""
+    with transaction.atomic():
+        per_product = (
+            listings.exclude(product=None)
+            .order_by()
+            .values("product_id")
+            .annotate(count=Count("id"))
+            .values_list("product_id", "count")
+        )
+        deltas = {pk: count * quantity for pk, count in per_product}
+        restocked = listings.update(
+            quantity=F("quantity") + quantity,
+            stock_baseline=F("stock_baseline") + quantity,
+        )
+        product_stats.stock_changed(deltas)
+        events.bus.publish_on_commit(listings.values_list("pk", flat=True))
+    return restocked
+
+
+def reprice(listings, price):
+    """Set the price of every listing of the queryset `listings`. Returns the
+    number of listings whose price changed."""
+    with transaction.atomic():
+        changed = list(listings.exclude(price=price).values_list("pk", "product_id"))
+        if not changed:
+            return 0
+        Listing.objects.filter(pk__in=[pk for pk, _ in changed]).update(price=price)
+        # A higher price may change the cheapest listing, recompute
+        product_stats.refresh({product_id for _, product_id in changed if product_id})
+        price_history.record({pk: price for pk, _ in changed})
+        events.bus.publish_on_commit([pk for pk, _ in changed])
+    return len(changed)
@@ -0,0 +1,147 @@
+"""
+In-process bus of listing stock and price changes, feeding the SSE endpoint.
+
+Writers only publish the ids of the listings they changed, once their
+transaction is committed: Listing saves through a post_save signal, order
+stock decrements and restocks explicitly since they are bulk UPDATEs. Nothing
+is done for listings nobody subscribed to.
+
+A single pump task per process, running in the event loop of the ASGI server,
+reads the current quantity and price of the changed listings with one query
+and pushes them to their subscriptions. The pump runs at most
+LISTING_EVENTS["RATE"] times per second, so changes of a hot listing in
+between are coalesced into one event carrying its latest state.
+"""
+
+import asyncio
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from myapp.models import Listing
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_listings(listing_ids):
+    return list(
+        Listing.objects.filter(pk__in=listing_ids)
+        .order_by()
+        .values_list("id", "quantity", "price")
+    )
+
+
+class Subscription:
+    """Changes of some listings waiting to be sent to one client"""
+
+    def __init__(self, listing_ids):
+        self.listing_ids = listing_ids
+        self.pending = {}
+        self.sent = {}
+        self.ready = asyncio.Event()
+
+    def push(self, listing_id, quantity, price):
+        # Only called from the event loop, by the pump
+        if self.sent.get(listing_id) == (quantity, price):
+            return
+        self.pending[listing_id] = (quantity, price)
+        self.ready.set()
+
+    async def get(self, timeout):
+        """Wait up to `timeout` seconds for changes and return them as
+        (listing_id, quantity, price) tuples, or [] on timeout"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        changes, self.pending = self.pending, {}
+        self.sent.update(changes)
+        return [(pk, quantity, price) for pk, (quantity, price) in changes.items()]
+
+
+class ChangeBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.dirty = set()
+        self.loop = None
+        self.wakeup = None
+        self.pump = None
+
+    def publish(self, listing_ids):
+        """Mark listings as changed, callable from any thread"""
+        with self.lock:
+            listing_ids = [pk for pk in listing_ids if pk in self.subscriptions]
+            if not listing_ids:
+                return
+            self.dirty.update(listing_ids)
+            loop, wakeup = self.loop, self.wakeup
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:  # the loop of the server was closed
+            pass
+
+    def publish_on_commit(self, listing_ids):
+        if self.subscriptions:
+            listing_ids = list(listing_ids)
+            transaction.on_commit(lambda: self.publish(listing_ids))
+
+    def listing_saved(self, sender, instance, **kwargs):
+        self.publish_on_commit([instance.pk])
+
+    async def subscribe(self, listing_ids):
+        """Subscribe to the changes of `listing_ids`, starting with their
+        current state"""
+        subscription = Subscription(listing_ids)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            for pk in listing_ids:
+                self.subscriptions.setdefault(pk, set()).add(subscription)
+            if self.loop is not loop or self.pump.done():
+                self.loop, self.wakeup = loop, asyncio.Event()
+                self.pump = loop.create_task(self.run())
+        self.publish(listing_ids)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for pk in subscription.listing_ids:
+                subscriptions = self.subscriptions.get(pk)
+                if subscriptions is None:
+                    continue
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[pk]
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                listing_ids, self.dirty = self.dirty, set()
+
+            try:
+                rows = await sync_to_async(fetch_listings)(listing_ids)
+            except Exception:
+                logger.exception(
+                    "Cannot read the changes of %d listings", len(listing_ids)
+                )
+                rows = []
+
+            with self.lock:
+                targets = [
+                    (row, list(self.subscriptions.get(row[0], ()))) for row in rows
+                ]
+            for (pk, quantity, price), subscriptions in targets:
+                for subscription in subscriptions:
+                    subscription.push(pk, quantity, price)
+
+            # Changes published meanwhile are sent together on the next round
+            await asyncio.sleep(1 / settings.LISTING_EVENTS["RATE"])
+
+
+bus = ChangeBus()
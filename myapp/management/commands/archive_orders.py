@@ -0,0 +1,41 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the orders older than ORDER_ARCHIVE['AGE_DAYS'] days, and their "
+        "lines, to the archive tables, one chunk per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ORDER_ARCHIVE["AGE_DAYS"],
+            help="Archive orders older than this, at least AGE_DAYS",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.ORDER_ARCHIVE["CHUNK_SIZE"]
+        )
+
+    def handle(self, *args, **options):
+        # Reads only look in the archive before the horizon, archiving younger
+        # orders would hide them
+        if options["days"] < settings.ORDER_ARCHIVE["AGE_DAYS"]:
+            raise CommandError(
+                "--days must be at least {}".format(settings.ORDER_ARCHIVE["AGE_DAYS"])
+            )
+
+        before = timezone.now() - datetime.timedelta(days=options["days"])
+        archived = 0
+        for count in archive.archive(before, chunk_size=options["chunk_size"]):
+            archived += count
+            self.stdout.write("{} orders archived".format(archived))
+
+        self.stdout.write(self.style.SUCCESS("{} orders archived".format(archived)))
@@ -0,0 +1,84 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from myapp import stock_audit
+from myapp.models import Listing
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the quantity of every listing against its stock baseline minus "
+        "what its order lines sold, by ranges of listing ids, and optionally "
+        "correct the quantities that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Audit the chunks in this many worker processes",
+        )
+        parser.add_argument(
+            "--repair", action="store_true", help="Save the expected quantities"
+        )
+
+    def handle(self, *args, **options):
+        bounds = Listing.objects.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            self.stdout.write(self.style.SUCCESS("No listing to audit"))
+            return
+
+        chunk_size = options["chunk_size"]
+        chunks = [
+            (start, start + chunk_size)
+            for start in range(bounds["first"], bounds["last"] + 1, chunk_size)
+        ]
+
+        if options["workers"] > 1:
+            # Forked workers must open their own database connections
+            connections.close_all()
+            context = multiprocessing.get_context("fork")
+            with context.Pool(options["workers"]) as pool:
+                drifted = self.report(
+                    pool.imap(stock_audit.audit_chunk, chunks), options["repair"]
+                )
+        else:
+            drifted = self.report(
+                map(stock_audit.audit_chunk, chunks), options["repair"]
+            )
+
+        action = "repaired" if options["repair"] else "drifted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{} chunks audited, {} listings {}".format(len(chunks), drifted, action)
+            )
+        )
+
+    def report(self, results, repair):
+        # Audits may run in the workers, repairs are written by this process
+        drifted = 0
+        for discrepancies in results:
+            if repair and discrepancies:
+                discrepancies = stock_audit.repair(
+                    [listing_id for listing_id, _, _ in discrepancies]
+                )
+            drifted += len(discrepancies)
+            for listing_id, quantity, expected in discrepancies:
+                if expected is None:
+                    self.stdout.write(
+                        "listing #{}: quantity={} no baseline".format(
+                            listing_id, quantity
+                        )
+                    )
+                else:
+                    self.stdout.write(
+                        "listing #{}: quantity={} expected={}".format(
+                            listing_id, quantity, expected
+                        )
+                    )
+        return drifted
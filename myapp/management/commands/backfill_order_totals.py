@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from myapp import order_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the unit prices and totals of the orders created before they were "
+        "captured, from the current listing prices, chunk by chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = 0
+        for count in order_totals.backfill(chunk_size=options["chunk_size"]):
+            updated += count
+            self.stdout.write("{} orders backfilled".format(updated))
+
+        self.stdout.write(self.style.SUCCESS("{} orders backfilled".format(updated)))
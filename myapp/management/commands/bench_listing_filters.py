@@ -0,0 +1,124 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from myapp.models import Listing, Product
+
+BENCH_TITLE = "bench listing"
+BENCH_PRODUCT = "bench product"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the listing filters, sorting and facets on a large table. "
+        "Synthetic listings are created in the configured database if needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--listings", type=int, default=1_000_000)
+        parser.add_argument("--products", type=int, default=1_000)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the synthetic rows at the end",
+        )
+
+    def handle(self, *args, **options):
+        self.populate(options["listings"], options["products"], options["batch_size"])
+
+        product_id = (
+            Product.objects.filter(name=BENCH_PRODUCT)
+            .values_list("id", flat=True)
+            .first()
+        )
+        in_stock_by_price = Listing.objects.filter(
+            quantity__gt=0, price__gte=100, price__lte=250
+        ).order_by("price", "id")
+        by_product = Listing.objects.filter(product_id=product_id).order_by(
+            "price", "id"
+        )
+
+        def facets():
+            return Listing.objects.filter(quantity__gt=0).aggregate(
+                count=Count("id"),
+                cheap=Count("id", filter=Q(price__lt=100)),
+                mid=Count("id", filter=Q(price__gte=100, price__lt=500)),
+                expensive=Count("id", filter=Q(price__gte=500)),
+            )
+
+        cases = [
+            (
+                "in stock, price between, sorted by price (first 50)",
+                lambda: list(in_stock_by_price[:50]),
+            ),
+            ("count in stock and price between", in_stock_by_price.count),
+            ("product sorted by price (first 50)", lambda: list(by_product[:50])),
+            ("facet counts by price bucket", facets),
+        ]
+        self.stdout.write("facets: {}".format(facets()))
+        for name, case in cases:
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                case()
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            self.stdout.write(
+                "{:<55} best {:8.2f} ms  median {:8.2f} ms".format(
+                    name, timings[0] * 1000, timings[len(timings) // 2] * 1000
+                )
+            )
+
+        self.stdout.write("\nQuery plans:")
+        self.stdout.write(in_stock_by_price[:50].explain())
+        self.stdout.write(by_product[:50].explain())
+
+        if options["cleanup"]:
+            Listing.objects.filter(title=BENCH_TITLE).delete()
+            Product.objects.filter(name=BENCH_PRODUCT).delete()
+
+    def populate(self, listings, products, batch_size):
+        missing = listings - Listing.objects.filter(title=BENCH_TITLE).count()
+        if missing <= 0:
+            return
+        self.stdout.write("Creating {} synthetic listings...".format(missing))
+
+        product_ids = list(
+            Product.objects.filter(name=BENCH_PRODUCT).values_list("id", flat=True)
+        )
+        if len(product_ids) < products:
+            Product.objects.bulk_create(
+                [
+                    Product(name=BENCH_PRODUCT)
+                    for _ in range(products - len(product_ids))
+                ]
+            )
+            product_ids = list(
+                Product.objects.filter(name=BENCH_PRODUCT).values_list("id", flat=True)
+            )
+
+        rng = random.Random(42)
+        while missing > 0:
+            size = min(batch_size, missing)
+            listings = []
+            for _ in range(size):
+                # roughly a third of the catalog is out of stock
+                quantity = max(0, rng.randrange(-10, 20))
+                listings.append(
+                    Listing(
+                        product_id=rng.choice(product_ids),
+                        title=BENCH_TITLE,
+                        price=Decimal(rng.randrange(100, 200_000)) / 100,
+                        quantity=quantity,
+                        stock_baseline=quantity,
+                    )
+                )
+            with transaction.atomic():
+                Listing.objects.bulk_create(listings, batch_size=batch_size)
+            missing -= size
@@ -0,0 +1,162 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from myapp import writes
+from myapp.models import Listing, Merchant, Order
+from myapp.views import ListingViewSet, OrderAPIView
+
+BENCH_TITLE = "bench order listing"
+BENCH_USER = "bench-orders"
+
+# Stock Django sqlite3: deferred transactions, 5s timeout, rollback journal
+STOCK_OPTIONS = {}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent order and listing writes on the configured SQLite "
+        "database: stock sqlite3 settings, then the tuned connection OPTIONS, "
+        "then the tuned OPTIONS with the group-commit write queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--writes", type=int, default=100, help="Per thread")
+        parser.add_argument("--listings", type=int, default=20)
+        parser.add_argument(
+            "--modes", default="stock,tuned,group", help="Comma separated"
+        )
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the synthetic rows at the end",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite" or connection.is_in_memory_db():
+            raise CommandError("Expected a SQLite database file")
+
+        tuned = connection.settings_dict["OPTIONS"]
+        journal_mode = tuned.get("pragmas", {}).get("journal_mode", "DELETE")
+        modes = {
+            "stock": (STOCK_OPTIONS, "DELETE", False),
+            "tuned": (tuned, journal_mode, False),
+            "group": (tuned, journal_mode, True),
+        }
+        names = options["modes"].split(",")
+        if not set(names) <= set(modes):
+            raise CommandError("Modes are {}".format(", ".join(modes)))
+
+        merchant, listings = self.populate(options["listings"])
+        self.stdout.write(
+            "{} threads x {} writes, 1 in 5 a listing update\n".format(
+                options["threads"], options["writes"]
+            )
+        )
+        try:
+            for name in names:
+                self.configure(*modes[name])
+                stats = self.run(
+                    merchant, listings, options["threads"], options["writes"]
+                )
+                self.report(name, stats)
+        finally:
+            self.configure(tuned, journal_mode, False)
+
+        if options["cleanup"]:
+            Order.objects.filter(merchant=merchant).delete()
+            Listing.objects.filter(title=BENCH_TITLE).delete()
+            User.objects.filter(username=BENCH_USER).delete()
+
+    def populate(self, count):
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        merchant, _ = Merchant.objects.get_or_create(user=user)
+        missing = count - Listing.objects.filter(title=BENCH_TITLE).count()
+        if missing > 0:
+            Listing.objects.bulk_create(
+                [
+                    Listing(
+                        title=BENCH_TITLE,
+                        price=10,
+                        quantity=10**9,
+                        stock_baseline=10**9,
+                    )
+                    for _ in range(missing)
+                ]
+            )
+        return merchant, list(Listing.objects.filter(title=BENCH_TITLE)[:count])
+
+    @staticmethod
+    def configure(database_options, journal_mode, group_commit):
+        # Connections are opened again, with the new OPTIONS. The journal mode
+        # is stored in the database file, it is set once for all of them.
+        connection.close()
+        connection.settings_dict["OPTIONS"] = database_options
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = {}".format(journal_mode))
+        settings.WRITE_QUEUE["ENABLED"] = group_commit
+
+    def run(self, merchant, listings, threads, count):
+        latencies, errors = [], {}
+        lock = threading.Lock()
+
+        def worker(offset):
+            view = OrderAPIView()
+            try:
+                for index in range(count):
+                    listing = listings[(offset + index) % len(listings)]
+                    if index % 5 == 4:
+                        job = lambda: ListingViewSet.save_listing(
+                            listing.pk, {"quantity": 10**9}
+                        )
+                    else:
+                        job = lambda: view.place_order(
+                            merchant, {listing.pk: 1}, timezone.now()
+                        )
+                    start = time.perf_counter()
+                    try:
+                        writes.write_queue.run(job)
+                    except DatabaseError as error:
+                        with lock:
+                            errors[str(error)] = errors.get(str(error), 0) + 1
+                    else:
+                        with lock:
+                            latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=worker, args=(offset,)) for offset in range(threads)
+        ]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return {
+            "elapsed": time.perf_counter() - start,
+            "latencies": sorted(latencies),
+            "errors": errors,
+        }
+
+    def report(self, name, stats):
+        latencies = stats["latencies"]
+        failed = sum(stats["errors"].values())
+        total = len(latencies) + failed
+        self.stdout.write(
+            "{:<6} {:8.1f} writes/s  errors {:6.2%}  p50 {:7.1f} ms  p99 {:7.1f} ms".format(
+                name,
+                len(latencies) / stats["elapsed"],
+                failed / total if total else 0,
+                latencies[len(latencies) // 2] * 1000 if latencies else 0,
+                latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+            )
+        )
+        for error, count in stats["errors"].items():
+            self.stdout.write("       {} x {}".format(count, error))
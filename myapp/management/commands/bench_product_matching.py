@@ -0,0 +1,132 @@
+import math
+import random
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from myapp.matching import TrigramIndex, dice, trigrams
+
+BRANDS = ["Apple", "Samsung", "Google", "Xiaomi", "Sony", "Huawei", "Oppo", "Nokia"]
+LINES = ["Phone", "Galaxy", "Pixel", "Redmi", "Xperia", "Mate", "Find", "Lumia"]
+VARIANTS = ["", "Pro", "Max", "Lite", "Ultra", "Plus", "Mini", "Neo"]
+STORAGE = ["32Gb", "64Gb", "128Gb", "256Gb", "512Gb", "1Tb"]
+COLORS = ["black", "white", "blue", "red", "green", "gold", "silver", "purple"]
+
+
+def product_name(rng):
+    return " ".join(
+        part
+        for part in [
+            rng.choice(BRANDS),
+            rng.choice(LINES),
+            str(rng.randint(1, 99)),
+            rng.choice(VARIANTS),
+            rng.choice(STORAGE),
+            rng.choice(COLORS),
+            "{:04x}".format(rng.randrange(16**4)),
+        ]
+        if part
+    )
+
+
+def listing_title(name, rng):
+    """A title as merchants write them: a word dropped, a typo, a suffix"""
+    words = name.split()
+    words.pop(rng.randrange(1, len(words)))
+    word = rng.randrange(len(words))
+    if len(words[word]) > 3:
+        letters = list(words[word])
+        ix = rng.randrange(len(letters) - 1)
+        letters[ix], letters[ix + 1] = letters[ix + 1], letters[ix]
+        words[word] = "".join(letters)
+    return " ".join(words + [rng.choice(["- unlocked", "like new", "", "boxed"])])
+
+
+def exact_search(index, title, limit, min_score):
+    """TrigramIndex.search without its early stop: every product sharing
+    enough trigrams with `title` is scored"""
+    query = trigrams(title)
+    needed = max(1, math.ceil(min_score * (len(query) + 1) / 2))
+    counts = Counter()
+    for gram in query:
+        counts.update(index.postings.get(gram, ()))
+    scored = []
+    for pk, count in counts.items():
+        if count >= needed:
+            score = dice(query, trigrams(index.names[pk]))
+            if score >= min_score:
+                scored.append((pk, index.names[pk], score))
+    scored.sort(key=lambda match: (-match[2], match[0]))
+    return scored[:limit]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the product matching index on synthetic product names, in "
+        "memory: build time, search latency, and recall against an exhaustive "
+        "search."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument(
+            "--exact", type=int, default=20, help="Queries checked exhaustively"
+        )
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--min-score", type=float, default=0.3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        names = [product_name(rng) for _ in range(options["products"])]
+
+        index = TrigramIndex()
+        start = time.perf_counter()
+        for pk, name in enumerate(names, 1):
+            index.add(pk, name)
+        self.stdout.write(
+            "{} products indexed in {:.1f} s, {} trigrams".format(
+                len(index), time.perf_counter() - start, len(index.postings)
+            )
+        )
+
+        titles = [
+            listing_title(rng.choice(names), rng) for _ in range(options["queries"])
+        ]
+        timings, results = [], []
+        for title in titles:
+            start = time.perf_counter()
+            results.append(index.search(title, options["limit"], options["min_score"]))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(
+            "search: p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms".format(
+                timings[len(timings) // 2] * 1000,
+                timings[int(len(timings) * 0.99)] * 1000,
+                timings[-1] * 1000,
+            )
+        )
+
+        # Recall: share of the exhaustive top results matched by the index, by
+        # score since products often tie. Scores of both searches are exact.
+        checked = min(options["exact"], len(titles))
+        if not checked:
+            return
+        found = expected = same_best = 0
+        for title, result in zip(titles[:checked], results):
+            exact = exact_search(index, title, options["limit"], options["min_score"])
+            if not exact:
+                continue
+            expected += len(exact)
+            found += sum(1 for match in result if match[2] >= exact[-1][2])
+            same_best += bool(result) and result[0][2] == exact[0][2]
+        self.stdout.write(
+            "recall over {} queries: {:.1%} of the top {}, best match {:.1%}".format(
+                checked,
+                found / expected if expected else 1,
+                options["limit"],
+                same_best / checked,
+            )
+        )
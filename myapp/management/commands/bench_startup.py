@@ -0,0 +1,99 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a new interpreter: imports the WSGI application with the warm-up on or
+# off, then serves two requests without a server
+CHILD = """
+import json, os, sys, time
+from wsgiref.util import setup_testing_defaults
+
+start = time.perf_counter()
+from django.conf import settings
+settings.WARMUP["ENABLED"] = sys.argv[1] == "on"
+from myfirstproject.wsgi import application
+ready = time.perf_counter()
+
+def request():
+    environ = {"PATH_INFO": sys.argv[2], "HTTP_HOST": "localhost"}
+    setup_testing_defaults(environ)
+    statuses = []
+    begin = time.perf_counter()
+    b"".join(application(environ, lambda status, headers: statuses.append(status)))
+    return time.perf_counter() - begin, statuses[0]
+
+first, status = request()
+second, _ = request()
+print(json.dumps({
+    "ready": ready - start,
+    "first": first,
+    "ttfr": time.perf_counter() - start - second,
+    "second": second,
+    "status": status,
+}))
+"""
+
+METRICS = [
+    ("ready", "import + warm-up"),
+    ("first", "first request"),
+    ("ttfr", "time to first response"),
+    ("second", "second request"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the cold start of a worker: import the WSGI application in "
+        "new processes, with the warm-up off then on, and time their first "
+        "requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=10, help="Processes per mode")
+        parser.add_argument("--path", default="/myapp/product/")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        self.stdout.write(
+            "{} processes per mode, GET {}, median ms\n".format(
+                options["runs"], options["path"]
+            )
+        )
+        self.stdout.write(
+            "{:<8}".format("warm-up")
+            + "".join("{:>24}".format(label) for _, label in METRICS)
+        )
+        for mode in ["off", "on"]:
+            runs = [
+                self.run(mode, options["path"], env) for _ in range(options["runs"])
+            ]
+            self.stdout.write(
+                "{:<8}".format(mode)
+                + "".join(
+                    "{:>24.1f}".format(
+                        statistics.median(run[key] for run in runs) * 1000
+                    )
+                    for key, _ in METRICS
+                )
+            )
+
+    @staticmethod
+    def run(mode, path, env):
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD, mode, path],
+            env=env,
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+        stats = json.loads(result.stdout.splitlines()[-1])
+        if not stats["status"].startswith("200"):
+            raise CommandError("GET {} answered {}".format(path, stats["status"]))
+        return stats
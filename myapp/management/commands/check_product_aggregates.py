@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import product_stats
+from myapp.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the denormalized aggregates of every product against its listings, "
+        "chunk by chunk, and optionally repair the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--repair", action="store_true", help="Save the recomputed aggregates"
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        checked = drifted = 0
+        last_pk = 0
+
+        while True:
+            product_ids = list(
+                Product.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not product_ids:
+                break
+            last_pk = product_ids[-1]
+
+            # One short transaction per chunk so writers are never blocked for long
+            with transaction.atomic():
+                products = product_stats.refresh(product_ids, save=options["repair"])
+
+            checked += len(product_ids)
+            drifted += len(products)
+            for product in products:
+                self.stdout.write(
+                    "product #{}: listing_count={} min_price={} total_stock={}".format(
+                        product.pk,
+                        product.listing_count,
+                        product.min_price,
+                        product.total_stock,
+                    )
+                )
+
+        action = "repaired" if options["repair"] else "drifted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{} products checked, {} {}".format(checked, drifted, action)
+            )
+        )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from myapp import price_history
+from myapp.models import Listing
+
+
+class Command(BaseCommand):
+    help = (
+        "Downsample the price history: changes older than "
+        "PRICE_HISTORY['RAW_DAYS'] days into hourly buckets, hourly buckets "
+        "older than HOURLY_DAYS days into daily ones. One transaction per "
+        "chunk of listing ids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.PRICE_HISTORY["CHUNK_SIZE"]
+        )
+
+    def handle(self, *args, **options):
+        bounds = Listing.objects.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            self.stdout.write(self.style.SUCCESS("No listing to compact"))
+            return
+
+        chunk_size = options["chunk_size"]
+        chunks = [
+            (start, start + chunk_size)
+            for start in range(bounds["first"], bounds["last"] + 1, chunk_size)
+        ]
+        # Changes compacted into hours may be old enough for days already
+        for resolution, before in price_history.horizons().items():
+            folded = sum(
+                price_history.compact_chunk(resolution, before, chunk)
+                for chunk in chunks
+            )
+            self.stdout.write(
+                "{} rows folded into {} buckets".format(folded, resolution)
+            )
+        self.stdout.write(self.style.SUCCESS("Price history compacted"))
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import webhooks
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver the pending webhook events of the outbox, batched per endpoint, "
+        "until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Dispatch the due events and exit"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.WEBHOOKS["POLL_INTERVAL"],
+            help="Seconds to wait when there is nothing to deliver",
+        )
+
+    def handle(self, *args, **options):
+        rounds = []
+        dispatcher = webhooks.Dispatcher()
+        for stats in dispatcher.run(
+            options["interval"], stop=lambda: options["once"] and rounds
+        ):
+            rounds.append(stats)
+            if stats["purged"]:
+                self.stdout.write("{purged} delivered events purged".format(**stats))
+            if stats["delivered"] or stats["failed"]:
+                self.stdout.write(
+                    "{delivered} delivered, {failed} failed, delivery lag "
+                    "{lag:.1f}s, backlog lag {backlog_lag:.1f}s".format(**stats)
+                )
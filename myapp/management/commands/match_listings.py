@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from myapp import catalog
+from myapp.matching import product_index
+from myapp.models import Listing
+
+
+class Command(BaseCommand):
+    help = (
+        "Suggest a catalog product for every listing without one, using the "
+        "trigram index over product names, and optionally attach the best match."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--min-score", type=float, default=0.5)
+        parser.add_argument(
+            "--attach",
+            action="store_true",
+            help="Attach the best product to listings scoring at least --min-score",
+        )
+
+    def handle(self, *args, **options):
+        product_index.ensure_loaded()
+        self.stdout.write("{} products indexed".format(len(product_index)))
+
+        matched = attached = 0
+        last_pk = 0
+        while True:
+            listings = list(
+                Listing.objects.filter(product__isnull=True, pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "title")[: options["chunk_size"]]
+            )
+            if not listings:
+                break
+            last_pk = listings[-1][0]
+
+            pairs = {}
+            for pk, title in listings:
+                matches = product_index.search(
+                    title, limit=1, min_score=options["min_score"]
+                )
+                if not matches:
+                    continue
+                product_pk, name, score = matches[0]
+                pairs[pk] = product_pk
+                self.stdout.write(
+                    'listing #{} "{}" -> product #{} "{}" ({:.2f})'.format(
+                        pk, title, product_pk, name, score
+                    )
+                )
+
+            matched += len(pairs)
+            if options["attach"] and pairs:
+                outcomes = catalog.attach_products(pairs)
+                attached += sum(
+                    1 for outcome in outcomes.values() if outcome == catalog.ATTACHED
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{} listings matched, {} attached".format(matched, attached)
+            )
+        )
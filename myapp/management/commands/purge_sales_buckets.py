@@ -0,0 +1,22 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myapp import sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the sales buckets which no longer belong to any top sellers "
+        "window. Meant to run periodically, e.g. hourly."
+    )
+
+    def handle(self, *args, **options):
+        seconds = max(settings.TOP_SELLERS["WINDOWS"].values())
+        before = sales.bucket_start(
+            timezone.now() - datetime.timedelta(seconds=seconds)
+        )
+        deleted = sales.purge(before)
+        self.stdout.write(self.style.SUCCESS("{} buckets deleted".format(deleted)))
@@ -0,0 +1,217 @@
+"""
+Fuzzy matching of listing titles to catalog products.
+
+Product names are indexed in memory with a character-trigram inverted index:
+every trigram points to the ids of the products whose name contains it. A
+title is matched by counting the trigrams it shares with each product over the
+postings of all its trigrams, which gives the exact Dice similarity of every
+product from its number of trigrams. Products are scored most shared trigrams
+first, until that number bounds the score of the next ones below min_score or
+below the results found. Results are those of an exhaustive search,
+bench_product_matching checks it and measures the latency.
+
+The index is built lazily from the database on first use. The Product
+post_save/post_delete signals of this process update it on commit. Products
+added or renamed by other processes, or by bulk_create, are read from their
+updated_date every PRODUCT_MATCHING["REFRESH_SECONDS"]. Renames through
+QuerySet.update() must set updated_date. Products deleted by other processes
+stay in the index: callers check that the products found still exist.
+"""
+
+import datetime
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from myapp.models import Product
+
+NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    return NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+
+
+def trigrams(text):
+    """Return the set of trigrams of `text`, each word being padded like in
+    PostgreSQL pg_trgm so that short words and word starts weigh more"""
+    grams = set()
+    for word in normalize(text).split():
+        padded = "  {} ".format(word)
+        for ix in range(len(padded) - 2):
+            grams.add(padded[ix : ix + 3])
+    return grams
+
+
+def dice(left, right):
+    if not left or not right:
+        return 0.0
+    return 2 * len(left & right) / (len(left) + len(right))
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.postings = {}
+        self.names = {}
+        # Number of trigrams of every name
+        self.sizes = {}
+        # Products removed or renamed, whose old trigrams are still in postings
+        self.stale = set()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, pk, name):
+        with self.lock:
+            if pk in self.names:
+                if self.names[pk] == name:
+                    return
+                self.remove(pk)
+            grams = trigrams(name)
+            self.names[pk] = name
+            self.sizes[pk] = len(grams)
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("q")
+                posting.append(pk)
+
+    def remove(self, pk):
+        # Postings are cleaned lazily: stale ids are skipped when searching, or
+        # their product is scored from its name if it was added again. They
+        # are dropped once the stale products outnumber the live ones.
+        with self.lock:
+            if self.names.pop(pk, None) is None:
+                return
+            del self.sizes[pk]
+            self.stale.add(pk)
+            if len(self.stale) > max(1000, len(self.names)):
+                self.compact()
+
+    def clear(self):
+        with self.lock:
+            self.postings, self.names, self.sizes, self.stale = {}, {}, {}, set()
+
+    def compact(self):
+        with self.lock:
+            names = self.names
+            self.clear()
+            for pk, name in names.items():
+                self.add(pk, name)
+
+    def search(self, title, limit=10, min_score=0.3):
+        """Return up to `limit` (product id, name, score) tuples whose Dice
+        similarity with `title` is at least `min_score`, best first"""
+        query = trigrams(title)
+        if not query:
+            return []
+
+        with self.lock:
+            counts = Counter()
+            for gram in query:
+                counts.update(self.postings.get(gram, ()))
+            # Dice is highest when the name has no other trigram, so a product
+            # reaching min_score shares at least `needed` trigrams with the query
+            # (rounded down a little, a float error must not exclude a match)
+            needed = min_score * len(query) / (2 - min_score) - 1e-9
+            candidates = sorted(
+                ((shared, pk) for pk, shared in counts.items() if shared >= needed),
+                reverse=True,
+            )
+
+            # Heap of the best (score, -pk, name), the worst on top
+            best = []
+            names, sizes, stale = self.names, self.sizes, self.stale
+            for shared, pk in candidates:
+                bound = 2 * shared / (len(query) + shared)
+                if len(best) == limit and bound < best[0][0]:
+                    break
+                size = sizes.get(pk)
+                if size is None:
+                    continue
+                if pk in stale:
+                    # Old trigrams of the product are counted too
+                    score = dice(query, trigrams(names[pk]))
+                else:
+                    score = 2 * shared / (len(query) + size)
+                if score < min_score:
+                    continue
+                match = (score, -pk, names[pk])
+                if len(best) < limit:
+                    heapq.heappush(best, match)
+                elif match > best[0]:
+                    heapq.heapreplace(best, match)
+
+        best.sort(reverse=True)
+        return [(-pk, name, score) for score, pk, name in best]
+
+
+class ProductIndex(TrigramIndex):
+    """Trigram index over Product.name, loaded from the database on first use"""
+
+    def __init__(self):
+        super().__init__()
+        self.loaded = False
+        # Products saved since are read again by refresh()
+        self.synced_to = None
+        self.refreshed_at = None
+
+    def reload(self):
+        with self.lock:
+            self.clear()
+            self.read(Product.objects.all())
+            self.loaded = True
+
+    def refresh(self):
+        """Read the products added or renamed since the last read, by any
+        process. A save commits a little after its updated_date is set, the
+        last DELAY seconds are read again."""
+        with self.lock:
+            delay = datetime.timedelta(seconds=settings.PRODUCT_MATCHING["DELAY"])
+            self.read(Product.objects.filter(updated_date__gte=self.synced_to - delay))
+
+    def read(self, products):
+        start = timezone.now()
+        products = products.values_list("pk", "name").order_by()
+        for pk, name in products.iterator(chunk_size=10000):
+            if self.names.get(pk) != name:
+                self.add(pk, name)
+        self.synced_to = start
+        self.refreshed_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.reload()
+        elif (
+            time.monotonic() - self.refreshed_at
+            >= settings.PRODUCT_MATCHING["REFRESH_SECONDS"]
+        ):
+            self.refresh()
+
+    def search(self, title, limit=10, min_score=0.3):
+        self.ensure_loaded()
+        return super().search(title, limit, min_score)
+
+    def product_saved(self, sender, instance, **kwargs):
+        # Not loaded yet: the product will be read with the others on first use
+        if self.loaded:
+            pk, name = instance.pk, instance.name
+            transaction.on_commit(lambda: self.add(pk, name))
+
+    def product_deleted(self, sender, instance, **kwargs):
+        if self.loaded:
+            pk = instance.pk
+            transaction.on_commit(lambda: self.remove(pk))
+
+
+product_index = ProductIndex()
@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/html", "text/plain")
+
+
+def parse_accept_encoding(header):
+    """Return the q-value of every coding listed by the client, as {coding: q}."""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(header):
+    """Pick the coding we support with the highest q-value, br on ties."""
+    accepted = parse_accept_encoding(header)
+
+    def quality(coding):
+        # A coding listed explicitly overrides "*"
+        return accepted.get(coding, accepted.get("*", 0))
+
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(supported, key=quality)
+    return best if quality(best) > 0 else None
+
+
+def compress_body(content, encoding):
+    if encoding == "br":
+        return brotli.compress(content, quality=5)
+    return gzip.compress(content, compresslevel=6, mtime=0)
+
+
+def compress_stream(sequence, encoding):
+    """Compress a streaming body chunk by chunk, flushing after each chunk so
+    the client can start decoding rows before the whole body is produced."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        for chunk in sequence:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+
+    # wbits=31 produces a gzip container instead of a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in sequence:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip/brotli compression for API responses.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE are sent as-is. Compressed bodies
+    are stored in the COMPRESSION_CACHE cache, keyed by encoding and a digest
+    of the raw body, so a hot page is compressed once and then served from
+    the cache to every client asking for it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, "COMPRESSION_MIN_SIZE", 1024)
+        self.cache_alias = getattr(settings, "COMPRESSION_CACHE", "default")
+        self.cache_timeout = getattr(settings, "COMPRESSION_CACHE_TIMEOUT", 300)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        # Don't touch responses already encoded or that we don't know how to handle
+        if response.has_header("Content-Encoding"):
+            return response
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in COMPRESSIBLE_CONTENT_TYPES:
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            # Compressed size is unknown until the stream is exhausted
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding
+            )
+            if response.has_header("Content-Length"):
+                del response["Content-Length"]
+        else:
+            compressed = self.get_compressed(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        # A strong ETag no longer matches the encoded bytes
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+    def get_compressed(self, content, encoding):
+        cache = caches[self.cache_alias]
+        digest = hashlib.blake2b(content, digest_size=20).hexdigest()
+        key = "compressed:{}:{}".format(encoding, digest)
+
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress_body(content, encoding)
+            cache.set(key, compressed, self.cache_timeout)
+        return compressed
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.5 on 2026-10-19 15:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_auto_20210713_1330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='product',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='myapp.product'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='creation_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation_date'),
+        ),
+        migrations.AlterField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='myapp.order'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['price', 'quantity'], name='listing_price_qty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['product', 'price', 'quantity'], name='listing_product_price_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.5 on 2026-10-19 15:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def compute_aggregates(apps, schema_editor):
+    Listing = apps.get_model('myapp', 'Listing')
+    Product = apps.get_model('myapp', 'Product')
+
+    rows = (
+        Listing.objects.filter(product__isnull=False)
+        .order_by()
+        .values('product_id')
+        .annotate(listing_count=Count('id'), min_price=Min('price'), total_stock=Sum('quantity'))
+    )
+    products = [
+        Product(
+            pk=row['product_id'],
+            listing_count=row['listing_count'],
+            min_price=row['min_price'],
+            total_stock=row['total_stock'] or 0,
+        )
+        for row in rows.iterator()
+    ]
+    Product.objects.bulk_update(
+        products, ['listing_count', 'min_price', 'total_stock'], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_listing_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='listing_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(compute_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_product_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('placed', 'Placed'), ('cancelled', 'Cancelled'), ('partially_returned', 'Partially returned'), ('returned', 'Returned')], default='placed', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='returned_quantity',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_order_cancellation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=8, null=True),
+        ),
+    ]
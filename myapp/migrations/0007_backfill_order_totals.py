@@ -0,0 +1,51 @@
+from django.db import migrations, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+CHUNK_SIZE = 1000
+
+
+def backfill_order_totals(apps, schema_editor):
+    # Same as myapp.order_totals.backfill, with the historical models
+    Listing = apps.get_model('myapp', 'Listing')
+    Order = apps.get_model('myapp', 'Order')
+    OrderLine = apps.get_model('myapp', 'OrderLine')
+    total_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+    prices = Listing.objects.filter(pk=OuterRef('listing_id')).values('price')[:1]
+    totals = (
+        OrderLine.objects.filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=total_field))
+        .values('total')
+    )
+    orders = Order.objects.filter(total__isnull=True).order_by('pk')
+    start = 0
+    while True:
+        ids = list(orders.filter(pk__gte=start).values_list('pk', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            return
+        start, stop = ids[0], ids[-1] + 1
+        with transaction.atomic():
+            OrderLine.objects.filter(
+                order_id__gte=start, order_id__lt=stop, unit_price__isnull=True
+            ).update(unit_price=Subquery(prices))
+            Order.objects.filter(pk__gte=start, pk__lt=stop, total__isnull=True).update(
+                total=Coalesce(Subquery(totals), Value(0), output_field=total_field)
+            )
+        start = stop
+
+
+class Migration(migrations.Migration):
+
+    # One transaction per chunk of orders instead of one for the whole table
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0006_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_backfill_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('creation_date', models.DateTimeField(verbose_name='creation_date')),
+                ('status', models.CharField(choices=[('placed', 'Placed'), ('cancelled', 'Cancelled'), ('partially_returned', 'Partially returned'), ('returned', 'Returned')], max_length=20)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=12, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderLine',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField()),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=8, null=True)),
+                ('returned_quantity', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['creation_date'], name='order_creation_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderline',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.listing'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='myapp.archivedorder'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='merchant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.merchant'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['merchant', 'creation_date'], name='archived_order_merchant_idx'),
+        ),
+    ]
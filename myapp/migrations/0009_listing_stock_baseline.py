@@ -0,0 +1,52 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:15
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+CHUNK_SIZE = 10000
+
+
+def set_stock_baselines(apps, schema_editor):
+    # Current quantities are trusted: baseline = quantity + net sold
+    Listing = apps.get_model('myapp', 'Listing')
+    OrderLine = apps.get_model('myapp', 'OrderLine')
+    ArchivedOrderLine = apps.get_model('myapp', 'ArchivedOrderLine')
+
+    last_pk = 0
+    while True:
+        listings = list(
+            Listing.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'quantity')[:CHUNK_SIZE]
+        )
+        if not listings:
+            return
+        start, last_pk = listings[0].pk, listings[-1].pk
+
+        sold = {}
+        for model in (OrderLine, ArchivedOrderLine):
+            rows = (
+                model.objects.filter(listing_id__gte=start, listing_id__lte=last_pk)
+                .order_by()
+                .values('listing_id')
+                .annotate(net=Sum(F('quantity') - F('returned_quantity')))
+            )
+            for row in rows:
+                sold[row['listing_id']] = sold.get(row['listing_id'], 0) + row['net']
+        for listing in listings:
+            listing.stock_baseline = listing.quantity + sold.get(listing.pk, 0)
+        Listing.objects.bulk_update(listings, ['stock_baseline'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='stock_baseline',
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(set_stock_baselines, migrations.RunPython.noop),
+    ]
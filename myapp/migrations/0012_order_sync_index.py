@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_sales_buckets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['merchant', 'creation_date', 'id'], name='order_merchant_sync_idx'),
+        ),
+    ]
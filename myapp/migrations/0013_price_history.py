@@ -0,0 +1,75 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+CHUNK_SIZE = 10000
+
+
+def record_current_prices(apps, schema_editor):
+    # The history of the existing listings starts with their current price
+    Listing = apps.get_model('myapp', 'Listing')
+    PriceChange = apps.get_model('myapp', 'PriceChange')
+    now = django.utils.timezone.now()
+
+    last_pk = 0
+    while True:
+        listings = list(
+            Listing.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'price')[:CHUNK_SIZE]
+        )
+        if not listings:
+            return
+        last_pk = listings[-1][0]
+        PriceChange.objects.bulk_create(
+            [PriceChange(listing_id=pk, at=now, price=price) for pk, price in listings],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_order_sync_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.listing')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('last_price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.listing')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pricechange',
+            index=models.Index(fields=['listing', 'at'], name='price_change_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricechange',
+            index=models.Index(fields=['at'], name='price_change_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricebucket',
+            index=models.Index(fields=['resolution', 'start'], name='price_bucket_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricebucket',
+            constraint=models.UniqueConstraint(fields=('listing', 'resolution', 'start'), name='price_bucket_listing_start'),
+        ),
+        migrations.RunPython(record_current_prices, migrations.RunPython.noop),
+    ]
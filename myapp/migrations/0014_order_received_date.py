@@ -0,0 +1,63 @@
+# Generated by Django 3.2.5 on 2026-10-19 16:45
+
+from django.db import migrations, models, transaction
+from django.db.models import F
+import django.utils.timezone
+
+CHUNK_SIZE = 10000
+
+
+def backfill_received_dates(apps, schema_editor):
+    # Existing orders keep their position in the syncs: the cursors given
+    # so far were on creation_date
+    for model_name in ['Order', 'ArchivedOrder']:
+        model = apps.get_model('myapp', model_name)
+        start = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gte=start).order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE]
+            )
+            if not ids:
+                break
+            start, stop = ids[0], ids[-1] + 1
+            with transaction.atomic():
+                model.objects.filter(pk__gte=start, pk__lt=stop).update(received_date=F('creation_date'))
+            start = stop
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_price_history'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_merchant_sync_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='received_date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='received_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill_received_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['merchant', 'received_date', 'id'], name='archived_order_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['merchant', 'creation_date'], name='order_merchant_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['merchant', 'received_date', 'id'], name='order_merchant_sync_idx'),
+        ),
+    ]
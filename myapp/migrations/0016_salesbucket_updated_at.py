@@ -0,0 +1,19 @@
+# Generated by Django 3.2.5 on 2026-10-19 17:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_product_updated_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesbucket',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,16 +1,31 @@
 from django.utils import timezone
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 
 class Merchant(models.Model):
     user = models.OneToOneField(User, related_name="merchant", on_delete=models.CASCADE)
 
+    def __str__(self):
+        return self.user.username
+
 
 class Product(models.Model):
     name = models.CharField(max_length=200, blank=False, unique=False)
     # name is mandatory
 
+    # Denormalized aggregates over the listings of the product, maintained by
+    # myapp.product_stats and checked by the check_product_aggregates command
+    listing_count = models.IntegerField(default=0)
+    min_price = models.DecimalField(
+        max_digits=8, decimal_places=2, blank=True, null=True, default=None
+    )
+    total_stock = models.IntegerField(default=0)
+    # set on every save, read by the product matching index of each process to
+    # catch up with the products added or renamed by the others
+    updated_date = models.DateTimeField(auto_now=True, db_index=True)
+
 
 class Listing(models.Model):
     product = models.ForeignKey(
@@ -27,11 +42,64 @@ class Listing(models.Model):
     price = models.DecimalField(max_digits=8, decimal_places=2, blank=False)
     # price is mandatory
     quantity = models.IntegerField(default=0)
+    # stock received, i.e. quantity plus everything sold and not returned since
+    # the listing was created, checked against the order lines by audit_stock
+    stock_baseline = models.IntegerField(blank=True, null=True, default=None)
+
+    class Meta:
+        indexes = [
+            # price range / in stock filters and price sorting, index-only for facets
+            models.Index(fields=["price", "quantity"], name="listing_price_qty_idx"),
+            models.Index(
+                fields=["product", "price", "quantity"],
+                name="listing_product_price_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.stock_baseline is None:
+            self.stock_baseline = self.quantity
+        super().save(*args, **kwargs)
 
 
 class Order(models.Model):
+    PLACED = "placed"
+    CANCELLED = "cancelled"
+    PARTIALLY_RETURNED = "partially_returned"
+    RETURNED = "returned"
+    STATUSES = [
+        (PLACED, "Placed"),
+        (CANCELLED, "Cancelled"),
+        (PARTIALLY_RETURNED, "Partially returned"),
+        (RETURNED, "Returned"),
+    ]
+
     merchant = models.ForeignKey(Merchant, blank=False, on_delete=models.CASCADE)
     creation_date = models.DateTimeField("creation_date", default=timezone.now)
+    # set by the server when the order is written, creation_date comes from the
+    # client: incremental syncs page on this one
+    received_date = models.DateTimeField(default=timezone.now, editable=False)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PLACED)
+    # sum of quantity * unit_price of the lines, set when the order is created
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, blank=True, null=True, default=None
+    )
+
+    class Meta:
+        indexes = [
+            # selection of the orders to archive
+            models.Index(fields=["creation_date"], name="order_creation_date_idx"),
+            # date ranges of a merchant
+            models.Index(
+                fields=["merchant", "creation_date"],
+                name="order_merchant_date_idx",
+            ),
+            # incremental syncs of a merchant
+            models.Index(
+                fields=["merchant", "received_date", "id"],
+                name="order_merchant_sync_idx",
+            ),
+        ]
 
 
 class OrderLine(models.Model):
@@ -40,3 +108,135 @@ class OrderLine(models.Model):
     )
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
     quantity = models.IntegerField(blank=False)
+    # price of the listing when the order was created, it may be repriced since
+    unit_price = models.DecimalField(
+        max_digits=8, decimal_places=2, blank=True, null=True, default=None
+    )
+    # part of the quantity put back in stock by a cancellation or a return
+    returned_quantity = models.IntegerField(default=0)
+
+
+class ArchivedOrder(models.Model):
+    """Order moved out of the hot tables by myapp.archive, with its id kept"""
+
+    id = models.BigIntegerField(primary_key=True)
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
+    creation_date = models.DateTimeField("creation_date")
+    received_date = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.STATUSES)
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, blank=True, null=True, default=None
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["merchant", "creation_date"],
+                name="archived_order_merchant_idx",
+            ),
+            models.Index(
+                fields=["merchant", "received_date", "id"],
+                name="archived_order_sync_idx",
+            ),
+        ]
+
+
+class ArchivedOrderLine(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, related_name="lines", on_delete=models.CASCADE
+    )
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(
+        max_digits=8, decimal_places=2, blank=True, null=True, default=None
+    )
+    returned_quantity = models.IntegerField(default=0)
+
+
+class WebhookEndpoint(models.Model):
+    merchant = models.ForeignKey(
+        Merchant, related_name="webhook_endpoints", on_delete=models.CASCADE
+    )
+    url = models.URLField()
+    # key of the HMAC-SHA256 signature of the payloads
+    secret = models.CharField(max_length=64)
+    is_active = models.BooleanField(default=True)
+
+
+class OutboxEvent(models.Model):
+    """Event waiting to be delivered to a webhook endpoint by myapp.webhooks"""
+
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE)
+    type = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    # NULL once delivered, or given up after WEBHOOKS["MAX_ATTEMPTS"] attempts
+    next_attempt_at = models.DateTimeField(blank=True, null=True, default=timezone.now)
+    delivered_at = models.DateTimeField(blank=True, null=True, default=None)
+    last_error = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["next_attempt_at"], name="outbox_next_attempt_idx"),
+        ]
+
+
+class SalesBucket(models.Model):
+    """Quantity of a listing sold during the BUCKET_SECONDS starting at `start`"""
+
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    quantity = models.IntegerField(default=0)
+    # Set on every write, leaderboards read the rows changed since their copy
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["start", "listing"], name="sales_bucket_start_listing"
+            ),
+        ]
+
+
+class PriceChange(models.Model):
+    """Price set on a listing at `at`, compacted into PriceBuckets once old"""
+
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    at = models.DateTimeField(default=timezone.now)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "at"], name="price_change_listing_idx"),
+            # selection of the changes to compact
+            models.Index(fields=["at"], name="price_change_at_idx"),
+        ]
+
+
+class PriceBucket(models.Model):
+    """Lowest, highest and last prices set on a listing during the hour or
+    the day starting at `start`"""
+
+    HOUR = "hour"
+    DAY = "day"
+    RESOLUTIONS = [(HOUR, "Hour"), (DAY, "Day")]
+
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS)
+    start = models.DateTimeField()
+    min_price = models.DecimalField(max_digits=8, decimal_places=2)
+    max_price = models.DecimalField(max_digits=8, decimal_places=2)
+    last_price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["listing", "resolution", "start"],
+                name="price_bucket_listing_start",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["resolution", "start"], name="price_bucket_start_idx"),
+        ]
@@ -0,0 +1,110 @@
+"""
+Streamed HTML page of the orders of a merchant.
+
+Rows are read by chunks of ORDER_PAGE["CHUNK_SIZE"] orders and sent as soon as
+they are rendered, so the first bytes of a long history go out after the
+first chunk. The rendered row of every order is cached under its id, status
+and total (the fields of an order that change, on cancellations, returns and
+by backfill_order_totals), fetched and stored with one get_many/set_many per
+chunk, so a page seen again is mostly served from cache.
+"""
+
+import asyncio
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.loader import get_template
+
+ORDER_FIELDS = ["id", "creation_date", "status", "total"]
+
+
+def row_key(order):
+    return "order-row:{}:{}:{}".format(order.id, order.status, order.total)
+
+
+def iter_orders(queryset, chunk_size):
+    """Iterate over `queryset` by id, one query per chunk"""
+    queryset = queryset.only(*ORDER_FIELDS).order_by("pk")
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def render_rows(orders):
+    cache = caches[settings.ORDER_PAGE["CACHE"]]
+    keys = [row_key(order) for order in orders]
+    rows = cache.get_many(keys)
+
+    missing = {}
+    template = get_template("myapp/order_row.html")
+    for key, order in zip(keys, orders):
+        if key not in rows:
+            missing[key] = rows[key] = template.render({"order": order})
+    if missing:
+        cache.set_many(missing, settings.ORDER_PAGE["CACHE_TIMEOUT"])
+    return "".join(rows[key] for key in keys)
+
+
+class RowReader:
+    """Run the queries of a streamed body.
+
+    Under ASGI, Django 3.2 iterates streamed bodies in the event loop, where
+    the ORM refuses to run: the queries then go to a thread of their own, with
+    its own connection closed at the end of the stream."""
+
+    def __init__(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.executor = None
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def next(self, chunks):
+        if self.executor is None:
+            return next(chunks, None)
+        return self.executor.submit(next, chunks, None).result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.submit(connections.close_all).result()
+            self.executor.shutdown()
+
+
+def stream_page(merchant_id, querysets):
+    """Yield the page of the orders of `querysets`, merged by id"""
+    chunk_size = settings.ORDER_PAGE["CHUNK_SIZE"]
+    yield get_template("myapp/orders_start.html").render({"merchant_id": merchant_id})
+
+    # Hot and archived orders are merged by id, then cut again in chunks
+    orders = heapq.merge(
+        *[
+            itertools.chain.from_iterable(iter_orders(queryset, chunk_size))
+            for queryset in querysets
+        ],
+        key=lambda order: order.pk,
+    )
+    chunks = iter(lambda: list(itertools.islice(orders, chunk_size)), [])
+
+    reader = RowReader()
+    count = 0
+    try:
+        while True:
+            chunk = reader.next(chunks)
+            if chunk is None:
+                break
+            count += len(chunk)
+            yield render_rows(chunk)
+    finally:
+        reader.close()
+
+    yield get_template("myapp/orders_end.html").render({"count": count})
@@ -0,0 +1,57 @@
+"""
+Backfill of the prices captured on orders.
+
+Orders created before OrderLine.unit_price and Order.total existed have them
+NULL. They are filled from the current listing prices, which is the best we
+know, one range of order ids at a time so that each transaction stays short.
+"""
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from myapp.models import Listing, Order, OrderLine
+
+TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total():
+    return Sum(F("quantity") * F("unit_price"), output_field=TOTAL_FIELD)
+
+
+def backfill_range(start, stop):
+    """Fill the missing unit prices and totals of the orders with start <= id < stop.
+    Returns the number of orders updated."""
+    with transaction.atomic():
+        OrderLine.objects.filter(
+            order_id__gte=start, order_id__lt=stop, unit_price__isnull=True
+        ).update(
+            unit_price=Subquery(
+                Listing.objects.filter(pk=OuterRef("listing_id")).values("price")[:1]
+            )
+        )
+        totals = (
+            OrderLine.objects.filter(order=OuterRef("pk"))
+            .order_by()
+            .values("order")
+            .annotate(total=line_total())
+            .values("total")
+        )
+        return Order.objects.filter(
+            pk__gte=start, pk__lt=stop, total__isnull=True
+        ).update(total=Coalesce(Subquery(totals), Value(0), output_field=TOTAL_FIELD))
+
+
+def backfill(chunk_size=1000):
+    """Backfill every order missing its total, chunk by chunk.
+    Yields the number of orders updated by each chunk."""
+    orders = Order.objects.filter(total__isnull=True).order_by("pk")
+    start = 0
+    while True:
+        ids = list(
+            orders.filter(pk__gte=start).values_list("pk", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield backfill_range(ids[0], ids[-1] + 1)
+        start = ids[-1] + 1
@@ -0,0 +1,164 @@
+"""
+Listing price history, downsampled as it ages.
+
+Every price set on a listing is one PriceChange row, written by `record()` from
+the listing endpoints and the bulk paths. Saves that keep the price are not
+recorded. The compact_price_history command folds the changes older than
+PRICE_HISTORY["RAW_DAYS"] days into hourly PriceBuckets, then the hourly
+buckets older than HOURLY_DAYS days into daily ones, keeping the lowest,
+highest and last prices set during each bucket. Cutoffs are aligned on bucket
+starts: a bucket is built once, from complete data, and tiers never overlap.
+
+`history()` reads a range at the finest resolution still stored for all of it,
+or coarser if asked, downsampling the younger, finer rows on the fly.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from myapp.models import PriceBucket, PriceChange
+
+RAW = "raw"
+# Finest first
+RESOLUTIONS = [RAW, PriceBucket.HOUR, PriceBucket.DAY]
+SECONDS = {PriceBucket.HOUR: 3600, PriceBucket.DAY: 24 * 3600}
+
+
+def record(prices):
+    """Record the new prices {listing_id: price}, set now"""
+    at = timezone.now()
+    PriceChange.objects.bulk_create(
+        [
+            PriceChange(listing_id=pk, at=at, price=price)
+            for pk, price in prices.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def floor(when, resolution):
+    """Start of the bucket of `resolution` containing `when`"""
+    if resolution == RAW:
+        return when
+    seconds = SECONDS[resolution]
+    timestamp = int(when.timestamp()) // seconds * seconds
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def horizons(now=None):
+    """{resolution: date} before which rows of the next finer resolution are
+    compacted into buckets of `resolution`"""
+    now = now or timezone.now()
+    config = settings.PRICE_HISTORY
+    return {
+        PriceBucket.HOUR: floor(
+            now - datetime.timedelta(days=config["RAW_DAYS"]), PriceBucket.HOUR
+        ),
+        PriceBucket.DAY: floor(
+            now - datetime.timedelta(days=config["HOURLY_DAYS"]), PriceBucket.DAY
+        ),
+    }
+
+
+def points(resolution, **lookups):
+    """Rows of `resolution` as (listing_id, time, min, max, last) tuples, by
+    listing then time. `lookups` filter on listing_id and on time, e.g.
+    time__lt=..."""
+    field = "at" if resolution == RAW else "start"
+    lookups = {
+        field + key[4:] if key.startswith("time") else key: value
+        for key, value in lookups.items()
+    }
+    if resolution == RAW:
+        rows = (
+            PriceChange.objects.filter(**lookups)
+            .order_by("listing_id", "at", "pk")
+            .values_list("listing_id", "at", "price")
+        )
+        return [(pk, at, price, price, price) for pk, at, price in rows]
+    return list(
+        PriceBucket.objects.filter(resolution=resolution, **lookups)
+        .order_by("listing_id", "start")
+        .values_list("listing_id", "start", "min_price", "max_price", "last_price")
+    )
+
+
+def downsample(rows, resolution):
+    """Fold rows sorted by listing and time into one row per listing and
+    bucket of `resolution`"""
+    buckets = {}
+    for listing_id, when, low, high, last in rows:
+        key = (listing_id, floor(when, resolution))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [low, high, last]
+        else:
+            bucket[0] = min(bucket[0], low)
+            bucket[1] = max(bucket[1], high)
+            bucket[2] = last
+    return [
+        (listing_id, start, low, high, last)
+        for (listing_id, start), (low, high, last) in buckets.items()
+    ]
+
+
+def compact_chunk(resolution, before, bounds):
+    """Fold the rows of the next finer resolution older than `before`, of the
+    listings with bounds[0] <= id < bounds[1], into buckets of `resolution`.
+    Returns the number of rows folded."""
+    finer = RESOLUTIONS[RESOLUTIONS.index(resolution) - 1]
+    listings = {"listing_id__gte": bounds[0], "listing_id__lt": bounds[1]}
+    with transaction.atomic():
+        rows = points(finer, time__lt=before, **listings)
+        if not rows:
+            return 0
+        PriceBucket.objects.bulk_create(
+            [
+                PriceBucket(
+                    listing_id=listing_id,
+                    resolution=resolution,
+                    start=start,
+                    min_price=low,
+                    max_price=high,
+                    last_price=last,
+                )
+                for listing_id, start, low, high, last in downsample(rows, resolution)
+            ],
+            batch_size=1000,
+        )
+        if finer == RAW:
+            PriceChange.objects.filter(at__lt=before, **listings).delete()
+        else:
+            PriceBucket.objects.filter(
+                resolution=finer, start__lt=before, **listings
+            ).delete()
+    return len(rows)
+
+
+def history(listing_id, since, until, resolution=None):
+    """Return the resolution used and the (start, min, max, last) rows of the
+    listing between `since` and `until`, at `resolution` or coarser if the
+    finer rows of the range were compacted"""
+    # The changes before the horizon of a resolution may have been compacted
+    needed = RAW
+    for coarser, horizon in horizons().items():
+        if since < horizon:
+            needed = coarser
+    resolution = max(needed, resolution or RAW, key=RESOLUTIONS.index)
+
+    # Younger rows are still in finer tiers
+    rows = []
+    for tier in RESOLUTIONS[: RESOLUTIONS.index(resolution) + 1]:
+        rows += points(
+            tier,
+            listing_id=listing_id,
+            time__gte=floor(since, resolution),
+            time__lte=until,
+        )
+    rows.sort(key=lambda row: row[1])
+    if resolution != RAW:
+        rows = downsample(rows, resolution)
+    return resolution, [row[1:] for row in rows]
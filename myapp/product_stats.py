@@ -0,0 +1,126 @@
+"""
+Incremental maintenance of the denormalized aggregates stored on Product
+(listing_count, min_price, total_stock).
+
+Every function issues UPDATE statements based on F() expressions, so concurrent
+requests never overwrite each other's changes. min_price can only be updated
+incrementally when it decreases; when it may have increased, it is recomputed
+for the product with a single correlated UPDATE.
+"""
+
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from myapp import stock
+from myapp.models import Listing, Product
+
+
+def _lower_min_price(price):
+    return Case(
+        When(Q(min_price__isnull=True) | Q(min_price__gt=price), then=Value(price)),
+        default=F("min_price"),
+    )
+
+
+def _min_price_subquery():
+    return Subquery(
+        Listing.objects.filter(product=OuterRef("pk"))
+        .order_by()
+        .values("product")
+        .annotate(min_price=Min("price"))
+        .values("min_price")
+    )
+
+
+def listing_added(listing):
+    """A listing was created with a product, or a product was attached to it"""
+    if listing.product_id is None:
+        return
+    listings_added(listing.product_id, 1, listing.quantity, listing.price)
+
+
+def listings_added(product_id, count, quantity, min_price):
+    """`count` listings holding `quantity` items in total, the cheapest one at
+    `min_price`, were attached to the product"""
+    Product.objects.filter(pk=product_id).update(
+        listing_count=F("listing_count") + count,
+        total_stock=F("total_stock") + quantity,
+        min_price=_lower_min_price(min_price),
+    )
+
+
+def listing_updated(listing, old_price, old_quantity):
+    """Price and/or quantity of a listing changed"""
+    if listing.product_id is None:
+        return
+    products = Product.objects.filter(pk=listing.product_id)
+    changes = {}
+    if listing.quantity != old_quantity:
+        changes["total_stock"] = F("total_stock") + (listing.quantity - old_quantity)
+    if listing.price < old_price:
+        changes["min_price"] = _lower_min_price(listing.price)
+    elif listing.price > old_price:
+        # The listing may have been the cheapest one
+        changes["min_price"] = Case(
+            When(min_price__gte=old_price, then=_min_price_subquery()),
+            default=F("min_price"),
+        )
+    if changes:
+        products.update(**changes)
+
+
+def stock_changed(deltas):
+    """Apply stock deltas given as {product_id: delta}, one UPDATE per batch"""
+    stock.add_deltas(Product.objects, "total_stock", deltas)
+
+
+def compute(product_ids):
+    """Return the expected aggregates of the given products, computed from
+    their listings with a single grouped query"""
+    expected = {
+        pk: {"listing_count": 0, "min_price": None, "total_stock": 0}
+        for pk in product_ids
+    }
+    rows = (
+        Listing.objects.filter(product_id__in=product_ids)
+        .order_by()
+        .values("product_id")
+        .annotate(
+            listing_count=Count("id"),
+            min_price=Min("price"),
+            total_stock=Coalesce(Sum("quantity"), 0),
+        )
+    )
+    for row in rows:
+        expected[row.pop("product_id")] = row
+    return expected
+
+
+def refresh(product_ids, save=True):
+    """Recompute the aggregates of the given products from their listings and
+    save the ones that drifted. Returns the drifted products, with the
+    expected values set on them."""
+    expected = compute(product_ids)
+    fixed = []
+    for product in Product.objects.filter(pk__in=product_ids):
+        values = expected[product.pk]
+        if any(getattr(product, key) != value for key, value in values.items()):
+            for key, value in values.items():
+                setattr(product, key, value)
+            fixed.append(product)
+    if fixed and save:
+        Product.objects.bulk_update(
+            fixed, ["listing_count", "min_price", "total_stock"]
+        )
+    return fixed
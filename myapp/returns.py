@@ -0,0 +1,139 @@
+"""
+Order cancellations and returns.
+
+Restocking is set-based: the quantities to put back are summed per listing with
+one grouped query, then added to the listings (and to the product aggregates)
+with one CASE-based UPDATE per batch, so cancelling many orders costs the same
+number of queries as cancelling one. The restocked quantities are taken back
+from the sales buckets of the top sellers too, in the same transaction, with
+one UPDATE per bucket the orders were counted in.
+"""
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from myapp import events, product_stats, sales, stock
+from myapp.models import Listing, Order, OrderLine
+
+# Orders handled by one set of restocking queries
+BATCH_SIZE = 500
+
+
+class ReturnError(Exception):
+    pass
+
+
+class CancelConflict(Exception):
+    """Some orders of a batch were cancelled by another transaction"""
+
+
+def mark_cancelled(order_ids):
+    """Cancel the orders of `order_ids` not cancelled yet, returns how many"""
+    return (
+        Order.objects.filter(pk__in=order_ids)
+        .exclude(status=Order.CANCELLED)
+        .update(status=Order.CANCELLED)
+    )
+
+
+def restock(lines):
+    """Put back in stock the part not yet returned of `lines` (an OrderLine
+    queryset), and mark them as fully returned"""
+    rows = (
+        lines.order_by()
+        .values("listing_id", "listing__product_id", "order__received_date")
+        .annotate(quantity=Sum(F("quantity") - F("returned_quantity")))
+    )
+    listing_deltas = {}
+    product_deltas = {}
+    # {bucket start: {listing_id: quantity}} of the sales to take back
+    sold = {}
+    for row in rows:
+        listing_id, quantity = row["listing_id"], row["quantity"]
+        listing_deltas[listing_id] = listing_deltas.get(listing_id, 0) + quantity
+        product_id = row["listing__product_id"]
+        product_deltas[product_id] = product_deltas.get(product_id, 0) + quantity
+        bucket = sold.setdefault(sales.bucket_start(row["order__received_date"]), {})
+        bucket[listing_id] = bucket.get(listing_id, 0) + quantity
+
+    stock.add_deltas(Listing.objects, "quantity", listing_deltas)
+    events.bus.publish_on_commit(listing_deltas)
+    product_stats.stock_changed(product_deltas)
+    for start, quantities in sold.items():
+        sales.take_back(quantities, start)
+    lines.update(returned_quantity=F("quantity"))
+
+
+def cancel_orders(orders):
+    """Cancel the orders of the `orders` queryset which are not cancelled yet
+    and restock their lines. Returns the ids of the cancelled orders."""
+    with transaction.atomic():
+        order_ids = list(
+            orders.exclude(status=Order.CANCELLED).values_list("pk", flat=True)
+        )
+        cancelled = []
+        for start in range(0, len(order_ids), BATCH_SIZE):
+            batch = order_ids[start : start + BATCH_SIZE]
+            # The status guard keeps a concurrent cancel from restocking twice.
+            # When it skipped orders, which ones is only known order by order.
+            try:
+                with transaction.atomic():
+                    if mark_cancelled(batch) != len(batch):
+                        raise CancelConflict
+            except CancelConflict:
+                batch = [pk for pk in batch if mark_cancelled([pk])]
+            restock(OrderLine.objects.filter(order_id__in=batch))
+            cancelled.extend(batch)
+    return cancelled
+
+
+def return_lines(order, quantities):
+    """Return {listing_id: quantity} of `order` and restock them.
+
+    Raises ReturnError, without changing anything, if the order is cancelled,
+    a listing is not part of it or more items are returned than were ordered."""
+    if order.status == Order.CANCELLED:
+        raise ReturnError("Order #{} is cancelled.".format(order.pk))
+
+    with transaction.atomic():
+        lines = {
+            line.listing_id: line
+            for line in OrderLine.objects.filter(order=order).select_related("listing")
+        }
+        returned = {}
+        for listing_id, quantity in quantities.items():
+            line = lines.get(listing_id)
+            if line is None:
+                raise ReturnError("Listing #{} is not in the order.".format(listing_id))
+            if quantity > line.quantity - line.returned_quantity:
+                raise ReturnError(
+                    "Only {} items of listing #{} can be returned.".format(
+                        line.quantity - line.returned_quantity, listing_id
+                    )
+                )
+            returned[line.pk] = quantity
+
+        product_deltas = {}
+        for listing_id, quantity in quantities.items():
+            product_id = lines[listing_id].listing.product_id
+            product_deltas[product_id] = product_deltas.get(product_id, 0) + quantity
+        stock.add_deltas(OrderLine.objects, "returned_quantity", returned)
+        # A concurrent return of the same lines was committed since they were read
+        if OrderLine.objects.filter(
+            pk__in=returned, returned_quantity__gt=F("quantity")
+        ).exists():
+            raise ReturnError(
+                "Lines of order #{} were returned concurrently.".format(order.pk)
+            )
+        stock.add_deltas(Listing.objects, "quantity", quantities)
+        events.bus.publish_on_commit(quantities)
+        product_stats.stock_changed(product_deltas)
+        sales.take_back(quantities, order.received_date)
+
+        fully_returned = all(
+            line.returned_quantity + returned.get(line.pk, 0) == line.quantity
+            for line in lines.values()
+        )
+        order.status = Order.RETURNED if fully_returned else Order.PARTIALLY_RETURNED
+        order.save(update_fields=["status"])
+    return order
@@ -0,0 +1,176 @@
+"""
+Top sellers over rolling windows.
+
+Every order adds its quantities to the SalesBucket row of each listing for the
+current bucket, by the server clock, of TOP_SELLERS["BUCKET_SECONDS"], with one INSERT ... ON
+CONFLICT DO NOTHING and one CASE-based UPDATE, in the order transaction.
+Cancellations and returns take their quantities back from the bucket the sale
+was counted in, unless it is out of every window.
+
+A Leaderboard keeps in memory the sales of a window (e.g. the last hour)
+summed per listing and its top K listings, computed with a heap. Closed buckets
+are read once, added when they enter the window and subtracted when they leave
+it. Only the current and previous buckets are read again on every refresh, at
+most every REFRESH_SECONDS, with the rows of closed buckets written since the
+last refresh (by a cancellation), found by their updated_at. Everything is
+rebuilt from the buckets after a restart, and every process sees the sales of
+the others.
+"""
+
+import datetime
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from myapp import stock
+from myapp.models import SalesBucket
+
+
+def bucket_start(when):
+    seconds = settings.TOP_SELLERS["BUCKET_SECONDS"]
+    timestamp = int(when.timestamp()) // seconds * seconds
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def record(quantities, when=None):
+    """Add the sales {listing_id: quantity} to the current bucket"""
+    now = timezone.now()
+    start = bucket_start(when or now)
+    SalesBucket.objects.bulk_create(
+        [SalesBucket(listing_id=pk, start=start) for pk in quantities],
+        ignore_conflicts=True,
+    )
+    stock.add_deltas(
+        SalesBucket.objects.filter(start=start),
+        "quantity",
+        quantities,
+        key="listing_id",
+        updated_at=now,
+    )
+
+
+def take_back(quantities, when):
+    """Remove the sales {listing_id: quantity} made at `when` from their
+    bucket, e.g. on a cancellation. Sales out of every window are left alone."""
+    now = timezone.now()
+    longest = max(settings.TOP_SELLERS["WINDOWS"].values())
+    start = bucket_start(when)
+    if start < bucket_start(now - datetime.timedelta(seconds=longest)):
+        return
+    stock.add_deltas(
+        SalesBucket.objects.filter(start=start),
+        "quantity",
+        {pk: -quantity for pk, quantity in quantities.items()},
+        key="listing_id",
+        updated_at=now,
+    )
+
+
+def purge(before):
+    """Delete the buckets started before `before`"""
+    return SalesBucket.objects.filter(start__lt=before).delete()[0]
+
+
+def read_buckets(*filters, **lookups):
+    """Return {start: {listing_id: quantity}} of the rows matching `filters`
+    and `lookups`"""
+    buckets = {}
+    rows = SalesBucket.objects.filter(*filters, **lookups).values_list(
+        "start", "listing_id", "quantity"
+    )
+    for start, listing_id, quantity in rows:
+        buckets.setdefault(start, {})[listing_id] = quantity
+    return buckets
+
+
+class Leaderboard:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.closed = {}
+        self.totals = {}
+        self.top = []
+        self.refreshed_at = None
+        # Rows written since are read again by refresh()
+        self.synced_to = None
+
+    def get(self, limit):
+        """Return up to `limit` (listing_id, quantity) pairs, best sellers first"""
+        with self.lock:
+            if (
+                self.refreshed_at is None
+                or time.monotonic() - self.refreshed_at
+                >= settings.TOP_SELLERS["REFRESH_SECONDS"]
+            ):
+                self.refresh(timezone.now())
+            return self.top[:limit]
+
+    def refresh(self, now):
+        # The window is made of the buckets overlapping the last `seconds`
+        first = bucket_start(now - datetime.timedelta(seconds=self.seconds))
+        # Orders committing late may still write to the previous bucket, so
+        # it is only considered closed once the next one ends
+        open_from = bucket_start(now) - datetime.timedelta(
+            seconds=settings.TOP_SELLERS["BUCKET_SECONDS"]
+        )
+
+        for start in [start for start in self.closed if start < first]:
+            self.add(self.closed.pop(start), -1)
+        last_closed = max(self.closed, default=first - datetime.timedelta(seconds=1))
+        new = Q(start__gt=last_closed)
+        if self.synced_to is not None:
+            delay = datetime.timedelta(seconds=settings.TOP_SELLERS["DELAY"])
+            new |= Q(updated_at__gte=self.synced_to - delay)
+        synced_to = timezone.now()
+        # Buckets after the current one are never written by orders
+        rows = read_buckets(new, start__gte=first, start__lte=bucket_start(now))
+
+        counts = {}
+        for start, quantities in rows.items():
+            if start >= open_from:
+                for listing_id, quantity in quantities.items():
+                    counts[listing_id] = counts.get(listing_id, 0) + quantity
+            else:
+                # Rows of a closed bucket replace their copy, if any
+                closed = self.closed.setdefault(start, {})
+                changes = {
+                    listing_id: quantity - closed.get(listing_id, 0)
+                    for listing_id, quantity in quantities.items()
+                }
+                closed.update(quantities)
+                self.add(changes, 1)
+
+        for listing_id, quantity in self.totals.items():
+            counts[listing_id] = counts.get(listing_id, 0) + quantity
+        # Ties are broken by listing id
+        self.top = heapq.nlargest(
+            settings.TOP_SELLERS["K"],
+            ((pk, quantity) for pk, quantity in counts.items() if quantity > 0),
+            key=lambda item: (item[1], -item[0]),
+        )
+        self.refreshed_at = time.monotonic()
+        self.synced_to = synced_to
+
+    def add(self, quantities, sign):
+        totals = self.totals
+        for listing_id, quantity in quantities.items():
+            total = totals.get(listing_id, 0) + sign * quantity
+            if total:
+                totals[listing_id] = total
+            else:
+                totals.pop(listing_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.closed, self.totals, self.top = {}, {}, []
+            self.refreshed_at = self.synced_to = None
+
+
+leaderboards = {
+    name: Leaderboard(seconds)
+    for name, seconds in settings.TOP_SELLERS["WINDOWS"].items()
+}
@@ -1,15 +1,23 @@
-from ddtrace.compat import is_integer
+import base64
+import datetime
+from collections.abc import Mapping
+
 from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 
-from myapp.models import Product, Listing, Order, OrderLine
+from myapp.models import Product, Listing, Order, OrderLine, ArchivedOrder
 
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ["id", "name"]
+        fields = ["id", "name", "listing_count", "min_price", "total_stock"]
+        read_only_fields = ["listing_count", "min_price", "total_stock"]
 
 
 class ListingSerializer(serializers.ModelSerializer):
@@ -29,35 +37,265 @@ class ListingSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "title", "description", "price", "quantity"]
 
 
+class ListingFilterSerializer(serializers.Serializer):
+    """Query parameters accepted by the listing list and facets endpoints"""
+
+    ORDERINGS = ["id", "-id", "price", "-price", "quantity", "-quantity"]
+
+    product = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(max_digits=8, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=8, decimal_places=2, required=False)
+    in_stock = serializers.BooleanField(required=False, allow_null=True, default=None)
+    ordering = serializers.ChoiceField(choices=ORDERINGS, required=False)
+
+    def validate(self, data):
+        min_price = data.get("min_price")
+        max_price = data.get("max_price")
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise serializers.ValidationError("min_price must be lower than max_price")
+        return data
+
+
 class AttachProductSerializer(serializers.Serializer):
     product = serializers.IntegerField()
 
 
+class ProductSuggestionQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    min_score = serializers.FloatField(min_value=0, max_value=1, default=0.3)
+
+
+class TopSellersQuerySerializer(serializers.Serializer):
+    window = serializers.ChoiceField(
+        choices=list(settings.TOP_SELLERS["WINDOWS"]), default="hour"
+    )
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.TOP_SELLERS["K"], default=10
+    )
+
+
+class PriceHistoryQuerySerializer(serializers.Serializer):
+    """Range of a price history, `until` defaults to now and `since` to
+    PRICE_HISTORY["DEFAULT_DAYS"] days before it"""
+
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    resolution = serializers.ChoiceField(choices=["raw", "hour", "day"], required=False)
+
+    def validate(self, data):
+        data.setdefault("until", timezone.now())
+        data.setdefault(
+            "since",
+            data["until"]
+            - datetime.timedelta(days=settings.PRICE_HISTORY["DEFAULT_DAYS"]),
+        )
+        if data["since"] > data["until"]:
+            raise serializers.ValidationError("since must be before until")
+        return data
+
+
+class BulkAttachProductSerializer(serializers.Serializer):
+    """
+    Parse a bulk attach payload into {listing_id: product_id} pairs.
+
+    Accepts either {"product": id, "listings": [id, ...]} to attach one product
+    to many listings, or a list of [listing, product] pairs (or of
+    {"listing": id, "product": id} objects).
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, Mapping):
+            product = self.to_id(data.get("product"), "product")
+            listings = data.get("listings")
+            if not isinstance(listings, list):
+                raise serializers.ValidationError({"listings": ["Expected a list."]})
+            items = [(listing, product) for listing in listings]
+        elif isinstance(data, list):
+            items = [self.to_pair(item) for item in data]
+        else:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: ["Expected an object or a list."]}
+            )
+
+        pairs = {}
+        for listing, product in items:
+            listing = self.to_id(listing, "listings")
+            if pairs.setdefault(listing, product) != product:
+                raise serializers.ValidationError(
+                    {"listings": ["Listing {} given several products.".format(listing)]}
+                )
+        if not pairs:
+            raise serializers.ValidationError({"listings": ["Expected at least one."]})
+        return {"pairs": pairs}
+
+    def to_pair(self, item):
+        if isinstance(item, Mapping):
+            item = [item.get("listing"), item.get("product")]
+        if not isinstance(item, list) or len(item) != 2:
+            raise serializers.ValidationError(
+                {"listings": ["Expected [listing, product] pairs."]}
+            )
+        return item[0], self.to_id(item[1], "product")
+
+    @staticmethod
+    def to_id(value, name):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        raise serializers.ValidationError({name: ["Expected an integer id."]})
+
+
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ["id", "merchant", "creation_date"]
+        fields = ["id", "merchant", "creation_date", "status", "total"]
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrder
+        fields = OrderSerializer.Meta.fields
+
+
+class OrderCursorField(serializers.Field):
+    """Opaque position (received_date, id) of an order in the sync order"""
+
+    default_error_messages = {"invalid": "Invalid cursor."}
+
+    def to_internal_value(self, data):
+        try:
+            date, pk = base64.urlsafe_b64decode(data.encode()).decode().split("|")
+            date, pk = parse_datetime(date), int(pk)
+        except ValueError:
+            self.fail("invalid")
+        if date is None:
+            self.fail("invalid")
+        return date, pk
+
+    def to_representation(self, value):
+        date, pk = value
+        position = "{}|{}".format(date.isoformat(), pk)
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+class OrderRangeSerializer(serializers.Serializer):
+    """Query parameters of the order list, both bounds are inclusive.
+
+    Incremental syncs give `after`, the X-Next-Cursor of their last page, or
+    `limit` for their first one: orders are then returned by (received_date,
+    id), `limit` at a time. received_date is set by the server, unlike
+    creation_date."""
+
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    after = OrderCursorField(required=False)
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=settings.ORDER_SYNC["MAX_LIMIT"]
+    )
+
+    def validate(self, data):
+        since = data.get("since")
+        until = data.get("until")
+        if since is not None and until is not None and since > until:
+            raise serializers.ValidationError("since must be before until")
+        return data
 
 
 class OrderLineSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderLine
-        fields = ["id", "order", "listing", "quantity"]
+        fields = [
+            "id",
+            "order",
+            "listing",
+            "quantity",
+            "unit_price",
+            "returned_quantity",
+        ]
+
 
+class OrderLinesSerializer(serializers.Serializer):
+    """
+    Parse the lines of an order, or of a return, into normalized lines.
+
+    listings and quantities are accepted as a single integer, a comma separated
+    string ("1,2,3") or a JSON array of integers. Both are validated in a single
+    pass and lines on the same listing are merged by summing their quantities,
+    so the validated data holds each listing id once, in order of appearance.
+    """
 
-class OrderPushSerializer(serializers.Serializer):
     listings = serializers.ListField(child=serializers.IntegerField())
-    quantities = serializers.ListField(child=serializers.IntegerField())
-    creation_date = serializers.DateTimeField(default=timezone.now())
+    quantities = serializers.ListField(child=serializers.IntegerField(min_value=1))
 
     def to_internal_value(self, data):
+        if not isinstance(data, Mapping):
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: ["Expected a dictionary."]}
+            )
+        listings = self.to_list(data, "listings")
+        quantities = self.to_list(data, "quantities")
+        if len(listings) != len(quantities):
+            raise serializers.ValidationError(
+                {"quantities": ["Expected one quantity per listing."]}
+            )
+        if not listings:
+            raise serializers.ValidationError(
+                {"listings": ["Expected at least one listing."]}
+            )
+
+        # Validate both lists and merge duplicated listings in one pass
+        lines = {}
+        for ix, (listing, quantity) in enumerate(zip(listings, quantities)):
+            listing = self.to_integer(listing, "listings", ix)
+            quantity = self.to_integer(quantity, "quantities", ix)
+            if quantity < 1:
+                raise serializers.ValidationError(
+                    {"quantities": ["Item {} must be at least 1.".format(ix)]}
+                )
+            lines[listing] = lines.get(listing, 0) + quantity
+
+        return {"listings": list(lines), "quantities": list(lines.values())}
+
+    @staticmethod
+    def to_list(data, name):
+        value = data.get(name)
         # Convert single integer to list of 1 element
-        if is_integer(data["listings"]):
-            data["listings"] = [data["listings"]]
-            data["quantities"] = [data["quantities"]]
-            return data
-
-        # Convert comma separated digits to list of integers
-        data["listings"] = data["listings"].split(",") if data["listings"] else []
-        data["quantities"] = data["quantities"].split(",") if data["quantities"] else []
-        return data
+        if isinstance(value, int) and not isinstance(value, bool):
+            return [value]
+        # Convert comma separated digits to list of strings, parsed afterwards
+        if isinstance(value, str):
+            return value.split(",") if value.strip() else []
+        if isinstance(value, list):
+            return value
+        raise serializers.ValidationError(
+            {name: ["Expected an integer, a comma separated string or a list."]}
+        )
+
+    @staticmethod
+    def to_integer(value, name, ix):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        raise serializers.ValidationError(
+            {name: ["Item {} is not a valid integer.".format(ix)]}
+        )
+
+
+class OrderPushSerializer(OrderLinesSerializer):
+    creation_date = serializers.DateTimeField(default=timezone.now)
+
+    def to_internal_value(self, data):
+        validated = super().to_internal_value(data)
+        validated["creation_date"] = self.fields["creation_date"].run_validation(
+            data.get("creation_date", empty)
+        )
+        return validated
+
+
+class OrderCancelSerializer(serializers.Serializer):
+    orders = serializers.ListField(
+        child=serializers.IntegerField(), min_length=1, max_length=10000
+    )
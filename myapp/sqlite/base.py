@@ -0,0 +1,45 @@
+"""
+SQLite backend tuned for concurrent writers.
+
+Set as ENGINE "myapp.sqlite", with three OPTIONS on top of the sqlite3 ones:
+
+- `pragmas`, applied to every new connection. WAL lets readers run while a
+  transaction writes, and busy_timeout makes a writer wait for the lock
+  instead of failing at once with "database is locked".
+- `transaction_mode`, the BEGIN of transactions. With IMMEDIATE a transaction
+  takes the write lock when it starts, waiting up to busy_timeout for it. A
+  DEFERRED one only takes it on its first write, and fails without waiting if
+  another connection wrote since its first read. Defaults to DEFERRED, so that
+  read-only transactions run concurrently.
+- `write_transaction_mode`, the BEGIN of the transactions opened by
+  `myapp.writes.write_transaction()`, defaults to `transaction_mode`.
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set by myapp.writes while it begins a write transaction
+        self.write_intent = False
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in ["pragmas", "transaction_mode", "write_transaction_mode"]:
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        options = self.settings_dict["OPTIONS"]
+        for name, value in options.get("pragmas", {}).items():
+            conn.execute("PRAGMA {} = {}".format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        options = self.settings_dict["OPTIONS"]
+        mode = options.get("transaction_mode", "DEFERRED")
+        if self.write_intent:
+            mode = options.get("write_transaction_mode", mode)
+        self.cursor().execute("BEGIN {}".format(mode))
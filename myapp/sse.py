@@ -0,0 +1,125 @@
+"""
+Server-sent events feed of listing stock and price changes.
+
+    GET /myapp/listing/events?listings=1,2,3
+
+Served by the ASGI application only: a client holds one connection instead of
+polling listing/<pk>, and gets a `listing` event with the current quantity
+and price of every listing it subscribed to, then one whenever they change.
+EventSource cannot set headers, so the token may also be given as ?token=.
+"""
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+from myapp.events import bus
+
+PATH = "/myapp/listing/events"
+
+
+def authenticate(key):
+    token = Token.objects.select_related("user").filter(key=key).first()
+    return token is not None and token.user.is_active
+
+
+def format_event(listing_id, quantity, price):
+    data = json.dumps({"id": listing_id, "quantity": quantity, "price": str(price)})
+    return "event: listing\ndata: {}\n\n".format(data).encode()
+
+
+class ListingEventsApp:
+    """ASGI middleware serving the feed at PATH and the rest with `app`"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != PATH:
+            return await self.app(scope, receive, send)
+
+        if scope["method"] != "GET":
+            return await self.respond(send, 405, "Method not allowed.")
+
+        params = parse_qs(scope["query_string"].decode("latin-1"))
+        headers = dict(scope["headers"])
+        key = params.get("token", [""])[0]
+        keyword, _, header_key = headers.get(b"authorization", b"").partition(b" ")
+        if keyword == b"Token":
+            key = header_key.decode("latin-1").strip()
+        if not key or not await sync_to_async(authenticate)(key):
+            return await self.respond(send, 401, "Invalid token.")
+
+        try:
+            listing_ids = {
+                int(pk) for pk in params.get("listings", [""])[0].split(",") if pk
+            }
+        except ValueError:
+            return await self.respond(send, 400, "Expected listing ids.")
+        if not 0 < len(listing_ids) <= settings.LISTING_EVENTS["MAX_LISTINGS"]:
+            return await self.respond(
+                send,
+                400,
+                "Expected 1 to {} listings.".format(
+                    settings.LISTING_EVENTS["MAX_LISTINGS"]
+                ),
+            )
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # Don't let a reverse proxy buffer the stream
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        subscription = await bus.subscribe(listing_ids)
+        stream = asyncio.ensure_future(self.stream(subscription, send))
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await asyncio.wait(
+                [stream, disconnect], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            bus.unsubscribe(subscription)
+            stream.cancel()
+            disconnect.cancel()
+
+    async def stream(self, subscription, send):
+        keepalive = settings.LISTING_EVENTS["KEEPALIVE"]
+        while True:
+            changes = await subscription.get(keepalive)
+            # A comment line keeps idle connections open through proxies
+            body = b"".join(format_event(*change) for change in changes)
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body or b": keepalive\n\n",
+                    "more_body": True,
+                }
+            )
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def respond(send, status, detail):
+        body = json.dumps({"detail": detail}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,53 @@
+"""
+Set-based stock updates.
+
+Stock changes of many listings are applied with one UPDATE per batch, adding a
+per-row delta chosen with CASE WHEN to the current value, instead of one
+read-modify-write per listing.
+"""
+
+from django.db.models import Case, F, IntegerField, Value, When
+
+from myapp.models import Listing
+
+# Each listing costs 3 query parameters (IN list + WHEN pk + THEN delta)
+BATCH_SIZE = 500
+
+
+def add_deltas(queryset, field, deltas, batch_size=BATCH_SIZE, key="pk", **values):
+    """Add deltas given as {pk: delta} to `field` of the rows of `queryset`,
+    with one UPDATE per batch. Returns the number of updated rows.
+
+    Rows may be identified by another unique column of `queryset` than pk,
+    given as `key`. `values` are set on the updated rows too."""
+    deltas = [(pk, delta) for pk, delta in deltas.items() if pk is not None and delta]
+    updated = 0
+    for start in range(0, len(deltas), batch_size):
+        batch = deltas[start : start + batch_size]
+        updated += queryset.filter(**{key + "__in": [pk for pk, _ in batch]}).update(
+            **{
+                field: F(field)
+                + Case(
+                    *[When(**{key: pk, "then": Value(delta)}) for pk, delta in batch],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            },
+            **values,
+        )
+    return updated
+
+
+def decrement(quantities):
+    """Remove {listing_id: quantity} from the stock of the listings.
+
+    Returns False, leaving the caller to roll back the transaction, if any
+    listing would end up with a negative stock (e.g. it was sold concurrently
+    since its quantity was checked)."""
+    add_deltas(Listing.objects, "quantity", {pk: -q for pk, q in quantities.items()})
+    pks = list(quantities)
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = pks[start : start + BATCH_SIZE]
+        if Listing.objects.filter(pk__in=batch, quantity__lt=0).exists():
+            return False
+    return True
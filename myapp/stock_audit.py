@@ -0,0 +1,105 @@
+"""
+Inventory consistency audit.
+
+Listing.stock_baseline counts the stock ever received by a listing: it only
+moves when its quantity is set by hand, while orders, cancellations and
+returns move its quantity and its order lines in step. So the quantity of a
+listing should always be
+
+    stock_baseline - sum(quantity - returned_quantity) of its order lines
+
+counting archived lines too. The audit checks this for one range of listing ids
+at a time with grouped aggregate queries. Ranges can be audited in parallel,
+drifted listings are then checked again and corrected one batch at a time.
+"""
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from myapp import events, product_stats
+from myapp.models import ArchivedOrderLine, Listing, OrderLine
+
+
+def sold_quantities(**lookups):
+    """Return {listing_id: quantity sold and not returned} for the listings
+    matching `lookups` on listing_id, e.g. listing_id__in=[...]"""
+    sold = {}
+    for model in (OrderLine, ArchivedOrderLine):
+        rows = (
+            model.objects.filter(**lookups)
+            .order_by()
+            .values("listing_id")
+            .annotate(net=Sum(F("quantity") - F("returned_quantity")))
+        )
+        for row in rows:
+            sold[row["listing_id"]] = sold.get(row["listing_id"], 0) + row["net"]
+    return sold
+
+
+def check(listings, sold):
+    """Return the discrepancies of `listings` as (listing, expected) pairs,
+    expected being None for a listing without baseline"""
+    discrepancies = []
+    for listing in listings:
+        if listing.stock_baseline is None:
+            discrepancies.append((listing, None))
+            continue
+        expected = listing.stock_baseline - sold.get(listing.pk, 0)
+        if listing.quantity != expected:
+            discrepancies.append((listing, expected))
+    return discrepancies
+
+
+def audit_range(start, stop):
+    """Audit the listings with start <= id < stop. Returns the discrepancies
+    as (listing_id, quantity, expected) tuples."""
+    # One transaction so that listings and order lines are read consistently
+    with transaction.atomic():
+        listings = Listing.objects.filter(pk__gte=start, pk__lt=stop).only(
+            "pk", "quantity", "stock_baseline"
+        )
+        sold = sold_quantities(listing_id__gte=start, listing_id__lt=stop)
+        return [
+            (listing.pk, listing.quantity, expected)
+            for listing, expected in check(listings, sold)
+        ]
+
+
+def repair(listing_ids):
+    """Check again the listings `listing_ids` and set the quantities that drifted
+    to the expected ones. Listings without baseline get one computed from their
+    current quantity. Returns the discrepancies that were repaired."""
+    with transaction.atomic():
+        # Orders must not change the quantities between the check and the fix
+        listings = (
+            Listing.objects.filter(pk__in=listing_ids)
+            .only("pk", "product_id", "quantity", "stock_baseline")
+            .select_for_update()
+        )
+        sold = sold_quantities(listing_id__in=listing_ids)
+        discrepancies = check(listings, sold)
+        if not discrepancies:
+            return []
+
+        repaired = []
+        for listing, expected in discrepancies:
+            repaired.append((listing.pk, listing.quantity, expected))
+            if expected is None:
+                listing.stock_baseline = listing.quantity + sold.get(listing.pk, 0)
+            else:
+                listing.quantity = expected
+        listings = [listing for listing, _ in discrepancies]
+        Listing.objects.bulk_update(
+            listings, ["quantity", "stock_baseline"], batch_size=1000
+        )
+        # Recomputed, the product may not have drifted with its listings
+        product_stats.refresh(
+            list({listing.product_id for listing in listings} - {None})
+        )
+        events.bus.publish_on_commit(listing.pk for listing in listings)
+    return repaired
+
+
+def audit_chunk(bounds):
+    # Entry point of the worker processes
+    return audit_range(*bounds)
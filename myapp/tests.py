@@ -1,15 +1,71 @@
+import datetime
+import gzip
+import hashlib
+import hmac
+import http.server
+import importlib.util
 import json
+import os
+import random
+import sys
+import tempfile
+import threading
 from collections import OrderedDict
-
+from concurrent.futures import Future
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.core.management import CommandError, call_command
+from django.test.utils import CaptureQueriesContext
 from rest_framework.authtoken.models import Token
 
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
-from myapp.models import Product, Merchant, Listing, OrderLine, Order
+from myapp import (
+    events,
+    price_history,
+    returns,
+    sales,
+    tracing,
+    warmup,
+    webhooks,
+    writes,
+)
+from myapp.sqlite.base import DatabaseWrapper
+from myapp.admin import EstimatedCountPaginator
+from myapp.management.commands import bench_product_matching
+from myapp.matching import TrigramIndex, dice, product_index, trigrams
+from myapp.middleware import compress_stream, negotiate_encoding
+from myapp.models import (
+    Product,
+    Merchant,
+    Listing,
+    OrderLine,
+    Order,
+    ArchivedOrder,
+    ArchivedOrderLine,
+    OutboxEvent,
+    PriceBucket,
+    PriceChange,
+    SalesBucket,
+    WebhookEndpoint,
+)
+from myapp.serializers import OrderPushSerializer
+from myapp.sse import ListingEventsApp
+from myapp.throttling import CacheBucketStore, LocalBucketStore, local_store
 
 
 class ProductViewSetTestCase(TestCase):
@@ -56,7 +112,13 @@ class ProductViewSetTestCase(TestCase):
 
     def test_view_get_returns_the_correct_object(self):
         # ARRANGE
-        expected_result = {"id": 1, "name": "iPhone X de Pelloch"}
+        expected_result = {
+            "id": 1,
+            "name": "iPhone X de Pelloch",
+            "listing_count": 0,
+            "min_price": None,
+            "total_stock": 0,
+        }
 
         # ACT
         response = self.client.get(self.url)
@@ -95,7 +157,13 @@ class ProductViewSetTestCase(TestCase):
     def test_view_update_correctly_product(self):
         # ARRANGE
         header = {"HTTP_AUTHORIZATION": "Token {}".format(self.token.key)}
-        expected_result = {"id": 1, "name": "updated or created Product name"}
+        expected_result = {
+            "id": 1,
+            "name": "updated or created Product name",
+            "listing_count": 0,
+            "min_price": None,
+            "total_stock": 0,
+        }
 
         # ACT
         response = self.client.put(
@@ -326,6 +394,38 @@ class ListingViewSetTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, expected_result)
 
+    def test_view_update_keeps_stock_sold_since_the_listing_was_read(self):
+        # ARRANGE
+        header = {"HTTP_AUTHORIZATION": "Token {}".format(self.token.key)}
+        baseline = Listing.objects.get(pk=self.listing.pk).stock_baseline
+        total_stock = Product.objects.get(pk=1).total_stock
+        run = writes.write_queue.run
+
+        def sell_then_run(job):
+            # An order committed between the request and its write
+            Listing.objects.filter(pk=self.listing.pk).update(
+                quantity=F("quantity") - 20
+            )
+            return run(job)
+
+        # ACT
+        with mock.patch.object(writes.write_queue, "run", sell_then_run):
+            response = self.client.put(
+                self.url,
+                data=self.encoded_data,
+                content_type=self.content_type,
+                **header
+            )
+
+        # ASSERT
+        listing = Listing.objects.get(pk=self.listing.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["quantity"], 12)
+        self.assertEqual(listing.quantity, 12)
+        # 100 left, set to 12: 88 written off
+        self.assertEqual(listing.stock_baseline, baseline - 88)
+        self.assertEqual(Product.objects.get(pk=1).total_stock, total_stock - 88)
+
     def test_view_attach_product_to_listing(self):
         # ARRANGE
         header = {"HTTP_AUTHORIZATION": "Token {}".format(self.token.key)}
@@ -491,10 +591,26 @@ class OrderAPIViewTestCase(TestCase):
             "id": 1,
             "merchant": self.merchant.pk,
             "creation_date": "2021-07-22T12:20:22.600614Z",
+            "status": Order.PLACED,
+            "total": "15140.00",
         }
         expected_orderlines = {
-            1: {"id": 1, "order_id": 1, "listing_id": 1, "quantity": 15},
-            2: {"id": 2, "order_id": 1, "listing_id": 2, "quantity": 1},
+            1: {
+                "id": 1,
+                "order_id": 1,
+                "listing_id": 1,
+                "quantity": 15,
+                "unit_price": Decimal("990.00"),
+                "returned_quantity": 0,
+            },
+            2: {
+                "id": 2,
+                "order_id": 1,
+                "listing_id": 2,
+                "quantity": 1,
+                "unit_price": Decimal("290.00"),
+                "returned_quantity": 0,
+            },
         }
 
         expected_listings_quantity = {1: 120 - 15, 2: 2 - 1}
@@ -553,6 +669,8 @@ class OrderAPIViewTestCase(TestCase):
                     "id": 1,
                     "merchant": 1,
                     "creation_date": "2021-07-22T00:00:00Z",
+                    "status": Order.PLACED,
+                    "total": None,
                 }
             ),
             OrderedDict(
@@ -560,6 +678,8 @@ class OrderAPIViewTestCase(TestCase):
                     "id": 2,
                     "merchant": 1,
                     "creation_date": "2021-07-22T00:00:00Z",
+                    "status": Order.PLACED,
+                    "total": None,
                 },
             ),
         ]
@@ -570,3 +690,2648 @@ class OrderAPIViewTestCase(TestCase):
         # ASSERT
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, expected_result)
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        # Enough products for the listing page to be above the size threshold
+        Product.objects.bulk_create(
+            [Product(name="Refurbished phone model {}".format(i)) for i in range(100)]
+        )
+        cls.url = reverse("product")
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_response_is_gzipped_when_client_accepts_it(self):
+        # ARRANGE
+
+        # ACT
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        products = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(products), 100)
+
+    def test_response_is_not_compressed_if_client_does_not_accept_it(self):
+        # ARRANGE
+
+        # ACT
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+
+        # ASSERT
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(json.loads(response.content)), 100)
+
+    def test_encoding_with_the_highest_q_value_is_picked(self):
+        # ARRANGE
+        headers = {
+            "gzip;q=1, br;q=0.5": "gzip",
+            "gzip;q=0.5, br": "br",
+            "gzip, br": "br",
+            "br;q=0, *": "gzip",
+            "*;q=0.1, gzip;q=0.2": "gzip",
+            "br;q=0, gzip;q=0": None,
+            "deflate": None,
+        }
+
+        # ACT
+        with mock.patch("myapp.middleware.brotli", object()):
+            encodings = {header: negotiate_encoding(header) for header in headers}
+
+        # ASSERT
+        self.assertEqual(encodings, headers)
+
+    def test_small_response_is_not_compressed(self):
+        # ARRANGE
+        url = reverse("single-product", kwargs={"pk": Product.objects.first().pk})
+
+        # ACT
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+
+        # ASSERT
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_compressed_body_is_served_from_cache(self):
+        # ARRANGE
+        self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        # ACT
+        with mock.patch("myapp.middleware.compress_body") as compress_body:
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        # ASSERT
+        compress_body.assert_not_called()
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 100)
+
+    def test_streaming_body_is_compressed_incrementally(self):
+        # ARRANGE
+        chunks = [b"<li>row %d</li>" % i for i in range(1000)]
+
+        # ACT
+        compressed = list(compress_stream(iter(chunks), "gzip"))
+
+        # ASSERT
+        self.assertGreater(len(compressed), 1)
+        self.assertEqual(gzip.decompress(b"".join(compressed)), b"".join(chunks))
+
+
+class ListingFilterTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product(pk=1, name="iPhone X de Pelloch")
+        cls.product.save()
+        Listing(pk=1, product=cls.product, title="cheap", price=30, quantity=5).save()
+        Listing(pk=2, product=cls.product, title="mid", price=120, quantity=0).save()
+        Listing(pk=3, product=None, title="mid", price=180, quantity=2).save()
+        Listing(pk=4, product=cls.product, title="high", price=990, quantity=1).save()
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+        cls.url = reverse("listing")
+        cls.url_facets = reverse("listing-facets")
+
+    def test_view_filters_in_stock_listings_by_price_range(self):
+        # ARRANGE
+        params = {"in_stock": "true", "min_price": "100", "max_price": "1000"}
+
+        # ACT
+        response = self.client.get(self.url, params, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([listing["id"] for listing in response.data], [3, 4])
+
+    def test_view_filters_by_product_and_sorts_by_price(self):
+        # ARRANGE
+        params = {"product": 1, "ordering": "-price"}
+
+        # ACT
+        response = self.client.get(self.url, params, **self.header)
+
+        # ASSERT
+        self.assertEqual([listing["id"] for listing in response.data], [4, 2, 1])
+
+    def test_view_raises_400_if_price_range_is_inverted(self):
+        # ARRANGE
+        params = {"min_price": "500", "max_price": "100"}
+
+        # ACT
+        response = self.client.get(self.url, params, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_view_facets_counts_listings_by_price_bucket_in_one_query(self):
+        # ARRANGE
+        expected_buckets = {0: 1, 50: 0, 100: 2, 250: 0, 500: 1, 1000: 0}
+
+        # ACT
+        with self.assertNumQueries(2):  # token authentication + aggregate
+            response = self.client.get(self.url_facets, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(response.data["in_stock"], 3)
+        self.assertEqual(
+            {b["min"]: b["count"] for b in response.data["price_buckets"]},
+            expected_buckets,
+        )
+
+
+class ProductAggregatesTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.content_type = "application/json"
+
+    def setUp(self):
+        self.product = Product.objects.create(name="iPhone X de Pelloch")
+
+    def create_listing(self, **data):
+        response = self.client.post(
+            reverse("listing"),
+            data=json.dumps(data),
+            content_type=self.content_type,
+            **self.header
+        )
+        return response.data["id"]
+
+    def assertAggregates(self, listing_count, min_price, total_stock):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.listing_count, listing_count)
+        self.assertEqual(self.product.min_price, min_price)
+        self.assertEqual(self.product.total_stock, total_stock)
+
+    def test_creating_listings_updates_product_aggregates(self):
+        # ARRANGE
+
+        # ACT
+        self.create_listing(product=self.product.pk, title="a", price=300, quantity=4)
+        self.create_listing(product=self.product.pk, title="b", price=250, quantity=1)
+
+        # ASSERT
+        self.assertAggregates(2, Decimal("250.00"), 5)
+
+    def test_updating_cheapest_listing_price_recomputes_min_price(self):
+        # ARRANGE
+        self.create_listing(product=self.product.pk, title="a", price=300, quantity=4)
+        cheapest = self.create_listing(
+            product=self.product.pk, title="b", price=250, quantity=1
+        )
+        data = {"title": "b", "price": 400, "quantity": 3}
+
+        # ACT
+        self.client.put(
+            reverse("single-listing", kwargs={"pk": cheapest}),
+            data=json.dumps(data),
+            content_type=self.content_type,
+            **self.header
+        )
+
+        # ASSERT
+        self.assertAggregates(2, Decimal("300.00"), 7)
+
+    def test_attaching_a_product_updates_product_aggregates(self):
+        # ARRANGE
+        listing = self.create_listing(title="a", price=120, quantity=6)
+
+        # ACT
+        self.client.put(
+            reverse("attach-product", kwargs={"pk": listing}),
+            data=json.dumps({"product": self.product.pk}),
+            content_type=self.content_type,
+            **self.header
+        )
+
+        # ASSERT
+        self.assertAggregates(1, Decimal("120.00"), 6)
+
+    def test_ordering_depletes_product_total_stock(self):
+        # ARRANGE
+        listing = self.create_listing(
+            product=self.product.pk, title="a", price=120, quantity=6
+        )
+        data = {"listings": listing, "quantities": 4}
+
+        # ACT
+        self.client.post(
+            reverse("orders"),
+            data=json.dumps(data),
+            content_type=self.content_type,
+            **self.header
+        )
+
+        # ASSERT
+        self.assertAggregates(1, Decimal("120.00"), 2)
+
+    def test_command_repairs_drifted_aggregates(self):
+        # ARRANGE
+        Listing(product=self.product, title="a", price=80, quantity=3).save()
+        Listing(product=self.product, title="b", price=60, quantity=2).save()
+        out = StringIO()
+
+        # ACT
+        call_command(
+            "check_product_aggregates", "--repair", "--chunk-size=1", stdout=out
+        )
+
+        # ASSERT
+        self.assertAggregates(2, Decimal("60.00"), 5)
+        self.assertIn("1 products checked, 1 repaired", out.getvalue())
+
+
+class OrderPushSerializerTestCase(TestCase):
+    def test_serializer_accepts_json_arrays_and_comma_strings(self):
+        # ARRANGE
+        payloads = [
+            {"listings": [1, 2], "quantities": [3, 4]},
+            {"listings": "1,2", "quantities": "3,4"},
+            {"listings": ["1", "2"], "quantities": [3, "4"]},
+        ]
+
+        for data in payloads:
+            # ACT
+            serializer = OrderPushSerializer(data=data)
+
+            # ASSERT
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(serializer.validated_data["listings"], [1, 2])
+            self.assertEqual(serializer.validated_data["quantities"], [3, 4])
+
+    def test_serializer_merges_duplicated_listings(self):
+        # ARRANGE
+        data = {"listings": "7,3,7,7", "quantities": "1,2,3,4"}
+
+        # ACT
+        serializer = OrderPushSerializer(data=data)
+
+        # ASSERT
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data["listings"], [7, 3])
+        self.assertEqual(serializer.validated_data["quantities"], [8, 2])
+
+    def test_serializer_rejects_invalid_payloads(self):
+        # ARRANGE
+        payloads = [
+            {"listings": "1,2", "quantities": "1"},
+            {"listings": "1,a", "quantities": "1,1"},
+            {"listings": [1, 2.5], "quantities": [1, 1]},
+            {"listings": "1", "quantities": "0"},
+            {"listings": "", "quantities": ""},
+            {"listings": {"1": 1}, "quantities": 1},
+        ]
+
+        for data in payloads:
+            # ACT
+            serializer = OrderPushSerializer(data=data)
+
+            # ASSERT
+            self.assertFalse(serializer.is_valid(), data)
+
+    def test_serializer_parses_large_orders(self):
+        # ARRANGE
+        data = {
+            "listings": ",".join(str(i % 5000) for i in range(20000)),
+            "quantities": ",".join("1" for _ in range(20000)),
+        }
+
+        # ACT
+        serializer = OrderPushSerializer(data=data)
+
+        # ASSERT
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(len(serializer.validated_data["listings"]), 5000)
+        self.assertEqual(set(serializer.validated_data["quantities"]), {4})
+
+
+class OrderCreationTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product.objects.create(name="iPhone X de Pelloch")
+        Listing.objects.bulk_create(
+            [
+                Listing(product=cls.product, title="listing", price=10, quantity=50)
+                for _ in range(20)
+            ]
+        )
+        cls.listings = list(Listing.objects.order_by("pk"))
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.url = reverse("orders")
+        cls.content_type = "application/json"
+
+    def post_order(self, data):
+        return self.client.post(
+            self.url,
+            data=json.dumps(data),
+            content_type=self.content_type,
+            **self.header
+        )
+
+    def test_view_merges_duplicated_listings_into_one_orderline(self):
+        # ARRANGE
+        pk = self.listings[0].pk
+        data = {"listings": [pk, pk], "quantities": [2, 3]}
+
+        # ACT
+        response = self.post_order(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(OrderLine.objects.values_list("listing_id", "quantity")), [(pk, 5)]
+        )
+        self.assertEqual(Listing.objects.get(pk=pk).quantity, 45)
+
+    def test_view_query_count_does_not_depend_on_the_number_of_lines(self):
+        # ARRANGE
+        data = {
+            "listings": [listing.pk for listing in self.listings],
+            "quantities": [1] * len(self.listings),
+        }
+
+        # ACT
+        with self.assertNumQueries(13):
+            response = self.post_order(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(OrderLine.objects.count(), 20)
+
+    def test_view_does_not_create_anything_if_a_listing_is_missing(self):
+        # ARRANGE
+        data = {"listings": [self.listings[0].pk, 10000], "quantities": [1, 1]}
+
+        # ACT
+        response = self.post_order(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).quantity, 50)
+
+    def test_view_raises_400_on_invalid_payload(self):
+        # ARRANGE
+        data = {"listings": "1,x", "quantities": "1,1"}
+
+        # ACT
+        response = self.post_order(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    MERCHANT_THROTTLE={"STORE": "local", "RATES": {"orders": (100, 1000)}}
+)
+class OrderReturnTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product.objects.create(name="iPhone X de Pelloch", total_stock=0)
+        Listing.objects.bulk_create(
+            [
+                Listing(product=cls.product, title="listing", price=10, quantity=50)
+                for _ in range(3)
+            ]
+        )
+        cls.listings = list(Listing.objects.order_by("pk"))
+        Product.objects.filter(pk=cls.product.pk).update(total_stock=150)
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.content_type = "application/json"
+
+    def tearDown(self):
+        # User pks are reused between test cases, so are their buckets
+        local_store.clear()
+
+    def post(self, url, data=None):
+        return self.client.post(
+            url,
+            data=json.dumps(data or {}),
+            content_type=self.content_type,
+            **self.header
+        )
+
+    def place_order(self, quantities):
+        data = {
+            "listings": [listing.pk for listing in self.listings],
+            "quantities": quantities,
+        }
+        response = self.post(reverse("orders"), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["id"]
+
+    def stock(self):
+        quantities = list(
+            Listing.objects.order_by("pk").values_list("quantity", flat=True)
+        )
+        return quantities, Product.objects.get(pk=self.product.pk).total_stock
+
+    def test_view_cancel_restocks_listings_and_product(self):
+        # ARRANGE
+        order = self.place_order([1, 2, 3])
+
+        # ACT
+        response = self.post(reverse("cancel-order", args=[order]))
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], Order.CANCELLED)
+        self.assertEqual(self.stock(), ([50, 50, 50], 150))
+        response = self.post(reverse("cancel-order", args=[order]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_view_partial_return_restocks_returned_items(self):
+        # ARRANGE
+        order = self.place_order([1, 2, 3])
+        data = {"listings": [self.listings[1].pk], "quantities": [2]}
+
+        # ACT
+        response = self.post(reverse("return-order-lines", args=[order]), data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], Order.PARTIALLY_RETURNED)
+        self.assertEqual(self.stock(), ([49, 50, 47], 146))
+
+        # Cancelling afterwards only restocks what was not returned yet
+        self.post(reverse("cancel-order", args=[order]))
+        self.assertEqual(self.stock(), ([50, 50, 50], 150))
+
+    def test_view_raises_400_when_returning_more_than_ordered(self):
+        # ARRANGE
+        order = self.place_order([1, 2, 3])
+        data = {"listings": [self.listings[0].pk], "quantities": [2]}
+
+        # ACT
+        response = self.post(reverse("return-order-lines", args=[order]), data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(), ([49, 48, 47], 144))
+        self.assertEqual(Order.objects.get(pk=order).status, Order.PLACED)
+
+    def test_view_bulk_cancel_query_count_does_not_depend_on_the_number_of_orders(
+        self,
+    ):
+        # ARRANGE
+        orders = [self.place_order([1, 1, 1]) for _ in range(10)]
+
+        # ACT
+        with self.assertNumQueries(15):
+            response = self.post(reverse("cancel-orders"), {"orders": orders})
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data["cancelled"]), orders)
+        self.assertEqual(self.stock(), ([50, 50, 50], 150))
+        self.assertFalse(Order.objects.exclude(status=Order.CANCELLED).exists())
+
+    def test_cancel_and_return_are_taken_off_the_sales(self):
+        # ARRANGE
+        cancelled = self.place_order([1, 2, 3])
+        returned = self.place_order([1, 2, 3])
+        data = {"listings": [self.listings[1].pk], "quantities": [2]}
+
+        # ACT
+        self.post(reverse("cancel-order", args=[cancelled]))
+        self.post(reverse("return-order-lines", args=[returned]), data)
+
+        # ASSERT
+        sold = dict(
+            SalesBucket.objects.values_list("listing_id").annotate(Sum("quantity"))
+        )
+        self.assertEqual(
+            sold,
+            {self.listings[0].pk: 1, self.listings[1].pk: 0, self.listings[2].pk: 3},
+        )
+
+    def test_cancel_skips_orders_cancelled_concurrently(self):
+        # ARRANGE
+        first = self.place_order([1, 1, 1])
+        second = self.place_order([1, 1, 1])
+        returns.cancel_orders(Order.objects.filter(pk=second))
+        # Both orders were read as not cancelled before the other cancel committed
+        orders = mock.Mock()
+        orders.exclude.return_value.values_list.return_value = [first, second]
+
+        # ACT
+        cancelled = returns.cancel_orders(orders)
+
+        # ASSERT
+        self.assertEqual(cancelled, [first])
+        self.assertEqual(self.stock(), ([50, 50, 50], 150))
+
+    def test_view_cannot_cancel_orders_of_other_merchants(self):
+        # ARRANGE
+        order = self.place_order([1, 1, 1])
+        user = User.objects.create(username="Augustin", password="fake-password")
+        Merchant.objects.create(user=user)
+        token = Token.objects.create(user=user)
+        header = {"HTTP_AUTHORIZATION": "Token {}".format(token.key)}
+
+        # ACT
+        response = self.client.post(reverse("cancel-order", args=[order]), **header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Order.objects.get(pk=order).status, Order.PLACED)
+
+
+class OrderTotalTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.listings = [
+            Listing.objects.create(title="listing", price=price, quantity=50)
+            for price in (Decimal("10.50"), Decimal("3.20"))
+        ]
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+    def tearDown(self):
+        local_store.clear()
+
+    def test_view_captures_prices_which_survive_repricing(self):
+        # ARRANGE
+        data = {
+            "listings": [listing.pk for listing in self.listings],
+            "quantities": [2, 5],
+        }
+
+        # ACT
+        response = self.client.post(
+            reverse("orders"),
+            data=json.dumps(data),
+            content_type="application/json",
+            **self.header
+        )
+        Listing.objects.update(price=99)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total"], "37.00")
+        self.assertEqual(Order.objects.get().total, Decimal("37.00"))
+        self.assertEqual(
+            list(OrderLine.objects.order_by("pk").values_list("unit_price", flat=True)),
+            [Decimal("10.50"), Decimal("3.20")],
+        )
+
+    def test_command_backfills_orders_created_without_prices(self):
+        # ARRANGE
+        orders = [Order.objects.create(merchant=self.merchant) for _ in range(3)]
+        for order in orders[:2]:
+            OrderLine.objects.create(order=order, listing=self.listings[0], quantity=2)
+            OrderLine.objects.create(order=order, listing=self.listings[1], quantity=1)
+        out = StringIO()
+
+        # ACT
+        call_command("backfill_order_totals", chunk_size=2, stdout=out)
+
+        # ASSERT
+        self.assertEqual(
+            [order.total for order in Order.objects.order_by("pk")],
+            [Decimal("24.20"), Decimal("24.20"), Decimal("0")],
+        )
+        self.assertFalse(OrderLine.objects.filter(unit_price__isnull=True).exists())
+        self.assertIn("3 orders backfilled", out.getvalue())
+
+
+@override_settings(MERCHANT_THROTTLE={"STORE": "local", "RATES": {"orders": (0.5, 2)}})
+class MerchantRateThrottleTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product.objects.create(name="iPhone X de Pelloch")
+        cls.listing = Listing.objects.create(
+            product=cls.product, title="listing", price=10, quantity=50
+        )
+        cls.users = [
+            User.objects.create(username=name, password="fake-password")
+            for name in ("Pelloch", "Augustin")
+        ]
+        cls.headers = []
+        for user in cls.users:
+            Merchant.objects.create(user=user)
+            token = Token.objects.create(user=user)
+            cls.headers.append({"HTTP_AUTHORIZATION": "Token {}".format(token.key)})
+        cls.url = reverse("orders")
+        cls.data = json.dumps({"listings": cls.listing.pk, "quantities": 1})
+        cls.content_type = "application/json"
+
+    def setUp(self):
+        local_store.clear()
+
+    def tearDown(self):
+        # Buckets are keyed by user pk, which are reused by the next tests
+        local_store.clear()
+
+    def post_order(self, header):
+        return self.client.post(
+            self.url, data=self.data, content_type=self.content_type, **header
+        )
+
+    def test_view_returns_429_with_retry_after_when_bucket_is_empty(self):
+        # ARRANGE
+        self.post_order(self.headers[0])
+        self.post_order(self.headers[0])
+
+        # ACT
+        with self.assertNumQueries(1):  # token authentication only
+            response = self.post_order(self.headers[0])
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "2")
+
+    def test_view_throttles_each_merchant_separately(self):
+        # ARRANGE
+        for _ in range(3):
+            self.post_order(self.headers[0])
+
+        # ACT
+        response = self.post_order(self.headers[1])
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_view_does_not_throttle_reads(self):
+        # ARRANGE
+        for _ in range(3):
+            self.post_order(self.headers[0])
+
+        # ACT
+        response = self.client.get(self.url, **self.headers[0])
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bucket_refills_over_time(self):
+        # ARRANGE
+        store = LocalBucketStore()
+        store.consume("orders:1", 0.5, 1, now=100)
+
+        # ACT
+        throttled, wait = store.consume("orders:1", 0.5, 1, now=101)
+        allowed, _ = store.consume("orders:1", 0.5, 1, now=102)
+
+        # ASSERT
+        self.assertFalse(throttled)
+        self.assertEqual(wait, 1)
+        self.assertTrue(allowed)
+
+    def test_cache_store_shares_buckets(self):
+        # ARRANGE
+        cache = caches["default"]
+        cache.clear()
+        CacheBucketStore(cache).consume("orders:1", 0.5, 1, now=100)
+
+        # ACT
+        allowed, _ = CacheBucketStore(cache).consume("orders:1", 0.5, 1, now=100)
+
+        # ASSERT
+        self.assertFalse(allowed)
+
+
+class RecordedSpan:
+    def __init__(self, name, service, resource):
+        self.name = name
+        self.service = service
+        self.resource = resource
+        self.tags = {}
+        self.metrics = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def set_metric(self, key, value):
+        self.metrics[key] = value
+
+
+class RecordingTracer:
+    """Dummy tracer keeping the spans in memory instead of sending them"""
+
+    def __init__(self):
+        self.spans = []
+
+    def trace(self, name, service=None, resource=None):
+        span = RecordedSpan(name, service, resource)
+        self.spans.append(span)
+        return span
+
+    def get(self, name):
+        return next(span for span in self.spans if span.name == name)
+
+
+class AgentHandler(http.server.BaseHTTPRequestHandler):
+    payloads = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.payloads.append((self.path, body))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_POST = do_PUT
+
+    def do_GET(self):
+        self.send_response(404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TracingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product.objects.create(name="iPhone X de Pelloch")
+        Listing.objects.create(product=cls.product, title="a", price=10, quantity=5)
+        Listing.objects.create(product=cls.product, title="b", price=20, quantity=5)
+        cls.listings = list(Listing.objects.values_list("pk", flat=True))
+
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.data = json.dumps({"listings": cls.listings, "quantities": [1, 2]})
+
+    def setUp(self):
+        self.tracer = RecordingTracer()
+        tracing.set_tracer(self.tracer)
+
+    def tearDown(self):
+        tracing.set_tracer(None)
+
+    def test_order_creation_phases_are_traced(self):
+        # ARRANGE
+
+        # ACT
+        self.client.post(
+            reverse("orders"),
+            data=self.data,
+            content_type="application/json",
+            **self.header
+        )
+
+        # ASSERT
+        self.assertEqual(
+            [span.name for span in self.tracer.spans],
+            [
+                "order.create",
+                "order.parse",
+                "order.stock_check",
+                "order.line_insert",
+                "order.stock_decrement",
+                "order.sales",
+                "order.outbox",
+            ],
+        )
+        root = self.tracer.get("order.create")
+        self.assertEqual(root.tags["merchant.id"], self.merchant.pk)
+        self.assertEqual(root.metrics["order.lines"], 2)
+        self.assertEqual(
+            self.tracer.get("order.stock_check").metrics["db.query_count"], 1
+        )
+        self.assertGreater(root.metrics["db.query_count"], 4)
+
+    def test_list_endpoints_are_traced(self):
+        # ARRANGE
+
+        # ACT
+        self.client.get(reverse("listing"), **self.header)
+
+        # ASSERT
+        span = self.tracer.get("listing.list")
+        self.assertEqual(span.tags["user.id"], self.user.pk)
+        self.assertEqual(span.metrics["db.query_count"], 1)
+
+    def test_order_list_spans_are_tagged_with_the_merchant(self):
+        # ARRANGE
+        since = timezone.now() - datetime.timedelta(days=1)
+
+        # ACT
+        self.client.get(
+            reverse("orders"),
+            {"format": "json", "since": since.isoformat()},
+            **self.header
+        )
+        with self.assertNumQueries(4):  # token, merchant, orders, archive
+            self.client.get(reverse("orders"), {"limit": 10}, **self.header)
+
+        # ASSERT
+        span = self.tracer.get("order.list")
+        self.assertEqual(span.tags["merchant.id"], self.merchant.pk)
+        # The merchant is loaded once, before the span opens
+        self.assertEqual(span.metrics["db.query_count"], 1)
+        sync = self.tracer.get("order.sync")
+        self.assertEqual(sync.tags["merchant.id"], self.merchant.pk)
+
+    def test_tracing_is_a_noop_when_disabled(self):
+        # ARRANGE
+        tracing.set_tracer(None)
+
+        # ACT
+        context = tracing.span("order.create", **{"merchant.id": 1})
+
+        # ASSERT
+        self.assertIs(context, tracing.NOOP)
+
+    @skipUnless(importlib.util.find_spec("ddtrace"), "ddtrace is not installed")
+    @skipIf("ddtrace" in sys.modules, "ddtrace already configured by another test")
+    def test_spans_are_sent_to_the_agent(self):
+        # ARRANGE
+        agent = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AgentHandler)
+        threading.Thread(target=agent.serve_forever, daemon=True).start()
+        config = {
+            "ENABLED": True,
+            "SERVICE": "myapp-test",
+            "AGENT_URL": "http://127.0.0.1:{}".format(agent.server_port),
+        }
+
+        # ACT
+        with override_settings(DDTRACE=config), mock.patch.dict(os.environ):
+            with tracing.span("order.create", **{"merchant.id": 1}):
+                pass
+            tracing.get_tracer().flush()
+
+        # ASSERT
+        agent.shutdown()
+        bodies = [body for path, body in AgentHandler.payloads if "traces" in path]
+        self.assertTrue(any(b"order.create" in body for body in bodies))
+
+
+class BulkAttachProductTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.phone = Product.objects.create(name="iPhone X de Pelloch")
+        cls.tablet = Product.objects.create(name="iPad de Pelloch")
+        for ix in range(6):
+            Listing.objects.create(title="listing", price=100 + ix, quantity=ix)
+        cls.listings = list(Listing.objects.order_by("pk").values_list("pk", flat=True))
+        Listing.objects.filter(pk=cls.listings[5]).update(product=cls.tablet)
+
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.url = reverse("bulk-attach-product")
+
+    def put(self, data):
+        return self.client.put(
+            self.url,
+            data=json.dumps(data),
+            content_type="application/json",
+            **self.header
+        )
+
+    def test_view_attaches_one_product_to_many_listings(self):
+        # ARRANGE
+        data = {"product": self.phone.pk, "listings": self.listings[:3]}
+
+        # ACT
+        response = self.put(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["attached"], 3)
+        self.assertEqual(
+            set(
+                Listing.objects.filter(product=self.phone).values_list("pk", flat=True)
+            ),
+            set(self.listings[:3]),
+        )
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.listing_count, 3)
+        self.assertEqual(self.phone.min_price, Decimal("100.00"))
+        self.assertEqual(self.phone.total_stock, 0 + 1 + 2)
+
+    def test_view_returns_the_outcome_of_every_pair(self):
+        # ARRANGE
+        data = [
+            [self.listings[0], self.phone.pk],
+            {"listing": self.listings[1], "product": self.tablet.pk},
+            [self.listings[2], 10000],
+            [10000, self.phone.pk],
+            [self.listings[5], self.phone.pk],
+        ]
+
+        # ACT
+        response = self.put(data)
+
+        # ASSERT
+        self.assertEqual(
+            {
+                result["listing"]: result["status"]
+                for result in response.data["results"]
+            },
+            {
+                self.listings[0]: "attached",
+                self.listings[1]: "attached",
+                self.listings[2]: "product_not_found",
+                10000: "listing_not_found",
+                self.listings[5]: "already_attached",
+            },
+        )
+        self.assertEqual(
+            Listing.objects.get(pk=self.listings[5]).product_id, self.tablet.pk
+        )
+
+    def test_view_query_count_depends_only_on_the_number_of_products(self):
+        # ARRANGE
+        data = {"product": self.phone.pk, "listings": self.listings}
+
+        # ACT
+        # token, savepoint, listings, products, listings update, product update, release
+        with self.assertNumQueries(7):
+            response = self.put(data)
+
+        # ASSERT
+        self.assertEqual(response.data["attached"], 5)
+
+    def test_view_attaches_listings_in_batches(self):
+        # ARRANGE
+        data = {"product": self.phone.pk, "listings": self.listings}
+
+        # ACT
+        # token, savepoint, listings, products, 3 listings updates, product
+        # update, release
+        with mock.patch("myapp.catalog.BATCH_SIZE", 2), self.assertNumQueries(9):
+            response = self.put(data)
+
+        # ASSERT
+        self.assertEqual(response.data["attached"], 5)
+        self.assertEqual(
+            set(
+                Listing.objects.filter(product=self.phone).values_list("pk", flat=True)
+            ),
+            set(self.listings[:5]),
+        )
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.listing_count, 5)
+
+    def test_view_raises_400_if_a_listing_is_given_several_products(self):
+        # ARRANGE
+        data = [[self.listings[0], self.phone.pk], [self.listings[0], self.tablet.pk]]
+
+        # ACT
+        response = self.put(data)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_single_attach_raises_400_if_listing_already_has_a_product(self):
+        # ARRANGE
+        url = reverse("attach-product", kwargs={"pk": self.listings[5]})
+
+        # ACT
+        response = self.client.put(
+            url,
+            data=json.dumps({"product": self.phone.pk}),
+            content_type="application/json",
+            **self.header
+        )
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Listing.objects.get(pk=self.listings[5]).product_id, self.tablet.pk
+        )
+
+
+@override_settings(LISTING_EVENTS={"RATE": 20, "KEEPALIVE": 15, "MAX_LISTINGS": 2})
+class ListingEventsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.listing = Listing.objects.create(title="listing", price=10, quantity=50)
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+
+    def tearDown(self):
+        local_store.clear()
+
+    def communicator(self, query_string):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/myapp/listing/events",
+            "query_string": query_string.encode(),
+            "headers": [],
+        }
+        return ApplicationCommunicator(ListingEventsApp(None), scope)
+
+    async def receive_events(self, communicator):
+        message = await communicator.receive_output(2)
+        return [
+            json.loads(line[len("data: ") :])
+            for line in message["body"].decode().splitlines()
+            if line.startswith("data: ")
+        ]
+
+    def sell_and_reprice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("orders"),
+                data=json.dumps({"listings": self.listing.pk, "quantities": 3}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Token {}".format(self.token.key),
+            )
+        for price in (12, 13, 14):
+            with self.captureOnCommitCallbacks(execute=True):
+                Listing.objects.filter(pk=self.listing.pk).update(price=price)
+                self.listing.refresh_from_db()
+                self.listing.save()
+
+    async def test_stream_pushes_coalesced_listing_changes(self):
+        # ARRANGE
+        communicator = self.communicator(
+            "listings={}&token={}".format(self.listing.pk, self.token.key)
+        )
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(2)
+        snapshot = await self.receive_events(communicator)
+
+        # ACT
+        await sync_to_async(self.sell_and_reprice)()
+        changes = await self.receive_events(communicator)
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(2)
+
+        # ASSERT
+        self.assertEqual(start["status"], status.HTTP_200_OK)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        self.assertEqual(
+            snapshot, [{"id": self.listing.pk, "quantity": 50, "price": "10.00"}]
+        )
+        self.assertEqual(
+            changes, [{"id": self.listing.pk, "quantity": 47, "price": "14.00"}]
+        )
+        self.assertFalse(events.bus.subscriptions)
+
+    async def test_stream_rejects_invalid_requests(self):
+        # ARRANGE
+        queries = {
+            "listings=1": status.HTTP_401_UNAUTHORIZED,
+            "listings=1&token=wrong": status.HTTP_401_UNAUTHORIZED,
+            "token={}".format(self.token.key): status.HTTP_400_BAD_REQUEST,
+            "listings=1,2,3&token={}".format(
+                self.token.key
+            ): status.HTTP_400_BAD_REQUEST,
+            "listings=x&token={}".format(self.token.key): status.HTTP_400_BAD_REQUEST,
+        }
+
+        for query_string, expected_status in queries.items():
+            # ACT
+            communicator = self.communicator(query_string)
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(2)
+
+            # ASSERT
+            self.assertEqual(start["status"], expected_status, query_string)
+
+
+class OrderArchiveTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.listing = Listing.objects.create(title="listing", price=10, quantity=50)
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+    def setUp(self):
+        now = timezone.now()
+        for days in (800, 500, 400, 10):
+            order = Order.objects.create(
+                merchant=self.merchant,
+                creation_date=now - datetime.timedelta(days=days),
+                total=20,
+            )
+            OrderLine.objects.create(
+                order=order, listing=self.listing, quantity=2, unit_price=10
+            )
+
+    def test_command_moves_old_orders_and_lines_to_the_archive(self):
+        # ARRANGE
+        recent = Order.objects.order_by("pk").last()
+        out = StringIO()
+
+        # ACT
+        call_command("archive_orders", chunk_size=2, stdout=out)
+
+        # ASSERT
+        self.assertEqual(list(Order.objects.all()), [recent])
+        self.assertEqual(
+            list(OrderLine.objects.values_list("order_id", flat=True)), [recent.pk]
+        )
+        self.assertEqual(
+            list(ArchivedOrder.objects.order_by("pk").values_list("pk", "total")),
+            [
+                (recent.pk - 3, Decimal("20")),
+                (recent.pk - 2, Decimal("20")),
+                (recent.pk - 1, Decimal("20")),
+            ],
+        )
+        self.assertEqual(ArchivedOrderLine.objects.count(), 3)
+        self.assertIn("3 orders archived", out.getvalue())
+
+    def test_command_refuses_to_archive_orders_younger_than_the_horizon(self):
+        # ACT / ASSERT
+        with self.assertRaises(CommandError):
+            call_command("archive_orders", days=30, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_view_reads_through_to_the_archive_for_old_date_ranges(self):
+        # ARRANGE
+        call_command("archive_orders", stdout=StringIO())
+        url = reverse("orders")
+        month_ago = timezone.now() - datetime.timedelta(days=30)
+        since = timezone.now() - datetime.timedelta(days=600)
+
+        # ACT
+        with self.assertNumQueries(3):  # token, merchant, hot orders
+            recent = self.client.get(
+                url, {"since": month_ago.isoformat()}, **self.header
+            )
+        history = self.client.get(url, {"since": since.isoformat()}, **self.header)
+        everything = self.client.get(url, **self.header)
+
+        # ASSERT
+        self.assertEqual(recent.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(recent.data), 1)
+        self.assertEqual(history.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(history.data), 3)
+        self.assertEqual(
+            [order["id"] for order in history.data],
+            sorted(order["id"] for order in history.data),
+        )
+        self.assertEqual(len(everything.data), 4)
+
+    def test_view_reads_through_to_the_archive_for_ranges_with_only_an_end(self):
+        # ARRANGE
+        call_command("archive_orders", stdout=StringIO())
+        until = timezone.now() - datetime.timedelta(days=450)
+
+        # ACT
+        response = self.client.get(
+            reverse("orders"), {"until": until.isoformat()}, **self.header
+        )
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [order["id"] for order in response.data],
+            list(ArchivedOrder.objects.order_by("pk").values_list("pk", flat=True)[:2]),
+        )
+
+
+@override_settings(ORDER_SYNC=dict(settings.ORDER_SYNC, DELAY=60))
+class OrderSyncTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.url = reverse("orders")
+
+    def setUp(self):
+        # Two orders share each date, ids are not in date order
+        self.now = timezone.now()
+        self.orders = []
+        for hours in (1, 3, 3, 2, 2):
+            date = self.now - datetime.timedelta(hours=hours)
+            self.orders.append(
+                Order.objects.create(
+                    merchant=self.merchant, creation_date=date, received_date=date
+                )
+            )
+
+    def tearDown(self):
+        local_store.clear()
+
+    def sync(self, **params):
+        response = self.client.get(self.url, params, **self.header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [order["id"] for order in response.data], response.get("X-Next-Cursor")
+
+    def test_view_filters_orders_by_date_range(self):
+        # ARRANGE
+        since = self.now - datetime.timedelta(hours=2, minutes=30)
+        until = self.now - datetime.timedelta(hours=1, minutes=30)
+
+        # ACT
+        ids, cursor = self.sync(since=since.isoformat(), until=until.isoformat())
+
+        # ASSERT
+        self.assertEqual(sorted(ids), [self.orders[3].pk, self.orders[4].pk])
+        self.assertIsNone(cursor)
+
+    def test_cursor_pages_through_orders_by_received_date_then_id(self):
+        # ARRANGE
+        expected = [self.orders[i].pk for i in (1, 2, 3, 4, 0)]
+        ids, cursor = self.sync(limit=2)
+
+        # ACT
+        pages = [ids]
+        while ids:
+            # token, merchant, page, archived page
+            with self.assertNumQueries(4):
+                ids, cursor = self.sync(after=cursor, limit=2)
+            pages.append(ids)
+
+        # ASSERT
+        self.assertEqual(pages, [expected[:2], expected[2:4], expected[4:], []])
+        self.assertIsNotNone(cursor)
+
+    def test_sync_only_reads_new_orders_and_waits_for_young_ones(self):
+        # ARRANGE
+        _, cursor = self.sync(limit=10)
+        # Created before the last sync by the client, received since
+        backdated = Order.objects.create(
+            merchant=self.merchant,
+            creation_date=self.now - datetime.timedelta(days=3),
+            received_date=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        Order.objects.create(merchant=self.merchant)
+
+        # ACT
+        ids, next_cursor = self.sync(after=cursor)
+        again, _ = self.sync(after=next_cursor)
+
+        # ASSERT
+        self.assertEqual(ids, [backdated.pk])
+        self.assertEqual(again, [])
+
+    def test_first_page_merges_archived_orders(self):
+        # ARRANGE
+        date = self.now - datetime.timedelta(days=800)
+        ArchivedOrder.objects.create(
+            id=1000,
+            merchant=self.merchant,
+            creation_date=date,
+            received_date=date,
+            status=Order.PLACED,
+        )
+
+        # ACT
+        ids, _ = self.sync(limit=2)
+
+        # ASSERT
+        self.assertEqual(ids, [1000, self.orders[1].pk])
+
+    def test_view_raises_400_on_invalid_cursor(self):
+        # ACT
+        response = self.client.get(self.url, {"after": "nope"}, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("after", response.data)
+
+
+@override_settings(ORDER_PAGE=dict(settings.ORDER_PAGE, CHUNK_SIZE=2, CACHE_TIMEOUT=60))
+class OrdersPageTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token(user=cls.user)
+        cls.token.save()
+        cls.header = {
+            "HTTP_AUTHORIZATION": "Token {}".format(cls.token.key),
+            "HTTP_ACCEPT": "text/html",
+        }
+
+    def setUp(self):
+        caches[settings.ORDER_PAGE["CACHE"]].clear()
+
+    def tearDown(self):
+        local_store.clear()
+
+    def create_orders(self, count, **kwargs):
+        for _ in range(count):
+            Order.objects.create(
+                merchant=self.merchant,
+                creation_date=datetime.datetime(
+                    2021, 7, 22, tzinfo=datetime.timezone.utc
+                ),
+                total=20,
+                **kwargs
+            )
+
+    def get_page(self, **params):
+        response = self.client.get(reverse("orders"), params, **self.header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_page_renders_every_order(self):
+        # ARRANGE
+        self.create_orders(5)
+        first = Order.objects.order_by("pk").first()
+
+        # ACT
+        page = self.get_page()
+
+        # ASSERT
+        self.assertIn("Orders list of merchant #{}".format(self.merchant.pk), page)
+        self.assertEqual(page.count("<li>"), 5)
+        self.assertIn(
+            "<li>Order #{} created on 2021-07-22 00:00, placed, total 20.00</li>".format(
+                first.pk
+            ),
+            page,
+        )
+        self.assertNotIn("no registered order", page)
+
+    def test_page_rows_are_cached_until_the_status_or_total_changes(self):
+        # ARRANGE
+        self.create_orders(3)
+        order = Order.objects.order_by("pk").first()
+        self.get_page()
+
+        # ACT
+        cached = self.get_page()
+        Order.objects.filter(pk=order.pk).update(total=99)
+        backfilled = self.get_page()
+        Order.objects.filter(pk=order.pk).update(status=Order.CANCELLED)
+        cancelled = self.get_page()
+
+        # ASSERT
+        self.assertIn("placed, total 20.00", cached)
+        self.assertIn("placed, total 99.00", backfilled)
+        self.assertIn("cancelled, total 99.00", cancelled)
+
+    @override_settings(ORDER_PAGE=dict(settings.ORDER_PAGE, CHUNK_SIZE=500))
+    def test_page_of_many_orders_is_served_from_cache_when_seen_again(self):
+        # ARRANGE
+        Order.objects.bulk_create(
+            [Order(merchant=self.merchant, total=20) for _ in range(1000)]
+        )
+        self.get_page()
+
+        # ACT
+        with mock.patch.object(
+            LocMemCache, "set_many", autospec=True, side_effect=LocMemCache.set_many
+        ) as set_many:
+            page = self.get_page()
+
+        # ASSERT
+        set_many.assert_not_called()
+        self.assertEqual(page.count("<li>"), 1000)
+
+    def test_page_reads_through_to_the_archive(self):
+        # ARRANGE
+        ArchivedOrder.objects.create(
+            id=1000,
+            merchant=self.merchant,
+            creation_date=timezone.now() - datetime.timedelta(days=800),
+            received_date=timezone.now() - datetime.timedelta(days=800),
+            status=Order.PLACED,
+        )
+        self.create_orders(2)
+
+        # ACT
+        until = self.get_page(until="2022-01-01T00:00:00Z")
+        history = self.get_page(since="2000-01-01T00:00:00Z")
+        everything = self.get_page()
+
+        # ASSERT
+        self.assertEqual(until.count("<li>"), 2)
+        self.assertEqual(history.count("<li>"), 3)
+        self.assertIn("Order #1000", history)
+        self.assertEqual(everything, history)
+
+    def test_page_says_when_there_is_no_order(self):
+        # ACT
+        page = self.get_page()
+
+        # ASSERT
+        self.assertIn("You have no registered order yet.", page)
+
+    def test_api_clients_get_json_when_they_ask_for_it(self):
+        # ARRANGE
+        self.create_orders(1)
+        authorization = self.header["HTTP_AUTHORIZATION"]
+
+        # ACT
+        accept = self.client.get(
+            reverse("orders"),
+            HTTP_AUTHORIZATION=authorization,
+            HTTP_ACCEPT="application/json",
+        )
+        query = self.client.get(
+            reverse("orders"), {"format": "json"}, HTTP_AUTHORIZATION=authorization
+        )
+        default = self.client.get(reverse("orders"), HTTP_AUTHORIZATION=authorization)
+
+        # ASSERT
+        for response in [accept, query]:
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(len(response.json()), 1)
+        self.assertEqual(default["Content-Type"], "text/html; charset=utf-8")
+        self.assertContains(default, "<li>Order #")
+
+
+class StockAuditTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User(username="Pelloch", password="fake-password")
+        cls.user.save()
+        cls.merchant = Merchant.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="iPhone X de Pelloch", total_stock=100
+        )
+        self.listings = [
+            Listing.objects.create(
+                product=self.product, title="listing", price=10, quantity=50
+            )
+            for _ in range(2)
+        ]
+        # Sell 5 + 3 items of the first listing, one order being archived
+        order = Order.objects.create(merchant=self.merchant)
+        OrderLine.objects.create(
+            order=order, listing=self.listings[0], quantity=5, returned_quantity=1
+        )
+        order = ArchivedOrder.objects.create(
+            id=1000,
+            merchant=self.merchant,
+            creation_date=timezone.now(),
+            received_date=timezone.now(),
+            status="placed",
+        )
+        ArchivedOrderLine.objects.create(
+            id=1000, order=order, listing=self.listings[0], quantity=3
+        )
+        Listing.objects.filter(pk=self.listings[0].pk).update(quantity=50 - 4 - 3)
+        Product.objects.filter(pk=self.product.pk).update(total_stock=93)
+
+    def quantities(self):
+        return list(Listing.objects.order_by("pk").values_list("quantity", flat=True))
+
+    def test_command_finds_no_discrepancy_in_consistent_stock(self):
+        # ARRANGE
+        out = StringIO()
+
+        # ACT
+        call_command("audit_stock", chunk_size=1, stdout=out)
+
+        # ASSERT
+        self.assertIn("2 chunks audited, 0 listings drifted", out.getvalue())
+
+    def test_command_reports_drifted_quantities(self):
+        # ARRANGE
+        Listing.objects.filter(pk=self.listings[0].pk).update(
+            quantity=F("quantity") + 7
+        )
+        out = StringIO()
+
+        # ACT
+        call_command("audit_stock", stdout=out)
+
+        # ASSERT
+        self.assertIn(
+            "listing #{}: quantity=50 expected=43".format(self.listings[0].pk),
+            out.getvalue(),
+        )
+        self.assertIn("1 chunks audited, 1 listings drifted", out.getvalue())
+        self.assertEqual(self.quantities(), [50, 50])
+
+    def test_command_repairs_quantities_and_missing_baselines(self):
+        # ARRANGE
+        Listing.objects.filter(pk=self.listings[0].pk).update(
+            quantity=F("quantity") + 7
+        )
+        Listing.objects.bulk_create([Listing(title="listing", price=10, quantity=5)])
+        out = StringIO()
+
+        # ACT
+        call_command("audit_stock", repair=True, stdout=out)
+
+        # ASSERT
+        self.assertIn("2 listings repaired", out.getvalue())
+        self.assertEqual(self.quantities(), [43, 50, 5])
+        self.assertEqual(Listing.objects.order_by("pk").last().stock_baseline, 5)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).total_stock, 93)
+
+    def test_setting_the_quantity_moves_the_baseline(self):
+        # ARRANGE
+        token = Token.objects.create(user=self.user)
+        data = {"title": "listing", "price": "10.00", "quantity": 60}
+
+        # ACT
+        response = self.client.put(
+            reverse("single-listing", args=[self.listings[0].pk]),
+            data=json.dumps(data),
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Token {}".format(token.key),
+        )
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).stock_baseline, 67)
+        out = StringIO()
+        call_command("audit_stock", stdout=out)
+        self.assertIn("0 listings drifted", out.getvalue())
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    """Stub merchant endpoint answering with the statuses of `statuses`"""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+    statuses = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.requests.append((self.client_address, dict(self.headers), body))
+        self.send_response(self.statuses.pop(0) if self.statuses else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    WEBHOOKS=dict(settings.WEBHOOKS, BATCH_SIZE=2, MAX_ATTEMPTS=2, TIMEOUT=2)
+)
+class WebhookTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        cls.listing = Listing.objects.create(title="listing", price=10, quantity=50)
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        WebhookHandler.requests = []
+        WebhookHandler.statuses = []
+        self.endpoint = WebhookEndpoint.objects.create(
+            merchant=self.merchant,
+            url="http://127.0.0.1:{}/hooks".format(self.server.server_port),
+            secret="s3cret",
+        )
+
+    def tearDown(self):
+        local_store.clear()
+
+    def place_orders(self, count):
+        for _ in range(count):
+            response = self.client.post(
+                reverse("orders"),
+                data=json.dumps({"listings": self.listing.pk, "quantities": 2}),
+                content_type="application/json",
+                **self.header
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_order_events_are_written_with_the_order(self):
+        # ARRANGE
+        WebhookEndpoint.objects.create(
+            merchant=self.merchant, url="http://localhost/", secret="x", is_active=False
+        )
+
+        # ACT
+        self.place_orders(1)
+        self.client.post(
+            reverse("orders"),
+            data=json.dumps({"listings": self.listing.pk, "quantities": 1000}),
+            content_type="application/json",
+            **self.header
+        )
+
+        # ASSERT
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.endpoint, self.endpoint)
+        self.assertEqual(event.type, "order.placed")
+        self.assertEqual(event.payload["total"], "20.00")
+        self.assertEqual(
+            event.payload["lines"],
+            [{"listing": self.listing.pk, "quantity": 2, "unit_price": "10.00"}],
+        )
+        self.assertFalse(WebhookHandler.requests)
+
+    def test_dispatcher_posts_signed_batches_over_one_connection(self):
+        # ARRANGE
+        self.place_orders(3)
+        out = StringIO()
+
+        # ACT
+        call_command("dispatch_webhooks", once=True, stdout=out)
+
+        # ASSERT
+        self.assertEqual(len(WebhookHandler.requests), 2)
+        clients = {client for client, _, _ in WebhookHandler.requests}
+        self.assertEqual(len(clients), 1)
+        _, headers, body = WebhookHandler.requests[0]
+        self.assertEqual(
+            headers["X-Webhook-Signature"],
+            "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest(),
+        )
+        self.assertEqual(len(json.loads(body)["events"]), 2)
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+        self.assertIn("3 delivered, 0 failed", out.getvalue())
+
+    def test_dispatcher_retries_with_backoff_then_gives_up(self):
+        # ARRANGE
+        self.place_orders(1)
+        WebhookHandler.statuses = [500, 503]
+        dispatcher = webhooks.Dispatcher()
+
+        # ACT
+        first = dispatcher.dispatch()
+        event = OutboxEvent.objects.get()
+        OutboxEvent.objects.update(next_attempt_at=timezone.now())
+        second = dispatcher.dispatch()
+        dispatcher.pool.close()
+
+        # ASSERT
+        self.assertEqual(first["failed"], 1)
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.last_error, "HTTP 500")
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(second["failed"], 1)
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 2)
+        self.assertIsNone(event.next_attempt_at)
+        self.assertIsNone(event.delivered_at)
+
+    def test_dispatcher_purges_delivered_events_every_interval(self):
+        # ARRANGE
+        old = timezone.now() - datetime.timedelta(days=8)
+
+        def delivered_event():
+            return OutboxEvent.objects.create(
+                endpoint=self.endpoint,
+                type="order.placed",
+                payload={},
+                next_attempt_at=None,
+                delivered_at=old,
+            )
+
+        delivered_event()
+        clock = [1000.0]
+        rounds = []
+        dispatcher = webhooks.Dispatcher()
+
+        # ACT
+        with mock.patch("myapp.webhooks.time.monotonic", lambda: clock[0]):
+            for stats in dispatcher.run(0, stop=lambda: len(rounds) == 3):
+                rounds.append(stats["purged"])
+                delivered_event()
+                clock[0] += 1800
+
+        # ASSERT
+        self.assertEqual(rounds, [1, 0, 2])
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+
+class TopSellersTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        Listing.objects.bulk_create(
+            [Listing(title="listing", price=10, quantity=100) for _ in range(4)]
+        )
+        cls.listings = list(Listing.objects.order_by("pk"))
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        cls.merchant = Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+    def setUp(self):
+        for leaderboard in sales.leaderboards.values():
+            leaderboard.clear()
+
+    def tearDown(self):
+        local_store.clear()
+
+    def get_top_sellers(self, **params):
+        return self.client.get(reverse("top-sellers"), params, **self.header)
+
+    def place_order(self, quantities):
+        data = {"listings": list(quantities), "quantities": list(quantities.values())}
+        response = self.client.post(
+            reverse("orders"),
+            data=json.dumps(data),
+            content_type="application/json",
+            **self.header
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["id"]
+
+    def test_orders_are_counted_in_the_current_bucket(self):
+        # ARRANGE
+        first, second = self.listings[:2]
+        data = {"listings": [first.pk, second.pk], "quantities": [2, 1]}
+
+        # ACT
+        for _ in range(2):
+            self.client.post(
+                reverse("orders"),
+                data=json.dumps(data),
+                content_type="application/json",
+                **self.header
+            )
+
+        # ASSERT
+        self.assertEqual(
+            sales.read_buckets(),
+            {sales.bucket_start(timezone.now()): {first.pk: 4, second.pk: 2}},
+        )
+
+    def test_backdated_orders_are_counted_in_the_current_bucket(self):
+        # ARRANGE
+        data = {
+            "listings": [self.listings[0].pk],
+            "quantities": [1],
+            "creation_date": "2001-01-01T00:00:00Z",
+        }
+
+        # ACT
+        self.client.post(
+            reverse("orders"),
+            data=json.dumps(data),
+            content_type="application/json",
+            **self.header
+        )
+
+        # ASSERT
+        self.assertEqual(
+            sales.read_buckets(),
+            {sales.bucket_start(timezone.now()): {self.listings[0].pk: 1}},
+        )
+
+    def test_view_returns_the_best_sellers_of_the_window(self):
+        # ARRANGE
+        now = timezone.now()
+        sales.record({self.listings[0].pk: 3, self.listings[1].pk: 5}, now)
+        sales.record({self.listings[0].pk: 4}, now - datetime.timedelta(minutes=30))
+        sales.record({self.listings[2].pk: 50}, now - datetime.timedelta(hours=3))
+
+        # ACT
+        hour = self.get_top_sellers(window="hour")
+        day = self.get_top_sellers(window="day", limit=2)
+
+        # ASSERT
+        self.assertEqual(hour.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            hour.json(),
+            [
+                {"listing": self.listings[0].pk, "quantity": 7},
+                {"listing": self.listings[1].pk, "quantity": 5},
+            ],
+        )
+        self.assertEqual(
+            [row["listing"] for row in day.json()],
+            [self.listings[2].pk, self.listings[0].pk],
+        )
+
+    def test_view_raises_400_on_invalid_parameters(self):
+        # ACT
+        window = self.get_top_sellers(window="week")
+        limit = self.get_top_sellers(limit=settings.TOP_SELLERS["K"] + 1)
+
+        # ASSERT
+        self.assertEqual(window.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(limit.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_leaderboard_slides_and_is_rebuilt_from_the_buckets(self):
+        # ARRANGE
+        leaderboard = sales.Leaderboard(3600)
+        now = timezone.now()
+        sales.record({self.listings[0].pk: 10}, now - datetime.timedelta(minutes=50))
+        sales.record({self.listings[1].pk: 6}, now - datetime.timedelta(minutes=20))
+        # Not sold yet
+        sales.record({self.listings[2].pk: 50}, now + datetime.timedelta(hours=2))
+        leaderboard.refresh(now)
+        before = list(leaderboard.top)
+
+        # ACT
+        sales.record({self.listings[1].pk: 1}, now)
+        later = now + datetime.timedelta(minutes=20)
+        with self.assertNumQueries(1):
+            leaderboard.refresh(later)
+        slid = list(leaderboard.top)
+        leaderboard.clear()
+        leaderboard.refresh(later)
+
+        # ASSERT
+        self.assertEqual(before, [(self.listings[0].pk, 10), (self.listings[1].pk, 6)])
+        self.assertEqual(slid, [(self.listings[1].pk, 7)])
+        self.assertEqual(leaderboard.top, slid)
+
+    def test_cancelled_orders_are_taken_back_from_their_bucket(self):
+        # ARRANGE
+        first, second = self.listings[:2]
+        old = self.place_order({first.pk: 10})
+        two_days_ago = timezone.now() - datetime.timedelta(days=2)
+        Order.objects.filter(pk=old).update(received_date=two_days_ago)
+        SalesBucket.objects.update(start=sales.bucket_start(two_days_ago))
+        recent = self.place_order({first.pk: 5, second.pk: 3})
+        self.place_order({second.pk: 1})
+        Order.objects.filter(pk=recent).update(
+            received_date=timezone.now() - datetime.timedelta(minutes=30)
+        )
+        SalesBucket.objects.filter(start__gt=two_days_ago).update(
+            start=sales.bucket_start(timezone.now() - datetime.timedelta(minutes=30))
+        )
+
+        # ACT
+        returns.cancel_orders(Order.objects.filter(pk=old))
+        before = self.get_top_sellers(window="hour").json()
+        returns.cancel_orders(Order.objects.filter(pk=recent))
+        sales.leaderboards["hour"].clear()
+        after = self.get_top_sellers(window="hour").json()
+
+        # ASSERT
+        self.assertEqual(
+            before,
+            [
+                {"listing": first.pk, "quantity": 5},
+                {"listing": second.pk, "quantity": 4},
+            ],
+        )
+        self.assertEqual(after, [{"listing": second.pk, "quantity": 1}])
+
+    def test_leaderboard_reads_the_closed_buckets_written_again(self):
+        # ARRANGE
+        leaderboard = sales.Leaderboard(3600)
+        now = timezone.now()
+        sold_at = now - datetime.timedelta(minutes=30)
+        sales.record({self.listings[0].pk: 10, self.listings[1].pk: 6}, sold_at)
+        leaderboard.refresh(now)
+
+        # ACT
+        sales.take_back({self.listings[0].pk: 7}, sold_at)
+        with self.assertNumQueries(1):
+            leaderboard.refresh(now)
+
+        # ASSERT
+        self.assertEqual(
+            leaderboard.top, [(self.listings[1].pk, 6), (self.listings[0].pk, 3)]
+        )
+
+    def test_purge_deletes_the_buckets_out_of_every_window(self):
+        # ARRANGE
+        now = timezone.now()
+        sales.record({self.listings[0].pk: 1}, now - datetime.timedelta(hours=2))
+        sales.record({self.listings[0].pk: 1}, now - datetime.timedelta(days=2))
+        out = StringIO()
+
+        # ACT
+        call_command("purge_sales_buckets", stdout=out)
+
+        # ASSERT
+        self.assertEqual(len(sales.read_buckets()), 1)
+        self.assertIn("1 buckets deleted", out.getvalue())
+
+
+class PriceHistoryTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.listing = Listing.objects.create(title="listing", price=10, quantity=5)
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+        cls.url = reverse("listing-price-history", kwargs={"pk": cls.listing.pk})
+
+    def setUp(self):
+        # Hour buckets are aligned on the hour, days on midnight UTC
+        self.now = price_history.floor(timezone.now(), PriceBucket.DAY)
+        for days, minutes, price in [
+            (200, 0, "9"),
+            (200, 90, "7"),
+            (100, 30, "11"),
+            (10, 10, "10"),
+            (10, 20, "8"),
+            (10, 70, "12"),
+            (1, 0, "13"),
+        ]:
+            PriceChange.objects.create(
+                listing=self.listing,
+                at=self.now
+                - datetime.timedelta(days=days)
+                + datetime.timedelta(minutes=minutes),
+                price=Decimal(price),
+            )
+
+    def tearDown(self):
+        local_store.clear()
+
+    def get_history(self, days, **params):
+        since = timezone.now() - datetime.timedelta(days=days)
+        response = self.client.get(
+            self.url, dict(params, since=since.isoformat()), **self.header
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["resolution"], [
+            (price["min"], price["max"], price["last"])
+            for price in response.data["prices"]
+        ]
+
+    def test_updates_record_only_price_changes(self):
+        # ARRANGE
+        PriceChange.objects.all().delete()
+        url = reverse("single-listing", kwargs={"pk": self.listing.pk})
+        data = {"title": "listing", "price": "10.00", "quantity": 5}
+
+        # ACT
+        for price in ["10.00", "12.50", "12.50"]:
+            self.client.put(
+                url,
+                data=json.dumps(dict(data, price=price)),
+                content_type="application/json",
+                **self.header
+            )
+
+        # ASSERT
+        self.assertEqual(
+            list(PriceChange.objects.values_list("price", flat=True)),
+            [Decimal("12.50")],
+        )
+
+    def test_command_downsamples_old_changes_into_hours_then_days(self):
+        # ARRANGE
+        out = StringIO()
+
+        # ACT
+        call_command("compact_price_history", stdout=out)
+
+        # ASSERT
+        buckets = PriceBucket.objects.order_by("start").values_list(
+            "resolution", "min_price", "max_price", "last_price"
+        )
+        self.assertEqual(
+            [
+                (resolution, str(low), str(high), str(last))
+                for resolution, low, high, last in buckets
+            ],
+            [
+                ("day", "7.00", "9.00", "7.00"),
+                ("day", "11.00", "11.00", "11.00"),
+                ("hour", "8.00", "10.00", "8.00"),
+                ("hour", "12.00", "12.00", "12.00"),
+            ],
+        )
+        self.assertEqual(
+            list(PriceChange.objects.values_list("price", flat=True)),
+            [Decimal("13")],
+        )
+        self.assertIn("6 rows folded into hour buckets", out.getvalue())
+
+    def test_view_reads_the_finest_resolution_stored_for_the_range(self):
+        # ARRANGE
+        call_command("compact_price_history", stdout=StringIO())
+
+        # ACT
+        recent = self.get_history(2)
+        month = self.get_history(30)
+        year = self.get_history(365)
+        coarse = self.get_history(30, resolution="day")
+
+        # ASSERT
+        self.assertEqual(recent, ("raw", [("13.00", "13.00", "13.00")]))
+        self.assertEqual(
+            month,
+            (
+                "hour",
+                [
+                    ("8.00", "10.00", "8.00"),
+                    ("12.00", "12.00", "12.00"),
+                    ("13.00", "13.00", "13.00"),
+                ],
+            ),
+        )
+        self.assertEqual(
+            year,
+            (
+                "day",
+                [
+                    ("7.00", "9.00", "7.00"),
+                    ("11.00", "11.00", "11.00"),
+                    ("8.00", "12.00", "12.00"),
+                    ("13.00", "13.00", "13.00"),
+                ],
+            ),
+        )
+        self.assertEqual(coarse[1], year[1][2:])
+
+
+@override_settings(ADMIN_PAGINATION={"COUNT_LIMIT": 5})
+class AdminTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.product = Product.objects.create(name="iPhone X de Pelloch")
+        Listing.objects.bulk_create(
+            [
+                Listing(
+                    product=cls.product,
+                    title="listing",
+                    price=10,
+                    quantity=5,
+                    stock_baseline=5,
+                )
+                for _ in range(3)
+            ]
+        )
+        cls.listings = list(Listing.objects.order_by("pk"))
+        Product.objects.filter(pk=cls.product.pk).update(
+            listing_count=3, min_price=10, total_stock=15
+        )
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        cls.merchant = Merchant.objects.create(user=cls.admin)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(merchant=self.merchant, total=10)
+            OrderLine.objects.create(
+                order=order, listing=self.listings[0], quantity=1, unit_price=10
+            )
+
+    def test_order_list_query_count_does_not_depend_on_the_number_of_rows(self):
+        # ARRANGE
+        url = reverse("admin:myapp_order_changelist")
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.create_orders(20)
+
+        # ACT
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "admin")
+        self.assertEqual(len(many), len(few))
+        counts = [query["sql"] for query in many if "COUNT(" in query["sql"]]
+        self.assertTrue(counts)
+        for sql in counts:
+            self.assertIn("LIMIT 5", sql)
+
+    def test_paginator_estimates_whole_tables_from_statistics(self):
+        # ARRANGE
+        self.create_orders(8)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.create_orders(2)
+
+        # ACT
+        whole = EstimatedCountPaginator(Order.objects.order_by("pk"), 2).count
+        filtered = EstimatedCountPaginator(
+            Order.objects.filter(total=10).order_by("pk"), 2
+        ).count
+
+        # ASSERT
+        self.assertEqual(whole, 8)
+        self.assertEqual(filtered, 5)
+
+    def test_numeric_search_looks_up_the_id(self):
+        # ARRANGE
+        self.create_orders(3)
+        order = Order.objects.order_by("pk")[1]
+
+        # ACT
+        orders = self.client.get(
+            reverse("admin:myapp_order_changelist"), {"q": str(order.pk)}
+        )
+        lines = self.client.get(
+            reverse("admin:myapp_orderline_changelist"), {"q": str(order.pk)}
+        )
+
+        # ASSERT
+        self.assertEqual(list(orders.context["cl"].result_list), [order])
+        self.assertEqual(
+            [line.order_id for line in lines.context["cl"].result_list], [order.pk]
+        )
+
+    def test_restock_and_reprice_actions_update_the_selected_listings(self):
+        # ARRANGE
+        url = reverse("admin:myapp_listing_changelist")
+        selected = [listing.pk for listing in self.listings[:2]]
+
+        # ACT
+        restock = self.client.post(
+            url,
+            {"action": "restock", "_selected_action": selected, "quantity": 4},
+        )
+        reprice = self.client.post(
+            url,
+            {"action": "reprice", "_selected_action": selected, "price": "12.50"},
+        )
+        missing = self.client.post(
+            url, {"action": "reprice", "_selected_action": selected}, follow=True
+        )
+
+        # ASSERT
+        self.assertEqual(restock.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(reprice.status_code, status.HTTP_302_FOUND)
+        self.assertContains(missing, "Set a valid price")
+        self.assertEqual(
+            list(
+                Listing.objects.order_by("pk").values_list(
+                    "quantity", "stock_baseline", "price"
+                )
+            ),
+            [
+                (9, 9, Decimal("12.50")),
+                (9, 9, Decimal("12.50")),
+                (5, 5, Decimal("10.00")),
+            ],
+        )
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.total_stock, product.min_price), (23, Decimal("10")))
+        self.assertEqual(
+            sorted(PriceChange.objects.values_list("listing_id", flat=True)), selected
+        )
+
+    def test_listings_orders_and_lines_cannot_be_deleted(self):
+        # ARRANGE
+        self.create_orders(1)
+        order = Order.objects.get()
+        models = {
+            "listing": self.listings[0].pk,
+            "order": order.pk,
+            "orderline": OrderLine.objects.get().pk,
+        }
+
+        # ACT
+        changelists, deletes = {}, {}
+        for model, pk in models.items():
+            changelists[model] = self.client.get(
+                reverse("admin:myapp_{}_changelist".format(model))
+            )
+            deletes[model] = self.client.post(
+                reverse("admin:myapp_{}_delete".format(model), args=[pk]),
+                {"post": "yes"},
+            )
+
+        # ASSERT
+        for model in models:
+            self.assertNotContains(changelists[model], 'value="delete_selected"')
+            self.assertEqual(deletes[model].status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Listing.objects.count(), 3)
+        self.assertEqual(OrderLine.objects.count(), 1)
+
+    def test_order_links_to_its_lines(self):
+        # ARRANGE
+        self.create_orders(2)
+        order = Order.objects.order_by("pk").first()
+
+        # ACT
+        change = self.client.get(reverse("admin:myapp_order_change", args=[order.pk]))
+        lines = self.client.get(
+            reverse("admin:myapp_orderline_changelist"),
+            {"order__id__exact": order.pk},
+        )
+
+        # ASSERT
+        self.assertContains(change, "?order__id__exact={}".format(order.pk))
+        self.assertEqual(
+            [line.order_id for line in lines.context["cl"].result_list], [order.pk]
+        )
+
+
+class WriteQueueTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.listing = Listing.objects.create(title="listing", price=10, quantity=50)
+
+    def decrement(self, quantity):
+        def job():
+            Listing.objects.filter(pk=self.listing.pk).update(
+                quantity=F("quantity") - quantity
+            )
+            if quantity > 10:
+                raise ValueError("too many")
+            return quantity
+
+        return job
+
+    def test_batch_is_committed_once_and_failures_only_roll_back_their_job(self):
+        # ARRANGE
+        queue = writes.WriteQueue()
+        futures = [Future() for _ in range(3)]
+        for quantity, future in zip([1, 20, 2], futures):
+            queue.jobs.put((self.decrement(quantity), future))
+
+        # ACT
+        batch = queue.take()
+        with self.captureOnCommitCallbacks() as callbacks:
+            queue.commit(batch)
+
+        # ASSERT
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(futures[0].result(), 1)
+        self.assertIsInstance(futures[1].exception(), ValueError)
+        self.assertEqual(futures[2].result(), 2)
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).quantity, 47)
+        self.assertEqual(callbacks, [])
+
+    def test_backend_applies_pragmas_and_begins_immediate_write_transactions(self):
+        # ARRANGE
+        settings_dict = dict(
+            connection.settings_dict,
+            OPTIONS=dict(
+                connection.settings_dict["OPTIONS"],
+                pragmas={"journal_mode": "WAL", "busy_timeout": 0},
+            ),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict["NAME"] = os.path.join(directory, "db.sqlite3")
+            first = DatabaseWrapper(dict(settings_dict), "first")
+            second = DatabaseWrapper(dict(settings_dict), "second")
+            try:
+                # ACT
+                with first.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    journal_mode = cursor.fetchone()[0]
+                # As atomic() does, the write lock is taken by BEGIN
+                first.write_intent = True
+                first.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True
+                )
+                # Other transactions are deferred, they can still read
+                second.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True
+                )
+                with second.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                second.set_autocommit(True)
+                second.write_intent = True
+                with self.assertRaises(OperationalError):
+                    second.set_autocommit(
+                        False, force_begin_transaction_with_broken_autocommit=True
+                    )
+            finally:
+                first.close()
+                second.close()
+
+        # ASSERT
+        self.assertEqual(journal_mode, "wal")
+
+
+@override_settings(WRITE_QUEUE=dict(settings.WRITE_QUEUE, ENABLED=True))
+class GroupCommitTestCase(TransactionTestCase):
+    def setUp(self):
+        self.listing = Listing.objects.create(title="listing", price=10, quantity=5)
+        self.user = User.objects.create(username="Pelloch", password="fake-password")
+        Merchant.objects.create(user=self.user)
+        token = Token.objects.create(user=self.user)
+        self.header = {"HTTP_AUTHORIZATION": "Token {}".format(token.key)}
+
+    def tearDown(self):
+        local_store.clear()
+
+    def test_orders_are_written_by_the_writer_thread(self):
+        # ACT
+        responses = [
+            self.client.post(
+                reverse("orders"),
+                data=json.dumps({"listings": self.listing.pk, "quantities": 3}),
+                content_type="application/json",
+                **self.header
+            )
+            for _ in range(2)
+        ]
+        missing = self.client.post(
+            reverse("orders"),
+            data=json.dumps({"listings": 10000, "quantities": 1}),
+            content_type="application/json",
+            **self.header
+        )
+
+        # ASSERT
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [status.HTTP_200_OK, status.HTTP_417_EXPECTATION_FAILED],
+        )
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).quantity, 2)
+        self.assertTrue(writes.write_queue.thread.is_alive())
+
+    @override_settings(WRITE_QUEUE=dict(settings.WRITE_QUEUE, ENABLED=False))
+    def test_only_write_transactions_begin_with_the_write_intent(self):
+        # ARRANGE
+        intents = []
+        begin = connection._start_transaction_under_autocommit
+
+        def start_transaction():
+            intents.append(connection.write_intent)
+            begin()
+
+        # ACT
+        with mock.patch.object(
+            connection, "_start_transaction_under_autocommit", start_transaction
+        ):
+            with transaction.atomic():
+                Listing.objects.count()
+            writes.write_queue.run(
+                lambda: Listing.objects.filter(pk=self.listing.pk).update(quantity=4)
+            )
+
+        # ASSERT
+        self.assertEqual(intents, [False, True])
+        self.assertFalse(connection.write_intent)
+
+
+class TrigramIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add(1, "Apple iPhone X 64Gb")
+        self.index.add(2, "Apple iPhone 12 Pro 128Gb")
+        self.index.add(3, "Samsung Galaxy S21")
+
+    def test_search_ranks_the_closest_names_first(self):
+        # ARRANGE
+
+        # ACT
+        matches = self.index.search("iphone x 64 GB unlocked", min_score=0.2)
+
+        # ASSERT
+        self.assertEqual([pk for pk, _, _ in matches], [1, 2])
+
+    def test_search_reflects_renamed_and_removed_products(self):
+        # ARRANGE
+        self.index.add(3, "Apple iPhone X 64Gb refurbished")
+        self.index.remove(1)
+
+        # ACT
+        matches = self.index.search("iphone x 64gb")
+
+        # ASSERT
+        self.assertEqual(matches[0][:2], (3, "Apple iPhone X 64Gb refurbished"))
+        self.assertNotIn(1, [pk for pk, _, _ in matches])
+
+    def test_search_returns_nothing_below_min_score(self):
+        # ARRANGE
+
+        # ACT
+        matches = self.index.search("nintendo switch", min_score=0.3)
+
+        # ASSERT
+        self.assertEqual(matches, [])
+
+    def test_search_finds_the_matches_of_an_exhaustive_search(self):
+        # ARRANGE
+        rng = random.Random(0)
+        index = TrigramIndex()
+        names = [bench_product_matching.product_name(rng) for _ in range(20000)]
+        for pk, name in enumerate(names, 1):
+            index.add(pk, name)
+        titles = [
+            bench_product_matching.listing_title(rng.choice(names), rng)
+            for _ in range(20)
+        ]
+
+        # ACT
+        results = [index.search(title) for title in titles]
+
+        # ASSERT
+        grams = [(pk, name, trigrams(name)) for pk, name in enumerate(names, 1)]
+        for title, result in zip(titles, results):
+            query = trigrams(title)
+            scored = [(pk, name, dice(query, other)) for pk, name, other in grams]
+            scored.sort(key=lambda match: (-match[2], match[0]))
+            self.assertEqual(
+                result, [match for match in scored[:10] if match[2] >= 0.3]
+            )
+
+
+class ProductMatchingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.iphone = Product.objects.create(name="Apple iPhone X 64Gb")
+        cls.galaxy = Product.objects.create(name="Samsung Galaxy S21 128Gb")
+        cls.listing = Listing.objects.create(
+            title="iPhone X 64 Gb - unlocked", price=350, quantity=3
+        )
+        Listing.objects.create(title="Galaxy S21 128Gb like new", price=420, quantity=1)
+        Listing.objects.create(title="Vintage record player", price=80, quantity=1)
+
+        cls.user = User.objects.create(username="Pelloch", password="fake-password")
+        Merchant.objects.create(user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.header = {"HTTP_AUTHORIZATION": "Token {}".format(cls.token.key)}
+
+    def setUp(self):
+        product_index.reload()
+
+    def tearDown(self):
+        # The index is process wide, next tests have their own catalog
+        product_index.loaded = False
+
+    def test_view_suggests_products_for_a_listing(self):
+        # ARRANGE
+        url = reverse("product-suggestions", kwargs={"pk": self.listing.pk})
+
+        # ACT
+        response = self.client.get(url, {"limit": 1}, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["id"], self.iphone.pk)
+
+    def test_saved_products_are_indexed_on_commit(self):
+        # ARRANGE
+        url = reverse("product-suggestions", kwargs={"pk": self.listing.pk})
+
+        # ACT
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="iPhone X 64Gb - unlocked")
+        response = self.client.get(url, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.data[0]["id"], product.pk)
+
+    @override_settings(
+        PRODUCT_MATCHING=dict(settings.PRODUCT_MATCHING, REFRESH_SECONDS=0)
+    )
+    def test_products_saved_by_other_processes_are_read_on_refresh(self):
+        # ARRANGE
+        url = reverse("product-suggestions", kwargs={"pk": self.listing.pk})
+        # Neither sends signals, as in another process
+        Product.objects.bulk_create([Product(name="iPhone X 64Gb - unlocked")])
+        Product.objects.filter(pk=self.galaxy.pk).update(
+            name="Apple iPhone X 64Gb unlocked", updated_date=timezone.now()
+        )
+
+        # ACT
+        response = self.client.get(url, {"limit": 2}, **self.header)
+
+        # ASSERT
+        self.assertEqual(
+            [match["name"] for match in response.data],
+            ["iPhone X 64Gb - unlocked", "Apple iPhone X 64Gb unlocked"],
+        )
+
+    def test_view_skips_products_deleted_by_other_processes(self):
+        # ARRANGE
+        url = reverse("product-suggestions", kwargs={"pk": self.listing.pk})
+        product_index.add(10**6, "iPhone X 64Gb - unlocked")
+
+        # ACT
+        response = self.client.get(url, **self.header)
+
+        # ASSERT
+        self.assertEqual(response.data[0]["id"], self.iphone.pk)
+
+    def test_command_attaches_best_matches(self):
+        # ARRANGE
+        out = StringIO()
+
+        # ACT
+        call_command("match_listings", "--attach", "--min-score=0.5", stdout=out)
+
+        # ASSERT
+        self.assertIn("2 listings matched, 2 attached", out.getvalue())
+        self.assertEqual(
+            Listing.objects.get(pk=self.listing.pk).product_id, self.iphone.pk
+        )
+        self.assertEqual(Listing.objects.filter(product__isnull=True).count(), 1)
+
+
+class WarmupTestCase(TestCase):
+    def tearDown(self):
+        # The index is process wide, next tests have their own catalog
+        product_index.loaded = False
+
+    def test_warm_up_runs_the_configured_steps(self):
+        # ARRANGE
+        product_index.loaded = False
+
+        # ACT
+        with self.assertLogs("myapp.warmup", "INFO"):
+            timings = warmup.warm_up()
+
+        # ASSERT
+        self.assertEqual(list(timings), settings.WARMUP["STEPS"])
+        # Left to the workers serving suggestions
+        self.assertFalse(product_index.loaded)
+
+    def test_failing_step_is_logged_and_skipped(self):
+        # ARRANGE
+        failing = mock.Mock(side_effect=OperationalError("database is down"))
+
+        # ACT
+        with mock.patch.dict(warmup.STEPS, database=failing):
+            with self.assertLogs("myapp.warmup", "ERROR") as logs:
+                timings = warmup.warm_up(["database", "matching"])
+
+        # ASSERT
+        failing.assert_called_once_with()
+        self.assertIn("Warm-up step database failed", logs.output[0])
+        self.assertEqual(list(timings), ["database", "matching"])
+        self.assertTrue(product_index.loaded)
+
+    @override_settings(WARMUP=dict(settings.WARMUP, ENABLED=False))
+    def test_disabled_warm_up_does_nothing(self):
+        # ARRANGE
+        product_index.loaded = False
+
+        # ACT
+        timings = warmup.warm_up()
+
+        # ASSERT
+        self.assertEqual(timings, {})
+        self.assertFalse(product_index.loaded)
@@ -0,0 +1,107 @@
+"""
+Per-merchant token bucket throttling.
+
+Each (endpoint scope, merchant) pair owns a bucket of `burst` tokens refilled at
+`rate` tokens per second. A write request takes one token, or is answered with
+429 and a Retry-After header when the bucket is empty. Checking a bucket is O(1)
+and happens in the DRF `initial()` hook, before the view touches the database.
+
+Buckets live in process memory by default. Setting MERCHANT_THROTTLE["STORE"]
+to "cache" shares them between workers through a Django cache; that store is
+best-effort (read-modify-write without a lock) but good enough for rate limiting.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+def refill(tokens, updated_at, now, rate, burst):
+    """Return the number of tokens in a bucket at `now`"""
+    return min(burst, tokens + (now - updated_at) * rate)
+
+
+def take(tokens, rate):
+    """Take one token. Returns (allowed, tokens left, seconds to wait)"""
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / rate
+
+
+class LocalBucketStore:
+    """Buckets kept in a dict of the current process"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, burst, now):
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            allowed, tokens, wait = take(tokens, rate)
+            self.buckets[key] = (tokens, now)
+        return allowed, wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """Buckets shared between processes through a Django cache"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def consume(self, key, rate, burst, now):
+        cache_key = "throttle:{}".format(key)
+        tokens, updated_at = self.cache.get(cache_key, (burst, now))
+        tokens = refill(tokens, updated_at, now, rate, burst)
+        allowed, tokens, wait = take(tokens, rate)
+        # A bucket left alone long enough is full again, no need to keep it
+        self.cache.set(cache_key, (tokens, now), int(burst / rate) + 1)
+        return allowed, wait
+
+
+local_store = LocalBucketStore()
+
+
+def get_store():
+    config = settings.MERCHANT_THROTTLE
+    if config.get("STORE") == "cache":
+        return CacheBucketStore(caches[config.get("CACHE", "default")])
+    return local_store
+
+
+class MerchantRateThrottle(BaseThrottle):
+    """
+    Throttle write requests per merchant and per endpoint.
+
+    The endpoint is given by the `throttle_scope` attribute of the view, its
+    (rate, burst) by MERCHANT_THROTTLE["RATES"][scope]. Merchants are identified
+    by their user, which token authentication already loaded.
+    """
+
+    def __init__(self):
+        self.wait_time = None
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS or not request.user.is_authenticated:
+            return True
+        scope = getattr(view, "throttle_scope", None)
+        rates = settings.MERCHANT_THROTTLE["RATES"]
+        if scope not in rates:
+            return True
+
+        rate, burst = rates[scope]
+        key = "{}:{}".format(scope, request.user.pk)
+        allowed, self.wait_time = get_store().consume(key, rate, burst, time.time())
+        return allowed
+
+    def wait(self):
+        return self.wait_time
@@ -0,0 +1,104 @@
+"""
+Datadog tracing of the order and catalog hot paths.
+
+Tracing is configured by the DDTRACE setting and disabled by default. While it
+is disabled `span()` returns a shared no-op context manager: ddtrace is never
+imported and no query counter is installed, so instrumented code pays a
+function call and nothing else.
+
+When enabled, ddtrace is imported on first use and spans are sent to the agent
+at DDTRACE["AGENT_URL"]. Every span gets a `db.query_count` metric with the
+number of queries run while it was open. Tests (or a custom writer) can swap
+the tracer with `set_tracer()`.
+"""
+
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+
+_tracer = None
+_configured = False
+
+
+class NoopSpan:
+    def set_tag(self, key, value):
+        pass
+
+    def set_metric(self, key, value):
+        pass
+
+
+class NoopContext:
+    span = NoopSpan()
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP = NoopContext()
+
+
+def load_tracer():
+    config = settings.DDTRACE
+    # ddtrace reads its agent URL from the environment when it is imported
+    os.environ.setdefault("DD_TRACE_AGENT_URL", config["AGENT_URL"])
+    try:
+        from ddtrace.trace import tracer
+    except ImportError:  # ddtrace < 3.0
+        from ddtrace import tracer
+    return tracer
+
+
+def get_tracer():
+    """Return the tracer in use, or None when tracing is disabled"""
+    global _tracer, _configured
+    if not _configured:
+        _tracer = load_tracer() if settings.DDTRACE["ENABLED"] else None
+        _configured = True
+    return _tracer
+
+
+def set_tracer(tracer):
+    """Use `tracer` instead of the ddtrace one, None disables tracing"""
+    global _tracer, _configured
+    _tracer, _configured = tracer, True
+
+
+@receiver(setting_changed)
+def reset_tracer(setting, **kwargs):
+    global _configured
+    if setting == "DDTRACE":
+        _configured = False
+
+
+def span(name, resource=None, **tags):
+    """Context manager tracing the block as a span named `name`"""
+    tracer = get_tracer()
+    if tracer is None:
+        return NOOP
+    return _traced(tracer, name, resource, tags)
+
+
+@contextmanager
+def _traced(tracer, name, resource, tags):
+    queries = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    with tracer.trace(
+        name, service=settings.DDTRACE["SERVICE"], resource=resource or name
+    ) as current:
+        for key, value in tags.items():
+            current.set_tag(key, value)
+        with connection.execute_wrapper(count_queries):
+            yield current
+        current.set_metric("db.query_count", queries[0])
@@ -3,7 +3,7 @@ from rest_framework.authtoken.views import obtain_auth_token
 
 from myapp import views
 
-from myapp.views import ProductViewSet, ListingViewSet, OrderAPIView
+from myapp.views import ProductViewSet, ListingViewSet, OrderAPIView, OrderViewSet
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -24,20 +24,60 @@ urlpatterns = [
         ListingViewSet.as_view({"get": "list", "post": "create"}),
         name="listing",
     ),
+    path(
+        "listing/top-sellers",
+        ListingViewSet.as_view({"get": "top_sellers"}),
+        name="top-sellers",
+    ),
+    path(
+        "listing/facets",
+        ListingViewSet.as_view({"get": "facets"}),
+        name="listing-facets",
+    ),
+    path(
+        "listing/attach-product",
+        ListingViewSet.as_view({"put": "bulk_attach_product"}),
+        name="bulk-attach-product",
+    ),
     path(
         "listing/<int:pk>",
         ListingViewSet.as_view({"get": "retrieve", "put": "update"}),
         name="single-listing",
     ),
+    path(
+        "listing/<int:pk>/price-history",
+        ListingViewSet.as_view({"get": "price_history"}),
+        name="listing-price-history",
+    ),
     path(
         "listing/<int:pk>/attach-product",
         ListingViewSet.as_view({"put": "attach_product"}),
         name="attach-product",
     ),
+    path(
+        "listing/<int:pk>/product-suggestions",
+        ListingViewSet.as_view({"get": "product_suggestions"}),
+        name="product-suggestions",
+    ),
     path(
         "orders/",
         OrderAPIView.as_view(),
         name="orders",
     ),
+    path(
+        "orders/cancel",
+        OrderViewSet.as_view({"post": "bulk_cancel"}),
+        name="cancel-orders",
+    ),
+    path(
+        "orders/<int:pk>/cancel",
+        OrderViewSet.as_view({"post": "cancel"}),
+        name="cancel-order",
+    ),
+    path(
+        "orders/<int:pk>/return",
+        OrderViewSet.as_view({"post": "return_lines"}),
+        name="return-order-lines",
+    ),
     path("api-token-auth/", obtain_auth_token, name="api_token_auth"),
 ]
@@ -1,20 +1,62 @@
-from django.http import HttpResponse
+import datetime
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import permissions, status
 from rest_framework import viewsets
 from rest_framework.generics import get_object_or_404, ListCreateAPIView
-from rest_framework.renderers import TemplateHTMLRenderer
+from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 
 
-from myapp.models import Product, Listing, Order, Merchant, OrderLine
+from myapp import (
+    archive,
+    catalog,
+    events,
+    order_pages,
+    price_history,
+    product_stats,
+    returns,
+    sales,
+    stock,
+    tracing,
+    webhooks,
+    writes,
+)
+from myapp.matching import product_index
+from myapp.models import (
+    Product,
+    Listing,
+    Order,
+    Merchant,
+    OrderLine,
+    ArchivedOrder,
+)
 from myapp.serializers import (
     ProductSerializer,
     ListingSerializer,
+    ListingFilterSerializer,
     AttachProductSerializer,
+    BulkAttachProductSerializer,
+    ProductSuggestionQuerySerializer,
+    TopSellersQuerySerializer,
+    PriceHistoryQuerySerializer,
     OrderSerializer,
+    ArchivedOrderSerializer,
+    OrderRangeSerializer,
+    OrderCursorField,
+    OrderLinesSerializer,
     OrderPushSerializer,
+    OrderCancelSerializer,
 )
+from myapp.throttling import MerchantRateThrottle
 
 
 # Create your views here.
@@ -31,20 +73,103 @@ class MyHTMLRenderer(TemplateHTMLRenderer):
     def get_template_context(self, *args, **kwargs):
         context = super().get_template_context(*args, **kwargs)
         if isinstance(context, list):
-            context = {"items": context}
+            merchant_id = context[0]["merchant"] if context else ""
+            context = {"orders": context, "merchant_id": merchant_id}
+        elif context is not None and "merchant" in context:
+            # A single order, e.g. the one just created
+            context = {"orders": [context], "merchant_id": context["merchant"]}
         return context
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class TracedListMixin:
+    """Trace the list action of a view as a span named `trace_name`, tagged
+    with `trace_tags()`"""
+
+    trace_name = None
+
+    def trace_tags(self):
+        return {"user.id": self.request.user.pk}
+
+    def list(self, request, *args, **kwargs):
+        with tracing.span(self.trace_name, resource=request.path, **self.trace_tags()):
+            return super().list(request, *args, **kwargs)
+
+
+class ProductViewSet(TracedListMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    trace_name = "product.list"
 
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(TracedListMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [MerchantRateThrottle]
+    throttle_scope = "listing"
+    trace_name = "listing.list"
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ("list", "facets"):
+            return queryset
+
+        # Filters are served by the (price, quantity) and (product, price, quantity) indexes
+        params = ListingFilterSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = params.validated_data
+
+        if "product" in filters:
+            queryset = queryset.filter(product_id=filters["product"])
+        if "min_price" in filters:
+            queryset = queryset.filter(price__gte=filters["min_price"])
+        if "max_price" in filters:
+            queryset = queryset.filter(price__lte=filters["max_price"])
+        if filters["in_stock"] is True:
+            queryset = queryset.filter(quantity__gt=0)
+        elif filters["in_stock"] is False:
+            queryset = queryset.filter(quantity__lte=0)
+
+        ordering = filters.get("ordering", "id")
+        # Tie-break on id so the order is stable between two calls
+        if ordering.lstrip("-") != "id":
+            return queryset.order_by(ordering, "id")
+        return queryset.order_by(ordering)
+
+    def facets(self, request, *args, **kwargs):
+        """Endpoint GET that returns the number of listings matching the filters,
+        how many are in stock and the counts by price bucket, in one query."""
+        buckets = settings.LISTING_PRICE_BUCKETS
+        bounds = list(zip(buckets, buckets[1:] + [None]))
+
+        aggregates = {
+            "count": Count("id"),
+            "in_stock": Count("id", filter=Q(quantity__gt=0)),
+        }
+        for ix, (low, high) in enumerate(bounds):
+            bucket_filter = Q(price__gte=low)
+            if high is not None:
+                bucket_filter &= Q(price__lt=high)
+            aggregates["bucket_{}".format(ix)] = Count("id", filter=bucket_filter)
+        result = self.get_queryset().aggregate(**aggregates)
+
+        price_buckets = [
+            {"min": low, "max": high, "count": result["bucket_{}".format(ix)]}
+            for ix, (low, high) in enumerate(bounds)
+        ]
+        return Response(
+            data={
+                "count": result["count"],
+                "in_stock": result["in_stock"],
+                "price_buckets": price_buckets,
+            }
+        )
+
+    def perform_create(self, serializer):
+        listing = serializer.save()
+        product_stats.listing_added(listing)
+        price_history.record({listing.pk: listing.price})
 
     def update(self, request, *args, **kwargs):
         # Get existing product
@@ -54,7 +179,7 @@ class ListingViewSet(viewsets.ModelViewSet):
         # Serialize input and check that request.data is valid
         serializer = ListingSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        data = serializer.data
+        data = serializer.validated_data
 
         # Return 400 if update want to update product
         # This feature is only handled by attach_product
@@ -62,13 +187,27 @@ class ListingViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         # Update all fields of the listing except the product
-        data["product"] = listing.product
-        for key in data:
-            setattr(listing, key, data[key])
-        listing.save()
+        data.pop("product", None)
+        listing = writes.write_queue.run(lambda: self.save_listing(listing.pk, data))
 
         return Response(data=ListingSerializer(listing).data)
 
+    @staticmethod
+    def save_listing(pk, data):
+        """Set the fields `data` of the listing, in the caller's transaction"""
+        # Read again under the write lock: orders may have sold stock since
+        listing = get_object_or_404(Listing.objects.select_for_update(), pk=pk)
+        old_price, old_quantity = listing.price, listing.quantity
+        for key in data:
+            setattr(listing, key, data[key])
+        # Setting the quantity receives (or writes off) stock
+        listing.stock_baseline = F("stock_baseline") + listing.quantity - old_quantity
+        listing.save(update_fields=[*data, "stock_baseline"])
+        product_stats.listing_updated(listing, old_price, old_quantity)
+        if listing.price != old_price:
+            price_history.record({listing.pk: listing.price})
+        return listing
+
     def attach_product(self, request, *args, **kwarg):
         """Endpoint PUT that allows attaching a product to a listing.
         Returns 400 if listing already has a product"""
@@ -79,54 +218,396 @@ class ListingViewSet(viewsets.ModelViewSet):
         serializer = AttachProductSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # Replace product of the listing by the product from the request
+        # Attach the product from the request, unless the listing already has one
         product = get_object_or_404(Product.objects, pk=serializer.data["product"])
+        attached = Listing.objects.filter(pk=listing.pk, product__isnull=True).update(
+            product=product
+        )
+        if not attached:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
         setattr(listing, "product", product)
+        product_stats.listing_added(listing)
 
         return Response(data=ListingSerializer(listing).data)
 
+    def product_suggestions(self, request, *args, **kwargs):
+        """Endpoint GET that returns the products whose name best matches the
+        title of the listing, with their similarity score. Matches are
+        approximate, see myapp.matching."""
+        listing = get_object_or_404(Listing.objects.only("title"), pk=self.kwargs["pk"])
+
+        serializer = ProductSuggestionQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        matches = product_index.search(listing.title, **serializer.validated_data)
+        # Products deleted by other processes are still in the index
+        existing = set(
+            Product.objects.filter(pk__in=[pk for pk, _, _ in matches]).values_list(
+                "pk", flat=True
+            )
+        )
+        matches = [match for match in matches if match[0] in existing]
+        return Response(
+            data=[
+                {"id": pk, "name": name, "score": round(score, 3)}
+                for pk, name, score in matches
+            ]
+        )
+
+    def price_history(self, request, *args, **kwargs):
+        """Endpoint GET that returns the prices of a listing over a range, by
+        buckets of the finest resolution still stored for the whole range"""
+        listing = get_object_or_404(Listing.objects, pk=self.kwargs["pk"])
+        serializer = PriceHistoryQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        resolution, rows = price_history.history(
+            listing.pk, params["since"], params["until"], params.get("resolution")
+        )
+        return Response(
+            data={
+                "listing": listing.pk,
+                "resolution": resolution,
+                "prices": [
+                    {
+                        "start": start,
+                        "min": str(low),
+                        "max": str(high),
+                        "last": str(last),
+                    }
+                    for start, low, high, last in rows
+                ],
+            }
+        )
+
+    def top_sellers(self, request, *args, **kwargs):
+        """Endpoint GET that returns the listings which sold the most items
+        during the last `window` (hour or day)"""
+        serializer = TopSellersQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        leaderboard = sales.leaderboards[serializer.validated_data["window"]]
+
+        top = leaderboard.get(serializer.validated_data["limit"])
+        return Response(
+            data=[{"listing": pk, "quantity": quantity} for pk, quantity in top]
+        )
+
+    def bulk_attach_product(self, request, *args, **kwargs):
+        """Endpoint PUT that attaches products to many listings at once.
+        Listings that already have a product are left untouched, the outcome
+        of every listing is returned."""
+        serializer = BulkAttachProductSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pairs = serializer.validated_data["pairs"]
+
+        outcomes = catalog.attach_products(pairs)
+
+        results = [
+            {"listing": listing, "product": pairs[listing], "status": outcome}
+            for listing, outcome in outcomes.items()
+        ]
+        attached = sum(
+            1 for outcome in outcomes.values() if outcome == catalog.ATTACHED
+        )
+        return Response(data={"attached": attached, "results": results})
+
 
-class OrderAPIView(ListCreateAPIView):
+class OrderAPIView(TracedListMixin, ListCreateAPIView):
     # Bonus : define a Get to see the list of orders of the authenticated merchant
     # Define a POST method to create an order with at least one orderline on existing listing
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
-    renderer_classes = [MyHTMLRenderer]
+    throttle_classes = [MerchantRateThrottle]
+    throttle_scope = "orders"
+    trace_name = "order.list"
+    # HTML by default, JSON for API clients asking for it (Accept or
+    # ?format=json)
+    renderer_classes = [MyHTMLRenderer, JSONRenderer]
     template_name = "myapp/orders.html"
 
     def get_queryset(self):
         """
-        This view should return a list of all the orders
-        for the currently authenticated merchant.
+        The orders of the authenticated merchant still in the hot tables, in
+        the requested range. list() adds the archived ones when the range
+        reaches before the archive horizon.
         """
-        merchant = get_object_or_404(Merchant.objects, user=self.request.user)
-        orders = Order.objects.filter(merchant=merchant)
+        orders = Order.objects.filter(merchant=self.get_merchant())
+        return self.filter_range(orders)
+
+    def get_merchant(self):
+        if not hasattr(self, "_merchant"):
+            self._merchant = get_object_or_404(Merchant.objects, user=self.request.user)
+        return self._merchant
+
+    def trace_tags(self):
+        return dict(super().trace_tags(), **{"merchant.id": self.get_merchant().pk})
+
+    def get_range(self):
+        if not hasattr(self, "_range"):
+            params = OrderRangeSerializer(data=self.request.query_params)
+            params.is_valid(raise_exception=True)
+            self._range = params.validated_data
+        return self._range
+
+    def filter_range(self, orders):
+        if "since" in self.get_range():
+            orders = orders.filter(creation_date__gte=self.get_range()["since"])
+        if "until" in self.get_range():
+            orders = orders.filter(creation_date__lte=self.get_range()["until"])
+        if "after" in self.get_range():
+            # Orders after (date, pk), the range on received_date alone is
+            # served by the (merchant, received_date, id) index
+            date, pk = self.get_range()["after"]
+            orders = orders.filter(received_date__gte=date).exclude(
+                received_date=date, id__lte=pk
+            )
         return orders
 
-    def create(self, request, *args, **kwargs):
-        # Serialize the request.data
-        serializer = OrderPushSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+    def get_archive_queryset(self):
+        return self.filter_range(
+            ArchivedOrder.objects.filter(merchant=self.get_merchant())
+        )
+
+    def list(self, request, *args, **kwargs):
+        """Orders still in the hot tables, and the archived ones unless `since`
+        is after the archive horizon, by id"""
+        needs_archive = archive.needs_archive(self.get_range().get("since"))
+        if self.asks_for_html(request):
+            return self.stream_html(needs_archive)
+        if "after" in self.get_range() or "limit" in self.get_range():
+            return self.list_page()
 
-        # Create the Order
-        order = Order.objects.create(
-            merchant=get_object_or_404(Merchant.objects, user=self.request.user),
-            creation_date=serializer.data["creation_date"],
+        response = super().list(request, *args, **kwargs)
+        if not needs_archive:
+            return response
+
+        with tracing.span("order.archive_read", resource=request.path):
+            archived = self.get_archive_queryset()
+            response.data = sorted(
+                ArchivedOrderSerializer(archived, many=True).data + response.data,
+                key=lambda order: order["id"],
+            )
+        return response
+
+    @staticmethod
+    def asks_for_html(request):
+        """Browsers (Accept: text/html) and ?format=html get the streamed page,
+        other clients the HTML of the renderer"""
+        if request.accepted_renderer.format != "html":
+            return False
+        if request.query_params.get("format") == "html":
+            return True
+        return "text/html" in request.META.get("HTTP_ACCEPT", "")
+
+    def list_page(self):
+        """One page of orders by (received_date, id), for incremental syncs.
+        The X-Next-Cursor header gives the `after` of the next page."""
+        limit = self.get_range().get("limit", settings.ORDER_SYNC["LIMIT"])
+        # An order commits a little after its received date is set: the
+        # youngest ones are left to the next page, so that a cursor never
+        # skips one
+        settled = timezone.now() - datetime.timedelta(
+            seconds=settings.ORDER_SYNC["DELAY"]
         )
+        # Orders are archived by creation date, any page may hold archived
+        # ones. Both reads are served by their sync index.
+        querysets = [self.get_queryset(), self.get_archive_queryset()]
+
+        with tracing.span(
+            "order.sync", resource=self.request.path, **self.trace_tags()
+        ) as span:
+            pages = [
+                queryset.filter(received_date__lt=settled).order_by(
+                    "received_date", "id"
+                )[:limit]
+                for queryset in querysets
+            ]
+            orders = list(
+                islice(
+                    heapq.merge(*pages, key=attrgetter("received_date", "pk")), limit
+                )
+            )
+            span.set_metric("order.count", len(orders))
+
+        data = [
+            (
+                ArchivedOrderSerializer(order).data
+                if isinstance(order, ArchivedOrder)
+                else OrderSerializer(order).data
+            )
+            for order in orders
+        ]
+        response = Response(data=data)
+        cursor = self.get_range().get("after")
+        if orders:
+            cursor = (orders[-1].received_date, orders[-1].pk)
+        if cursor is not None:
+            response["X-Next-Cursor"] = OrderCursorField().to_representation(cursor)
+        return response
+
+    def stream_html(self, needs_archive):
+        """Stream the orders page, rows are rendered chunk by chunk and cached"""
+        merchant = self.get_merchant()
+        querysets = [self.get_queryset()]
+        if needs_archive:
+            querysets.append(self.get_archive_queryset())
+        return StreamingHttpResponse(
+            order_pages.stream_page(merchant.pk, querysets),
+            content_type="text/html; charset=utf-8",
+        )
+
+    def create(self, request, *args, **kwargs):
+        with tracing.span("order.create", resource="POST orders/") as root:
+            # Serialize the request.data, duplicated listings are merged
+            with tracing.span("order.parse"):
+                serializer = OrderPushSerializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
+                lines = dict(
+                    zip(
+                        serializer.validated_data["listings"],
+                        serializer.validated_data["quantities"],
+                    )
+                )
+            merchant = self.get_merchant()
+            root.set_tag("merchant.id", merchant.pk)
+            root.set_metric("order.lines", len(lines))
+
+            # Order and stock writes go through the write queue, see myapp.writes
+            return writes.write_queue.run(
+                lambda: self.place_order(
+                    merchant, lines, serializer.validated_data["creation_date"]
+                )
+            )
+
+    def place_order(self, merchant, lines, creation_date):
+        """Write the order and decrement the stock, in the caller's transaction"""
+        # Check that every listings exist and that quantities are sufficient
+        with tracing.span("order.stock_check"):
+            listings = Listing.objects.in_bulk(list(lines))
+            stock_deltas = {}
+            for pk, quantity in lines.items():
+                listing = listings.get(pk)
+                if listing is None:
+                    raise Http404
+                if quantity > listing.quantity:
+                    return Response(status=status.HTTP_417_EXPECTATION_FAILED)
+                stock_deltas[listing.product_id] = (
+                    stock_deltas.get(listing.product_id, 0) - quantity
+                )
 
-        for ix, pk in enumerate(serializer.data["listings"]):
-            # Check that every listings exist and that quantities are sufficient
-            listing = get_object_or_404(Listing.objects, pk=pk)
-            quantity = serializer.data["quantities"][ix]
-            if quantity > listing.quantity:
+        # Create the Order and the associated OrderLines, with the prices
+        # of the listings read above so that repricing doesn't change them
+        with tracing.span("order.line_insert"):
+            order = Order.objects.create(
+                merchant=merchant,
+                creation_date=creation_date,
+                total=sum(
+                    listings[pk].price * quantity for pk, quantity in lines.items()
+                ),
+            )
+            OrderLine.objects.bulk_create(
+                [
+                    OrderLine(
+                        order=order,
+                        listing_id=pk,
+                        quantity=quantity,
+                        unit_price=listings[pk].price,
+                    )
+                    for pk, quantity in lines.items()
+                ],
+                batch_size=1000,
+            )
+
+        # Then decrement the quantity on the listings, the stock may have
+        # been sold concurrently since it was checked
+        with tracing.span("order.stock_decrement"):
+            if not stock.decrement(lines):
+                transaction.set_rollback(True)
                 return Response(status=status.HTTP_417_EXPECTATION_FAILED)
+            product_stats.stock_changed(stock_deltas)
+            events.bus.publish_on_commit(lines)
+
+        # Count the sales for the top sellers leaderboards, at the server
+        # time: creation_date is sent by the client
+        with tracing.span("order.sales"):
+            sales.record(lines)
+
+        # Notify the merchant once committed, without waiting for it
+        with tracing.span("order.outbox"):
+            webhooks.enqueue(
+                merchant.pk,
+                webhooks.ORDER_PLACED,
+                {
+                    "order": order.pk,
+                    "creation_date": order.creation_date,
+                    "total": order.total,
+                    "lines": [
+                        {
+                            "listing": pk,
+                            "quantity": quantity,
+                            "unit_price": listings[pk].price,
+                        }
+                        for pk, quantity in lines.items()
+                    ],
+                },
+            )
+
+        return Response(data=OrderSerializer(order).data)
+
 
-            # Then create the associated OrderLines
-            OrderLine.objects.create(order=order, listing=listing, quantity=quantity)
+class OrderViewSet(viewsets.GenericViewSet):
+    """Cancellations and returns on the orders of the authenticated merchant"""
+
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [MerchantRateThrottle]
+    throttle_scope = "orders"
+
+    def get_queryset(self):
+        merchant = get_object_or_404(Merchant.objects, user=self.request.user)
+        return Order.objects.filter(merchant=merchant)
 
-            # Then decrement the quantity on the listing
-            new_quantity = listing.quantity - quantity
-            setattr(listing, "quantity", new_quantity)
-            listing.save()
+    def cancel(self, request, *args, **kwargs):
+        """Endpoint POST that cancels an order and restocks all its lines.
+        Returns 400 if the order is already cancelled"""
+        order = self.get_object()
+        if order.status == Order.CANCELLED:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        cancelled = writes.write_queue.run(
+            lambda: returns.cancel_orders(Order.objects.filter(pk=order.pk))
+        )
+        if not cancelled:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        order.refresh_from_db(fields=["status"])
+        return Response(data=OrderSerializer(order).data)
+
+    def bulk_cancel(self, request, *args, **kwargs):
+        """Endpoint POST that cancels many orders at once, e.g. a fraud sweep.
+        Orders already cancelled or of other merchants are ignored"""
+        serializer = OrderCancelSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        orders = self.get_queryset().filter(pk__in=serializer.validated_data["orders"])
+        cancelled = writes.write_queue.run(lambda: returns.cancel_orders(orders))
+        return Response(data={"cancelled": cancelled})
+
+    def return_lines(self, request, *args, **kwargs):
+        """Endpoint POST that returns some items of an order and restocks them.
+        Returns 400 if more items are returned than were ordered"""
+        order = self.get_object()
+        serializer = OrderLinesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quantities = dict(
+            zip(
+                serializer.validated_data["listings"],
+                serializer.validated_data["quantities"],
+            )
+        )
 
+        try:
+            writes.write_queue.run(lambda: returns.return_lines(order, quantities))
+        except returns.ReturnError as error:
+            return Response(
+                data={"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(data=OrderSerializer(order).data)
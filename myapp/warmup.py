@@ -0,0 +1,120 @@
+"""
+Warm-up of a new worker process, before it serves its first request.
+
+wsgi.py and asgi.py call `warm_up()` once the application is built. Django and
+DRF build most of their per-process structures lazily, so without it the first
+requests of every new worker pay for them. The steps available are:
+
+- urls: the URL resolver, populated and its patterns compiled on first use;
+- serializers: the fields of every serializer of myapp.serializers, which
+  fills the model _meta caches DRF introspects, and imports the modules DRF
+  only loads when it first builds a field;
+- templates: the templates of myapp, compiled once by the cached loader
+  (used when DEBUG is off);
+- database: the connection of this thread, kept open across requests for
+  CONN_MAX_AGE seconds;
+- matching: the product matching index, read from the database on first use;
+- tracing: ddtrace, only imported when DDTRACE is enabled.
+
+wsgi.py and asgi.py run the steps of WARMUP["STEPS"]. A failing step is logged
+and skipped: a worker still starts, e.g. while the database is down.
+
+"database" and "matching" are not run at import. Under gunicorn --preload the
+application is imported before the workers are forked, and they would share
+the connection opened there. Under ASGI or threaded workers, requests do not
+use the connection of the importing thread. The matching index only pays off
+in the workers serving product suggestions. Run them from a post-fork hook
+where they help, e.g. in gunicorn.conf.py:
+
+    def post_fork(server, worker):
+        from myapp.warmup import warm_up
+        warm_up(["database", "matching"])
+"""
+
+import inspect
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.template.loader import get_template
+from django.urls import get_resolver, resolve, reverse
+
+logger = logging.getLogger(__name__)
+
+
+def warm_urls():
+    # Populating the reverse dict compiles every pattern
+    get_resolver().reverse_dict
+    resolve(reverse("orders"))
+
+
+def warm_serializers():
+    from rest_framework.serializers import BaseSerializer
+
+    from myapp import serializers
+
+    for serializer_class in vars(serializers).values():
+        if (
+            inspect.isclass(serializer_class)
+            and issubclass(serializer_class, BaseSerializer)
+            and serializer_class.__module__ == serializers.__name__
+        ):
+            # Built on first access
+            serializer_class().fields
+
+
+def warm_templates():
+    directory = os.path.join(apps.get_app_config("myapp").path, "templates")
+    for root, _, files in os.walk(directory):
+        for name in files:
+            get_template(os.path.relpath(os.path.join(root, name), directory))
+
+
+def warm_database():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def warm_matching():
+    from myapp.matching import product_index
+
+    product_index.ensure_loaded()
+
+
+def warm_tracing():
+    from myapp import tracing
+
+    tracing.get_tracer()
+
+
+STEPS = {
+    "urls": warm_urls,
+    "serializers": warm_serializers,
+    "templates": warm_templates,
+    "database": warm_database,
+    "matching": warm_matching,
+    "tracing": warm_tracing,
+}
+
+
+def warm_up(steps=None):
+    """Run `steps`, WARMUP["STEPS"] by default, returns {step: seconds}"""
+    timings = {}
+    if not settings.WARMUP["ENABLED"]:
+        return timings
+    for name in settings.WARMUP["STEPS"] if steps is None else steps:
+        start = time.perf_counter()
+        try:
+            STEPS[name]()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+        timings[name] = time.perf_counter() - start
+    logger.info(
+        "Worker warmed up in %.0f ms: %s",
+        sum(timings.values()) * 1000,
+        ", ".join("{} {:.0f} ms".format(k, v * 1000) for k, v in timings.items()),
+    )
+    return timings
@@ -0,0 +1,252 @@
+"""
+Merchant webhooks, delivered through an outbox.
+
+`enqueue()` writes one OutboxEvent per active endpoint of the merchant in the
+transaction of the change it describes: an event exists if and only if the
+change was committed, and checkout never waits on a remote call.
+
+The dispatch_webhooks command runs a Dispatcher, which posts the due events of
+every endpoint in batches of WEBHOOKS["BATCH_SIZE"] over kept-alive
+connections, and retries a failed batch with exponential backoff and jitter.
+Delivery is at least once, an endpoint may get an event again if a response is
+lost, so receivers dedupe on the event id. One dispatcher process is expected.
+It also purges the delivered events older than WEBHOOKS["RETENTION_DAYS"], when
+it starts then every WEBHOOKS["PURGE_INTERVAL"] seconds.
+"""
+
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Min
+from django.utils import timezone
+
+from myapp import tracing
+from myapp.models import OutboxEvent, WebhookEndpoint
+
+ORDER_PLACED = "order.placed"
+
+
+def enqueue(merchant_id, event_type, payload):
+    endpoints = WebhookEndpoint.objects.filter(merchant_id=merchant_id, is_active=True)
+    OutboxEvent.objects.bulk_create(
+        [
+            OutboxEvent(endpoint_id=pk, type=event_type, payload=payload)
+            for pk in endpoints.values_list("pk", flat=True)
+        ]
+    )
+
+
+def purge(before):
+    """Delete the events delivered before `before`"""
+    return OutboxEvent.objects.filter(delivered_at__lt=before).delete()[0]
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, after `attempts` failed ones"""
+    config = settings.WEBHOOKS
+    delay = min(config["BACKOFF_MAX"], config["BACKOFF_BASE"] ** attempts)
+    # Jitter so that the batches failed together are not retried together
+    return delay * random.uniform(0.5, 1)
+
+
+class ConnectionPool:
+    """Kept-alive HTTP connections, one per scheme and host"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.connections = {}
+
+    def post(self, url, body, headers):
+        """POST `body` to `url` and return the response status"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        reused = key in self.connections
+        try:
+            return self.request(key, path, body, headers)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server may close an idle connection at any time, try a new one
+            if not reused:
+                raise
+            return self.request(key, path, body, headers)
+
+    def request(self, key, path, body, headers):
+        connection = self.connections.get(key)
+        if connection is None:
+            scheme, netloc = key
+            connection_class = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            connection = connection_class(netloc, timeout=self.timeout)
+            self.connections[key] = connection
+
+        try:
+            connection.request("POST", path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.drop(key)
+            raise
+        if response.will_close:
+            self.drop(key)
+        return response.status
+
+    def drop(self, key):
+        connection = self.connections.pop(key, None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        for key in list(self.connections):
+            self.drop(key)
+
+
+class Dispatcher:
+    def __init__(self):
+        self.pool = ConnectionPool(settings.WEBHOOKS["TIMEOUT"])
+        # time.monotonic() of the last purge
+        self.purged_at = None
+
+    def dispatch(self):
+        """Deliver the due events, by batches per endpoint. Returns the number
+        of delivered and failed events, and the largest delivery lag (time
+        between the creation and the delivery of an event) in seconds."""
+        now = timezone.now()
+        stats = {"delivered": 0, "failed": 0, "lag": 0.0}
+        with tracing.span("webhook.dispatch") as span:
+            events = list(
+                OutboxEvent.objects.filter(next_attempt_at__lte=now)
+                .select_related("endpoint")
+                .order_by("pk")[: settings.WEBHOOKS["MAX_EVENTS"]]
+            )
+            batches = {}
+            for event in events:
+                batches.setdefault(event.endpoint_id, []).append(event)
+
+            size = settings.WEBHOOKS["BATCH_SIZE"]
+            for endpoint_events in batches.values():
+                for start in range(0, len(endpoint_events), size):
+                    batch = endpoint_events[start : start + size]
+                    error = self.deliver(batch[0].endpoint, batch)
+                    delivered_at = timezone.now()
+                    if error is None:
+                        self.mark_delivered(batch, delivered_at)
+                        stats["delivered"] += len(batch)
+                        lag = delivered_at - min(event.created_at for event in batch)
+                        stats["lag"] = max(stats["lag"], lag.total_seconds())
+                    else:
+                        self.mark_failed(batch, error, delivered_at)
+                        stats["failed"] += len(batch)
+
+            span.set_metric("webhook.delivered", stats["delivered"])
+            span.set_metric("webhook.failed", stats["failed"])
+            span.set_metric("webhook.delivery_lag_ms", stats["lag"] * 1000)
+        return stats
+
+    def deliver(self, endpoint, events):
+        """Post a batch of events, returns None or the error"""
+        if not endpoint.is_active:
+            return "endpoint disabled"
+        body = json.dumps(
+            {
+                "events": [
+                    {
+                        "id": event.pk,
+                        "type": event.type,
+                        "created_at": event.created_at,
+                        "data": event.payload,
+                    }
+                    for event in events
+                ]
+            },
+            cls=DjangoJSONEncoder,
+        ).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Signature": "sha256=" + sign(endpoint.secret, body),
+        }
+        try:
+            status = self.pool.post(endpoint.url, body, headers)
+        except (OSError, http.client.HTTPException) as error:
+            return repr(error)
+        if not 200 <= status < 300:
+            return "HTTP {}".format(status)
+        return None
+
+    @staticmethod
+    def mark_delivered(events, now):
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            attempts=F("attempts") + 1,
+            next_attempt_at=None,
+            delivered_at=now,
+            last_error="",
+        )
+
+    @staticmethod
+    def mark_failed(events, error, now):
+        pks = [event.pk for event in events]
+        attempts = max(event.attempts for event in events) + 1
+        OutboxEvent.objects.filter(pk__in=pks).update(
+            attempts=F("attempts") + 1,
+            next_attempt_at=now + datetime.timedelta(seconds=backoff(attempts)),
+            last_error=error[:200],
+        )
+        # Give up on the events which failed too many times
+        OutboxEvent.objects.filter(
+            pk__in=pks, attempts__gte=settings.WEBHOOKS["MAX_ATTEMPTS"]
+        ).update(next_attempt_at=None)
+
+    def backlog_lag(self):
+        """Age in seconds of the oldest event waiting for delivery"""
+        oldest = OutboxEvent.objects.filter(next_attempt_at__isnull=False).aggregate(
+            oldest=Min("created_at")
+        )["oldest"]
+        if oldest is None:
+            return 0.0
+        return (timezone.now() - oldest).total_seconds()
+
+    def purge_delivered(self):
+        """Purge the delivered events past the retention, at most once per
+        PURGE_INTERVAL. Returns the number of purged events."""
+        config = settings.WEBHOOKS
+        now = time.monotonic()
+        if (
+            self.purged_at is not None
+            and now - self.purged_at < config["PURGE_INTERVAL"]
+        ):
+            return 0
+        self.purged_at = now
+        retention = datetime.timedelta(days=config["RETENTION_DAYS"])
+        return purge(timezone.now() - retention)
+
+    def run(self, interval, stop=lambda: False):
+        """Dispatch until `stop()` returns True, waiting `interval` seconds
+        when there was nothing to deliver. Yields the stats of every round."""
+        try:
+            while not stop():
+                purged = self.purge_delivered()
+                stats = self.dispatch()
+                stats["purged"] = purged
+                stats["backlog_lag"] = self.backlog_lag()
+                yield stats
+                if not stats["delivered"] and not stats["failed"]:
+                    time.sleep(interval)
+        finally:
+            self.pool.close()
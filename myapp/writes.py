@@ -0,0 +1,126 @@
+"""
+Group commit of the order and stock writes.
+
+SQLite has a single writer: concurrent write transactions queue on its lock,
+and every commit pays for its own fsync. With WRITE_QUEUE["ENABLED"], `run()`
+hands its job to one writer thread per process instead. The writer takes the
+jobs waiting together, up to BATCH_SIZE, runs them in one transaction, each in
+its own savepoint, and commits once for all of them. Requests of a process
+then never compete for the lock, and a busy minute costs a few commits per
+second rather than one per request.
+
+A failing job only rolls back its savepoint, and its caller gets the
+exception. Callers block until the batch is committed, so a response is never
+sent for a write that could still be lost. on_commit callbacks run in the
+writer thread, after the batch is committed. Spans opened by a job are traced
+in the writer thread, not under the span of the request.
+
+Disabled, `run()` runs the job in its own transaction in the calling thread.
+
+Both open their transactions with `write_transaction()`, which SQLite begins
+with the write lock (see myapp.sqlite). Other transactions, e.g. the reads of
+audit_stock, stay deferred and run concurrently.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from myapp import tracing
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def write_transaction():
+    """atomic() for transactions which write, taking the SQLite write lock
+    when they begin"""
+    connection.write_intent = True
+    try:
+        with transaction.atomic():
+            # Only the outermost BEGIN, not the transactions of on_commit hooks
+            connection.write_intent = False
+            yield
+    finally:
+        connection.write_intent = False
+
+
+class WriteQueue:
+    def __init__(self):
+        self.jobs = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def run(self, job):
+        """Run `job()` in a transaction and return its result"""
+        if not settings.WRITE_QUEUE["ENABLED"]:
+            with write_transaction():
+                return job()
+
+        future = Future()
+        self.start()
+        self.jobs.put((job, future))
+        return future.result()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.work, name="write-queue", daemon=True
+                )
+                self.thread.start()
+
+    def work(self):
+        while True:
+            batch = self.take()
+            try:
+                self.commit(batch)
+            except Exception:
+                logger.exception("Cannot run a batch of %d writes", len(batch))
+            finally:
+                connection.close_if_unusable_or_obsolete()
+
+    def take(self):
+        """Wait for a job, then take the ones queued within MAX_WAIT seconds"""
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + settings.WRITE_QUEUE["MAX_WAIT"]
+        while len(batch) < settings.WRITE_QUEUE["BATCH_SIZE"]:
+            try:
+                batch.append(self.jobs.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def commit(self, batch):
+        """Run the jobs of `batch` in one transaction and settle their futures"""
+        outcomes = []
+        try:
+            with tracing.span("db.group_commit") as span:
+                span.set_metric("db.batch_size", len(batch))
+                with write_transaction():
+                    for job, future in batch:
+                        try:
+                            with transaction.atomic():
+                                outcomes.append((future, job(), None))
+                        except Exception as error:
+                            outcomes.append((future, None, error))
+        except Exception as error:
+            # The commit failed, so did every job
+            for _, future in batch:
+                future.set_exception(error)
+            raise
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+write_queue = WriteQueue()
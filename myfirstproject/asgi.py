@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myfirstproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, it uses the models
+from myapp.sse import ListingEventsApp  # noqa: E402
+from myapp.warmup import warm_up  # noqa: E402
+
+# Server-sent events of listing changes are streamed outside of Django views
+application = ListingEventsApp(django_application)
+
+# Build what the first requests would otherwise build lazily
+warm_up()
@@ -9,11 +9,11 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +52,7 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "myapp.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -60,6 +61,135 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Response compression (gzip, or brotli when the package is installed)
+# Compressed bodies are kept in the cache so hot pages are compressed once
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CACHE = "default"
+COMPRESSION_CACHE_TIMEOUT = 300
+
+# Lower bounds of the price buckets returned by the listing facets endpoint
+
+LISTING_PRICE_BUCKETS = [0, 50, 100, 250, 500, 1000]
+
+# Per-merchant throttling of write requests: (tokens per second, burst) per endpoint
+# Buckets are kept in process memory ("local") or shared through a cache ("cache")
+
+MERCHANT_THROTTLE = {
+    "STORE": "local",
+    "CACHE": "default",
+    "RATES": {
+        "orders": (10, 50),
+        "listing": (20, 100),
+    },
+}
+
+# Datadog tracing of the order and catalog endpoints, see myapp.tracing
+
+DDTRACE = {
+    "ENABLED": os.getenv("DDTRACE_ENABLED", "") == "true",
+    "SERVICE": "myapp",
+    "AGENT_URL": os.getenv("DD_TRACE_AGENT_URL", "http://localhost:8126"),
+}
+
+# Server-sent events of listing changes (ASGI only): at most RATE events per
+# second per listing, a keepalive comment every KEEPALIVE seconds when idle
+LISTING_EVENTS = {
+    "RATE": 2,
+    "KEEPALIVE": 15,
+    "MAX_LISTINGS": 100,
+}
+
+# Orders older than AGE_DAYS are moved to the archive tables by the
+# archive_orders command, CHUNK_SIZE orders per transaction
+ORDER_ARCHIVE = {
+    "AGE_DAYS": 365,
+    "CHUNK_SIZE": 1000,
+}
+
+# HTML orders page: orders read CHUNK_SIZE at a time, rendered rows cached in
+# the CACHE cache
+ORDER_PAGE = {
+    "CHUNK_SIZE": 500,
+    "CACHE": "order_rows",
+    "CACHE_TIMEOUT": 24 * 3600,
+}
+
+# Incremental sync of the orders: pages of LIMIT orders by default, orders
+# younger than DELAY seconds are left to the next page
+ORDER_SYNC = {
+    "LIMIT": 500,
+    "MAX_LIMIT": 5000,
+    "DELAY": 5,
+}
+
+# Product matching index of each process: products added or renamed by the
+# other processes are read every REFRESH_SECONDS, those saved up to DELAY
+# seconds before the last read being read again
+PRODUCT_MATCHING = {
+    "REFRESH_SECONDS": 10,
+    "DELAY": 5,
+}
+
+# Listing price history: changes older than RAW_DAYS are compacted into
+# hourly buckets, hourly buckets older than HOURLY_DAYS into daily ones, by the
+# compact_price_history command
+PRICE_HISTORY = {
+    "RAW_DAYS": 7,
+    "HOURLY_DAYS": 90,
+    "CHUNK_SIZE": 1000,
+    "DEFAULT_DAYS": 30,
+}
+
+# Admin lists: filtered lists are counted up to COUNT_LIMIT rows, whole tables
+# larger than that are counted from the database statistics (ANALYZE)
+ADMIN_PAGINATION = {
+    "COUNT_LIMIT": 10000,
+}
+
+# Warm-up of new workers by wsgi.py and asgi.py, see myapp.warmup. The
+# "database" and "matching" steps are left to post-fork hooks.
+WARMUP = {
+    "ENABLED": True,
+    "STEPS": ["urls", "serializers", "templates", "tracing"],
+}
+
+# Order and stock writes: with ENABLED, one writer thread per process commits
+# up to BATCH_SIZE of them together, waiting up to MAX_WAIT seconds for more
+# once it has one, see myapp.writes
+WRITE_QUEUE = {
+    "ENABLED": False,
+    "BATCH_SIZE": 50,
+    "MAX_WAIT": 0.002,
+}
+
+# Merchant webhooks delivered by the dispatch_webhooks command, retried after
+# min(BACKOFF_BASE ** attempts, BACKOFF_MAX) seconds (with jitter). Delivered
+# events are kept RETENTION_DAYS, purged every PURGE_INTERVAL seconds
+WEBHOOKS = {
+    "BATCH_SIZE": 100,
+    "MAX_EVENTS": 1000,
+    "TIMEOUT": 5,
+    "MAX_ATTEMPTS": 10,
+    "BACKOFF_BASE": 2,
+    "BACKOFF_MAX": 3600,
+    "POLL_INTERVAL": 1,
+    "RETENTION_DAYS": 7,
+    "PURGE_INTERVAL": 3600,
+}
+
+# Top sellers leaderboards: sales are counted by buckets of BUCKET_SECONDS,
+# the top K listings of each window are refreshed every REFRESH_SECONDS. Rows
+# written in the last DELAY seconds are read again, their writes may not be
+# committed yet.
+TOP_SELLERS = {
+    "BUCKET_SECONDS": 300,
+    "WINDOWS": {"hour": 3600, "day": 24 * 3600},
+    "K": 100,
+    "REFRESH_SECONDS": 10,
+    "DELAY": 5,
+}
+
 ROOT_URLCONF = "myfirstproject.urls"
 
 TEMPLATES = [
@@ -86,12 +216,42 @@ WSGI_APPLICATION = "myfirstproject.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        # sqlite3 with WAL, a busy timeout and BEGIN IMMEDIATE for the writes of
+        # myapp.writes, see myapp.sqlite
+        "ENGINE": "myapp.sqlite",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections open between requests, see myapp.warmup
+        "CONN_MAX_AGE": 60,
+        "OPTIONS": {
+            "write_transaction_mode": "IMMEDIATE",
+            "pragmas": {
+                "journal_mode": "WAL",
+                "synchronous": "NORMAL",
+                "busy_timeout": 20000,
+            },
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Rendered rows of the orders page, one entry per order: sized for the
+    # history of large merchants. Use a shared backend (e.g. Memcached) so
+    # that the workers share the rows.
+    "order_rows": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "order-rows",
+        "OPTIONS": {"MAX_ENTRIES": 200_000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
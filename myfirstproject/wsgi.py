@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myfirstproject.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up
+from myapp.warmup import warm_up  # noqa: E402
+
+# Build what the first requests would otherwise build lazily
+warm_up()